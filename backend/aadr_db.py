@@ -10,8 +10,11 @@ Parsii .anno-tiedoston ja tarjoaa:
   get_oldest_sample(haplogroup, lineage)        → vanhin tunnettu näyte
   get_samples_by_region(haplogroup, country)    → aluesuodatus
   get_clade_tree_samples(prefix, lineage)       → koko kladipuun näytteet
+  iter_clade_tree_samples(prefix, lineage)      → sama laiskana iteraattorina (vienti)
   get_sample_count(haplogroup, lineage)         → näytemäärä
   list_available_clades(lineage)                → kaikki kladit järjestettyinä
+  get_geo_points(bbox, haplogroup, lineage)     → kartan näytteet alueelta
+  preload()                                     → indeksin lataus käynnistyksessä
 
 v62 vs v54.1 pääerot:
   - Näytteitä: 21 945 (v62) vs 9 253 (v54.1)
@@ -20,7 +23,11 @@ v62 vs v54.1 pääerot:
   - Date-sarake: eri pitkä nimi (havaitaan automaattisesti)
 
 Ympäristömuuttujat:
-  AADR_ANNO_PATH  — polku .anno-tiedostoon (oletus: v62_0_HO_public.anno)
+  AADR_ANNO_PATH      — polku .anno-tiedostoon (oletus: v62_0_HO_public.anno)
+  AADR_SNAPSHOT_PATH  — parsitun indeksin binäärivedos (oletus: <anno>.kshm.snap,
+                        tyhjä arvo = ei vedosta). Ks. aadr_snapshot.py.
+  AADR_PARSE_WORKERS  — .anno-parsinnan prosessimäärä (oletus: CPU-ytimet;
+                        1 = yksi prosessi). Alle 8 Mt tiedostot parsitaan aina suoraan.
 
 Käyttö:
   from aadr_db import get_nearest_samples
@@ -30,10 +37,24 @@ Käyttö:
 
 from __future__ import annotations
 import csv
+import heapq
+import io
+import math
+import multiprocessing
 import os
+import sys
+import threading
 import logging
+from array import array
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from aadr_snapshot import INT32_NONE, load_snapshot, write_snapshot
+from geo_index import WORLD, BBox, GeoGrid, bp_range, bp_within, in_bbox
+from haplo_index import HaplogroupTrie
+from haplo_normalize import canonical_id
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +63,14 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 
 DEFAULT_ANNO_PATH = os.getenv("AADR_ANNO_PATH", "v62_0_HO_public.anno")
+_SNAPSHOT_PATH    = os.getenv("AADR_SNAPSHOT_PATH")
+
+
+def snapshot_path(anno_path: str) -> Optional[str]:
+    """Vedostiedoston polku .anno-tiedostolle (None = vedokset pois käytöstä)."""
+    if _SNAPSHOT_PATH is None:
+        return anno_path + ".kshm.snap"
+    return _SNAPSHOT_PATH or None
 
 # ---------------------------------------------------------------------------
 # Sarakenimi-kandidaatit (v54.1 ja v62 käyttävät eri nimiä)
@@ -355,11 +384,19 @@ MANUAL_ADDITIONS: List[Dict] = [
 # Sarakekartta — havaitaan kerran tiedostoa avattaessa
 # ---------------------------------------------------------------------------
 
+_COLMAP_ATTRS = (
+    "id", "group", "loc", "country", "lat", "lon",
+    "pub", "date", "mt", "y_term", "y_isogg", "y_manual",
+)
+
+
 class _ColMap:
-    __slots__ = (
-        "id", "group", "loc", "country", "lat", "lon",
-        "pub", "date", "mt", "y_term", "y_isogg", "y_manual", "version",
-    )
+    """
+    Sarakenimet havaitaan otsakkeesta (v54/v62) ja muunnetaan kerran
+    sarakeindekseiksi — rivit luetaan listoina (csv.reader), ei dicteinä.
+    """
+
+    __slots__ = _COLMAP_ATTRS + ("version", "_pos")
 
     def __init__(self, fieldnames: List[str]):
         def fc(cands): return _find_col(fieldnames, cands)
@@ -376,10 +413,17 @@ class _ColMap:
         self.y_isogg  = fc(_Y_ISOGG_COLS)
         self.y_manual = fc(_Y_MANUAL_COLS)
         self.version  = "v62" if (self.y_term and "Lazaridis" in (self.y_term or "")) else "v54"
+        # Sama nimi useasti otsakkeessa → viimeinen voittaa (kuten DictReader).
+        # Puuttuva sarake → indeksi jota ei ole millään rivillä → "".
+        index = {name: i for i, name in enumerate(fieldnames)}
+        self._pos = tuple(
+            index[getattr(self, a)] if getattr(self, a) else sys.maxsize for a in _COLMAP_ATTRS
+        )
 
-    def g(self, row: Dict, attr: str) -> str:
-        col = getattr(self, attr, None)
-        return row.get(col, "").strip() if col else ""
+    def pick(self, fields: List[str]) -> List[str]:
+        """Rivin kentät _COLMAP_ATTRS-järjestyksessä, välilyönnit poistettuina."""
+        n = len(fields)
+        return [fields[i].strip() if i < n else "" for i in self._pos]
 
 
 # ---------------------------------------------------------------------------
@@ -418,11 +462,13 @@ def _bp_to_bce(bp: str) -> Optional[int]:
 # Parseri
 # ---------------------------------------------------------------------------
 
-def _parse_row(row: Dict, cm: _ColMap) -> Optional[Dict]:
-    mt       = _clean(cm.g(row, "mt"))
-    y_term   = _clean(cm.g(row, "y_term"))
-    y_isogg  = _clean(cm.g(row, "y_isogg"))
-    y_manual = _clean(cm.g(row, "y_manual"))
+def _parse_row(row: List[str], cm: _ColMap) -> Optional[Dict]:
+    (sample_id, group, loc, country, lat, lon,
+     pub, date, mt, y_term, y_isogg, y_manual) = cm.pick(row)
+    mt       = _clean(mt)
+    y_term   = _clean(y_term)
+    y_isogg  = _clean(y_isogg)
+    y_manual = _clean(y_manual)
 
     # v54.1: terminaali usein tyhjä, ISOGG:ssä arvo → käytä ISOGG y_best:nä
     # v62:  terminaali (esim. "N-L550") > manuaalinen override > ISOGG
@@ -432,20 +478,20 @@ def _parse_row(row: Dict, cm: _ColMap) -> Optional[Dict]:
         return None
 
     try:
-        lat = float(cm.g(row, "lat"))
-        lon = float(cm.g(row, "lon"))
+        lat = float(lat)
+        lon = float(lon)
     except (ValueError, TypeError):
         lat, lon = None, None
 
     return {
-        "id":          cm.g(row, "id"),
-        "group":       cm.g(row, "group"),
-        "location":    cm.g(row, "loc"),
-        "country":     cm.g(row, "country"),
+        "id":          sample_id,
+        "group":       group,
+        "location":    loc,
+        "country":     country,
         "lat":         lat,
         "lon":         lon,
-        "date_bce":    _bp_to_bce(cm.g(row, "date")),
-        "publication": cm.g(row, "pub"),
+        "date_bce":    _bp_to_bce(date),
+        "publication": pub,
         "mt":          mt,
         "y":           y_best,
         "y_isogg":     y_isogg,
@@ -469,67 +515,346 @@ def _y_index_keys(y_term: Optional[str], y_isogg: Optional[str], y_manual: Optio
     return keys
 
 
+# Rinnakkaisparsinta: tiedosto jaetaan rivinvaihtoihin tasattuihin
+# tavualueisiin, jokainen prosessi parsii oman alueensa omaan
+# _SampleStoreen ja varastot yhdistetään tiedoston järjestyksessä.
+# Pienet tiedostot parsitaan suoraan (prosessien käynnistys maksaa enemmän).
+
+PARSE_WORKERS        = int(os.getenv("AADR_PARSE_WORKERS", os.cpu_count() or 1))
+_PARALLEL_MIN_BYTES  = 8 * 1024 * 1024
+_CHUNKS_PER_WORKER   = 2
+
+
+def _read_header(anno_path: str) -> Tuple[List[str], int]:
+    """(sarakenimet, datan alun tavusijainti)."""
+    with open(anno_path, "rb") as f:
+        line = f.readline()
+    header = next(csv.reader(io.StringIO(line.decode("utf-8"), newline=None), delimiter="\t"), [])
+    return header, len(line)
+
+
+def _chunk_ranges(anno_path: str, start: int, n_chunks: int) -> List[Tuple[int, int]]:
+    """Tavualueet [alku, loppu) joiden rajat osuvat rivinvaihdon jälkeen."""
+    size = os.path.getsize(anno_path)
+    bounds = [start]
+    with open(anno_path, "rb") as f:
+        for i in range(1, n_chunks):
+            target = max(start + (size - start) * i // n_chunks, bounds[-1])
+            f.seek(target)
+            f.readline()                      # loppuun nykyinen (osittainen) rivi
+            pos = min(f.tell(), size)
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def _parse_chunk(anno_path: str, start: int, end: int, header: List[str]) -> "_SampleStore":
+    """Parsii tavualueen omaan varastoonsa (ajetaan myös aliprosessissa)."""
+    cm = _ColMap(header)
+    with open(anno_path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    store = _SampleStore()
+    for fields in csv.reader(io.StringIO(text, newline=None), delimiter="\t"):
+        if not fields:
+            continue                          # tyhjä rivi (DictReader ohitti nämäkin)
+        s = _parse_row(fields, cm)
+        if s is not None:
+            store.append(s)
+    return store
+
+
+def _parse_anno(anno_path: str, workers: int = PARSE_WORKERS) -> Tuple[str, "_SampleStore"]:
+    """Parsii .anno-tiedoston → (versio, näytteet tiedoston järjestyksessä)."""
+    header, data_start = _read_header(anno_path)
+    cm = _ColMap(header)
+    logger.info(f"  Versio: {cm.version} | Y-terminaali: {(cm.y_term or '')[:60]}")
+
+    size = os.path.getsize(anno_path)
+    if workers <= 1 or size < _PARALLEL_MIN_BYTES:
+        return cm.version, _parse_chunk(anno_path, data_start, size, header)
+
+    ranges = _chunk_ranges(anno_path, data_start, workers * _CHUNKS_PER_WORKER)
+    logger.info(f"  Rinnakkaisparsinta: {len(ranges)} osaa, {workers} prosessia")
+    # spawn: kutsuja voi olla monisäikeinen palvelinprosessi, jossa fork() ei ole turvallinen
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=ctx) as pool:
+        parts = pool.map(_parse_chunk, *zip(*((anno_path, a, b, header) for a, b in ranges)))
+        store = _SampleStore()
+        for part in parts:
+            store.extend(part)
+    return cm.version, store
+
+
+# ---------------------------------------------------------------------------
+# Sarakemuotoinen näytevarasto
+# ---------------------------------------------------------------------------
+
+_NO_DATE = 2 ** 31 - 1          # päiväämätön näyte — lajittuu kronologisesti viimeiseksi
+
+# Merkkijonokentät _parse_row():n avainjärjestyksessä
+_STR_FIELDS = (
+    "id", "group", "location", "country", "publication",
+    "mt", "y", "y_isogg", "y_manual", "source",
+)
+
+
+class _SampleStore:
+    """
+    Jokainen näyte tallennetaan kerran riviksi sarakkeisiin:
+
+      merkkijonot  → array("I") -koodit jaettuun, internoituun merkkijonotauluun
+                     (koodi 0 = None); sama maa/ryhmä/julkaisu on muistissa kerran
+      date_bce     → array("i"), _NO_DATE = päiväämätön
+      lat / lon    → array("d"), NaN = puuttuva (float64, jotta koordinaatit
+                     palautuvat bitilleen samoina kuin .anno-tiedostossa)
+      modern       → bytearray: 1 = .DG-referenssinäyte (BP≈0)
+
+    Indeksit sisältävät rivinumeroita; dict muodostetaan vasta row():ssa
+    julkisen API:n reunalla.
+    """
+
+    __slots__ = _STR_FIELDS + ("strings", "_codes", "lat", "lon", "date", "modern", "notes")
+
+    def __init__(self):
+        self.strings: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+        for name in _STR_FIELDS:
+            setattr(self, name, array("I"))
+        self.lat    = array("d")
+        self.lon    = array("d")
+        self.date   = array("i")
+        self.modern = bytearray()
+        self.notes: Dict[int, str] = {}          # vain manuaalisille lisäyksille
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    def _code(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return code
+
+    def append(self, s: Dict) -> int:
+        """Lisää _parse_row()-muotoisen näytteen ja palauttaa sen rivinumeron."""
+        row = len(self.date)
+        for name in _STR_FIELDS:
+            getattr(self, name).append(self._code(s.get(name)))
+        lat, lon, date = s.get("lat"), s.get("lon"), s.get("date_bce")
+        self.lat.append(math.nan if lat is None else lat)
+        self.lon.append(math.nan if lon is None else lon)
+        self.date.append(_NO_DATE if date is None else date)
+        self.modern.append(_is_modern(date, s.get("group") or ""))
+        if s.get("notes") is not None:
+            self.notes[row] = s["notes"]
+        return row
+
+    def extend(self, other: "_SampleStore") -> None:
+        """Liittää toisen varaston rivit perään (merkkijonokoodit käännetään tähän tauluun)."""
+        offset = len(self.date)
+        remap = [self._code(s) for s in other.strings]
+        for name in _STR_FIELDS:
+            getattr(self, name).extend(map(remap.__getitem__, getattr(other, name)))
+        self.lat.extend(other.lat)
+        self.lon.extend(other.lon)
+        self.date.extend(other.date)
+        self.modern.extend(other.modern)
+        for r, note in other.notes.items():
+            self.notes[offset + r] = note
+
+    @classmethod
+    def from_snapshot(cls, snap) -> "_SampleStore":
+        """Sarakkeet kopioidaan vedoksesta suoraan (memcpy), ilman rivikohtaisia dictejä."""
+        store = cls()
+        store.strings = snap.strings
+        store._codes = {s: i for i, s in enumerate(snap.strings) if i}
+        for name in _STR_FIELDS:
+            getattr(store, name).frombytes(snap.buffer(name))
+        store.lat.frombytes(snap.buffer("lat"))
+        store.lon.frombytes(snap.buffer("lon"))
+        store.date.frombytes(snap.buffer("date_bce"))
+        for r, d in enumerate(store.date):
+            if d == INT32_NONE:
+                store.date[r] = _NO_DATE
+        # .DG-ryhmät tarkistetaan kerran per erillinen ryhmä, ei per rivi
+        dg = {c for c in set(store.group) if (store.strings[c] or "").endswith(".DG")}
+        date = store.date
+        store.modern = bytearray(
+            g in dg and -10 <= date[r] != _NO_DATE for r, g in enumerate(store.group)
+        )
+        return store
+
+    def snapshot_columns(self) -> Dict[str, Tuple[str, List]]:
+        """write_snapshot()-muotoiset sarakkeet (vain .anno-rivit — kutsutaan ennen manuaalisia)."""
+        strings = self.strings
+        columns: Dict[str, Tuple[str, List]] = {
+            name: ("s", [strings[c] for c in getattr(self, name)]) for name in _STR_FIELDS
+        }
+        columns["lat"] = ("d", list(self.lat))
+        columns["lon"] = ("d", list(self.lon))
+        columns["date_bce"] = ("i", [None if d == _NO_DATE else d for d in self.date])
+        return columns
+
+    # -----------------------------------------------------
+    # Rivikohtaiset lukijat
+    # -----------------------------------------------------
+
+    def row(self, r: int) -> Dict:
+        """Rivi julkisen API:n dict-muodossa (samat avaimet kuin _parse_row())."""
+        st = self.strings
+        lat, lon, date = self.lat[r], self.lon[r], self.date[r]
+        d = {
+            "id":          st[self.id[r]],
+            "group":       st[self.group[r]],
+            "location":    st[self.location[r]],
+            "country":     st[self.country[r]],
+            "lat":         None if math.isnan(lat) else lat,
+            "lon":         None if math.isnan(lon) else lon,
+            "date_bce":    None if date == _NO_DATE else date,
+            "publication": st[self.publication[r]],
+            "mt":          st[self.mt[r]],
+            "y":           st[self.y[r]],
+            "y_isogg":     st[self.y_isogg[r]],
+            "y_manual":    st[self.y_manual[r]],
+        }
+        notes = self.notes.get(r)
+        if notes is not None:
+            d["notes"] = notes
+        d["source"] = st[self.source[r]]
+        return d
+
+    def rows(self, rows) -> List[Dict]:
+        return [self.row(r) for r in rows]
+
+
+def _is_modern(date_bce: Optional[int], group: str) -> bool:
+    """Moderni referenssinäyte: .DG-pääte ja BP≈0."""
+    return date_bce is not None and date_bce >= -10 and group.endswith(".DG")
+
+
+# ---------------------------------------------------------------------------
+# Binäärivedos — ks. aadr_snapshot.py
+# ---------------------------------------------------------------------------
+
+def _read_anno(anno_path: str) -> Tuple[str, _SampleStore]:
+    """
+    Näytteet vedoksesta jos se on ajan tasalla, muuten parsitaan .anno ja
+    kirjoitetaan uusi vedos seuraavia käynnistyksiä varten.
+    """
+    snap_path = snapshot_path(anno_path)
+    if snap_path:
+        snap = load_snapshot(snap_path, anno_path)
+        if snap is not None:
+            try:
+                store = _SampleStore.from_snapshot(snap)
+                version = snap.meta.get("aadr_version", "unknown")
+            finally:
+                snap.close()
+            logger.info(f"  Vedos: {snap_path} ({len(store)} näytettä)")
+            return version, store
+
+    version, store = _parse_anno(anno_path)
+    if snap_path:
+        write_snapshot(snap_path, anno_path, store.snapshot_columns(),
+                       meta={"aadr_version": version})
+    return version, store
+
+
 # ---------------------------------------------------------------------------
 # Singleton-indeksi
 # ---------------------------------------------------------------------------
 
 class _AADRIndex:
     def __init__(self):
-        self._by_mt:  Dict[str, List[Dict]] = defaultdict(list)
-        self._by_y:   Dict[str, List[Dict]] = defaultdict(list)
+        self._store   = _SampleStore()
+        self._by_mt:  Dict[str, array] = {}
+        self._by_y:   Dict[str, array] = {}
+        self._mt_trie = HaplogroupTrie()
+        self._y_trie  = HaplogroupTrie()
+        self._geo     = GeoGrid((), ())
         self._loaded  = False
         self._path:   Optional[str] = None
         self._version = "unknown"
+        self._lock    = threading.Lock()
 
     def _load(self, anno_path: str) -> None:
         if self._loaded and self._path == anno_path:
             return
+        # Säiepoolista voi tulla useita ensimmäisiä hakuja yhtä aikaa —
+        # vain yksi parsii, muut odottavat valmista indeksiä
+        with self._lock:
+            if not (self._loaded and self._path == anno_path):
+                self._build(anno_path)
 
+    def _build(self, anno_path: str) -> None:
         logger.info(f"Ladataan AADR: {anno_path}")
-        by_mt: Dict[str, List] = defaultdict(list)
-        by_y:  Dict[str, List] = defaultdict(list)
-
         try:
-            with open(anno_path, encoding="utf-8") as f:
-                reader = csv.DictReader(f, delimiter="\t")
-                cm = _ColMap(list(reader.fieldnames or []))
-                self._version = cm.version
-                logger.info(f"  Versio: {cm.version} | Y-terminaali: {(cm.y_term or '')[:60]}")
-
-                for row in reader:
-                    s = _parse_row(row, cm)
-                    if s is None:
-                        continue
-                    if s["mt"]:
-                        by_mt[s["mt"]].append(s)
-                    for key in _y_index_keys(s.get("y"), s.get("y_isogg"), s.get("y_manual")):
-                        by_y[key].append(s)
-
+            self._version, store = _read_anno(anno_path)
         except FileNotFoundError:
             logger.warning(f"Tiedostoa ei löydy: {anno_path}")
+            store = _SampleStore()
 
         # Manuaaliset lisäykset
         for s in MANUAL_ADDITIONS:
-            if s.get("mt"):
-                by_mt[s["mt"]].append(s)
-            for key in _y_index_keys(s.get("y"), s.get("y_isogg"), s.get("y_manual")):
-                by_y[key].append(s)
-
-        self._by_mt  = by_mt
-        self._by_y   = by_y
-        self._loaded = True
-        self._path   = anno_path
+            store.append(s)
+
+        # Indeksit: haploryhmä → rivinumerot
+        by_mt: Dict[str, List[int]] = defaultdict(list)
+        by_y:  Dict[str, List[int]] = defaultdict(list)
+        strings = store.strings
+        y_keys_memo: Dict[Tuple[int, int, int], List[str]] = {}
+        for r, (mt, y, y_isogg, y_manual) in enumerate(
+            zip(store.mt, store.y, store.y_isogg, store.y_manual)
+        ):
+            mt_name = strings[mt]
+            if mt_name:
+                by_mt[mt_name].append(r)
+            # Sama Y-kolmikko toistuu tuhansilla riveillä — avaimet lasketaan kerran
+            codes = (y, y_isogg, y_manual)
+            y_keys = y_keys_memo.get(codes)
+            if y_keys is None:
+                y_keys = y_keys_memo[codes] = _y_index_keys(strings[y], strings[y_isogg], strings[y_manual])
+            for key in y_keys:
+                by_y[key].append(r)
+
+        self._store   = store
+        # Postauslistat deduplikoidaan (sama ID → ensimmäinen rivi) ja
+        # lajitellaan kronologisesti kerran tässä — haut eivät lajittele
+        self._by_mt   = {k: array("I", _chrono(store, _dedup(store, v))) for k, v in by_mt.items()}
+        self._by_y    = {k: array("I", _chrono(store, _dedup(store, v))) for k, v in by_y.items()}
+        # Etuliitepuut rakennetaan kerran latauksessa — haut O(nimen pituus)
+        self._mt_trie = HaplogroupTrie(by_mt.keys())
+        self._y_trie  = HaplogroupTrie(by_y.keys())
+        # Sijaintiruudukko bbox-hakuihin (jakaa store.lat/lon-taulukot, ei kopioi)
+        self._geo     = GeoGrid(store.lat, store.lon)
+        self._loaded  = True
+        self._path    = anno_path
 
         n_mt = sum(len(v) for v in by_mt.values())
         n_y  = sum(len(v) for v in by_y.values())
-        logger.info(f"Ladattu: {n_mt} mtDNA-merkintää, {n_y} Y-DNA-merkintää")
+        logger.info(f"Ladattu: {len(store)} näytettä, {n_mt} mtDNA-merkintää, {n_y} Y-DNA-merkintää")
 
-    def get_mt(self, p: str) -> Dict[str, List[Dict]]:
+    def get_mt(self, p: str) -> Dict[str, array]:
         self._load(p); return self._by_mt
 
-    def get_y(self, p: str) -> Dict[str, List[Dict]]:
+    def get_y(self, p: str) -> Dict[str, array]:
         self._load(p); return self._by_y
 
+    def get(self, p: str, lineage: str) -> Tuple[_SampleStore, Dict[str, array], HaplogroupTrie]:
+        """(varasto, indeksi, etuliitepuu) linjalle "mt" tai "y"."""
+        self._load(p)
+        if lineage == "mt":
+            return self._store, self._by_mt, self._mt_trie
+        return self._store, self._by_y, self._y_trie
+
+    def get_geo(self, p: str) -> Tuple[_SampleStore, GeoGrid]:
+        self._load(p); return self._store, self._geo
+
     @property
     def version(self) -> str:
         return self._version
@@ -539,99 +864,66 @@ _INDEX = _AADRIndex()
 
 
 # ---------------------------------------------------------------------------
-# N-Tat nimikaos — alias-taulukko
-# ---------------------------------------------------------------------------
-
-_N_TAT_ALIASES: Dict[str, str] = {
-    # SNP-pohjaiset
-    "N-M46": "N-M46",   "N-TAT": "N-M46",   "N-TAT": "N-M46",
-    "N-P105": "N-M46",  "N-M178": "N-M46",
-    # Vanhat ISOGG-nimet
-    "N3": "N-M46",      "N1C": "N-M46",     "N1C1": "N-M46",
-    # Eurooppalaiset SNP-nimet
-    "N-L1026": "N-L1026",
-    "N-VL29":  "N-L1026",
-    "N-L550":  "N-L550",
-    "N-Z1936": "N-Z1936",
-    "N-Z1925": "N-Z1936",
-    # Eupedian vanhat ISOGG-nimet
-    "N1C1A1A1A1": "N-L550",
-    "N1C1A1A1A2": "N-Z1936",
-    "N1C1A1A": "N-L1026",
-}
-
-
-def _resolve(hg: str, lineage: str) -> str:
-    if lineage == "y":
-        return _N_TAT_ALIASES.get(hg.upper().strip(), hg)
-    return hg
-
-
-# ---------------------------------------------------------------------------
-# Hakuapurit
+# Hakuapurit — kaikki toimivat rivinumeroilla
 # ---------------------------------------------------------------------------
-
-def _prefix_lookup(index: Dict[str, List[Dict]], hg: str) -> List[Dict]:
-    """Täsmällinen + pisin etuliiteosuma."""
-    hg_u = hg.upper().rstrip("~")
-    # Täsmällinen
-    for key, samps in index.items():
-        if key.upper().rstrip("~") == hg_u:
-            return samps
-    # Pisin etuliite
-    best, best_len = None, 0
-    for key in index:
-        k = key.upper().rstrip("~")
-        if hg_u.startswith(k) and len(k) > best_len and len(k) >= 2:
-            best, best_len = key, len(k)
-    return index[best] if best else []
-
-
-def _all_prefix_matches(index: Dict[str, List[Dict]], hg: str) -> List[Dict]:
-    """Kaikki näytteet koko kladipuulle."""
-    hg_u = hg.upper().rstrip("~")
+#
+# Postauslistat ovat valmiiksi kronologisessa järjestyksessä (vanhin ensin,
+# päiväämättömät viimeisenä), joten haut eivät lajittele: yksittäinen klade
+# on viipale ja kladipuu yhdistetään k-tie-lomituksella (heapq.merge).
+# Suodattimet ovat laiskoja generaattoreita, joten top-n pysähtyy n:nteen
+# osumaan — O(n) eikä O(N log N).
+
+def _prefix_lookup(index: Dict[str, array], trie: HaplogroupTrie, hg: str) -> Sequence[int]:
+    """Täsmällinen + pisin etuliiteosuma (vähintään 2 merkkiä). Kronologinen, deduplikoitu."""
+    key = trie.lookup(hg, min_len=2)
+    return index[key] if key else ()
+
+
+def _all_prefix_matches(store: _SampleStore, index: Dict[str, array], trie: HaplogroupTrie, hg: str) -> Iterator[int]:
+    """Kaikki rivit koko kladipuulle kronologisesti — jälkeläisten listojen k-tie-lomitus."""
+    postings = [index[key] for key in trie.descendants(hg)]
+    if len(postings) == 1:
+        return iter(postings[0])
+    return _unique(store, heapq.merge(*postings, key=store.date.__getitem__))
+
+
+def _unique(store: _SampleStore, rows: Iterable[int]) -> Iterator[int]:
+    """Laiska deduplikointi näyte-ID:n mukaan (ensimmäinen esiintymä voittaa)."""
+    ids = store.id
     seen: set = set()
-    out = []
-    for key, samps in index.items():
-        if key.upper().rstrip("~").startswith(hg_u):
-            for s in samps:
-                if s["id"] not in seen:
-                    out.append(s)
-                    seen.add(s["id"])
-    return out
+    for r in rows:
+        code = ids[r]
+        if code not in seen:
+            seen.add(code)
+            yield r
 
 
-def _dedup(samples: List[Dict]) -> List[Dict]:
-    seen: set = set()
-    out = []
-    for s in samples:
-        if s["id"] not in seen:
-            out.append(s)
-            seen.add(s["id"])
-    return out
+def _dedup(store: _SampleStore, rows: Sequence[int]) -> List[int]:
+    """Poistaa saman näyte-ID:n toistot (ID-koodi on internoitu → kokonaislukuvertailu)."""
+    ids = store.id
+    if len(set(map(ids.__getitem__, rows))) == len(rows):
+        return list(rows)           # tavallisin tapaus: ei toistoja
+    return list(_unique(store, rows))
 
 
-def _chrono(samples: List[Dict]) -> List[Dict]:
-    dated   = sorted([s for s in samples if s.get("date_bce") is not None],
-                     key=lambda x: x["date_bce"])
-    undated = [s for s in samples if s.get("date_bce") is None]
-    return dated + undated
+def _chrono(store: _SampleStore, rows: List[int]) -> List[int]:
+    """Vanhin ensin; päiväämättömät (_NO_DATE) viimeisenä alkuperäisessä järjestyksessä."""
+    return sorted(rows, key=store.date.__getitem__)
 
 
-def _no_modern(samples: List[Dict]) -> List[Dict]:
+def _no_modern(store: _SampleStore, rows: Iterable[int]) -> Iterator[int]:
     """Suodata pois modernit referenssinäytteet (.DG päätteellä ja BP≈0)."""
-    return [
-        s for s in samples
-        if not (
-            s.get("date_bce") is not None
-            and s["date_bce"] >= -10
-            and s.get("group", "").endswith(".DG")
-        )
-    ]
+    modern = store.modern
+    return (r for r in rows if not modern[r])
+
+
+def _take(rows: Iterable[int], n: int) -> List[int]:
+    return list(islice(rows, max(n, 0)))
 
 
 # ---------------------------------------------------------------------------
 # Julkinen API
+
 # ---------------------------------------------------------------------------
 
 def get_nearest_samples(
@@ -653,16 +945,17 @@ def get_nearest_samples(
         require_coordinates Vain koordinaateilla varustetut näytteet
         exclude_modern:     Jätä pois .DG-päätteiset modernit referenssinäytteet
     """
-    hg    = _resolve(haplogroup, lineage)
-    index = _INDEX.get_mt(anno_path) if lineage == "mt" else _INDEX.get_y(anno_path)
-    samps = _dedup(_prefix_lookup(index, hg))
+    hg    = canonical_id(haplogroup, lineage)
+    store, index, trie = _INDEX.get(anno_path, lineage)
+    rows  = _prefix_lookup(index, trie, hg)
 
     if require_coordinates:
-        samps = [s for s in samps if s.get("lat") is not None]
+        lat = store.lat
+        rows = (r for r in rows if lat[r] == lat[r])     # NaN != NaN
     if exclude_modern:
-        samps = _no_modern(samps)
+        rows = _no_modern(store, rows)
 
-    return _chrono(samps)[:n]
+    return store.rows(_take(rows, n))
 
 
 def get_oldest_sample(
@@ -670,7 +963,7 @@ def get_oldest_sample(
     lineage: str = "mt",
     anno_path: str = DEFAULT_ANNO_PATH,
 ) -> Optional[Dict]:
-    """Vanhin tunnettu näyte kladille."""
+    """Vanhin tunnettu näyte kladille — postauslistan ensimmäinen suodatuksen läpäisevä."""
     s = get_nearest_samples(haplogroup, n=1, lineage=lineage, anno_path=anno_path)
     return s[0] if s else None
 
@@ -683,11 +976,13 @@ def get_samples_by_region(
     n: int = 50,
 ) -> List[Dict]:
     """Suodattaa näytteet maan perusteella."""
-    hg    = _resolve(haplogroup, lineage)
-    index = _INDEX.get_mt(anno_path) if lineage == "mt" else _INDEX.get_y(anno_path)
-    samps = _dedup(_prefix_lookup(index, hg))
-    samps = [s for s in samps if country.lower() in s.get("country", "").lower()]
-    return _chrono(samps)[:n]
+    hg    = canonical_id(haplogroup, lineage)
+    store, index, trie = _INDEX.get(anno_path, lineage)
+    rows  = _prefix_lookup(index, trie, hg)
+    # Maavertailu tehdään kerran per erillinen maa-merkkijono, ei per rivi
+    needle, strings, countries = country.lower(), store.strings, store.country
+    matching = {c for c in set(map(countries.__getitem__, rows)) if needle in (strings[c] or "").lower()}
+    return store.rows(_take((r for r in rows if countries[r] in matching), n))
 
 
 def get_clade_tree_samples(
@@ -698,12 +993,30 @@ def get_clade_tree_samples(
     exclude_modern: bool = True,
 ) -> List[Dict]:
     """Kaikki näytteet koko kladipuulle (esim. kaikki U5*)."""
-    hg    = _resolve(haplogroup_prefix, lineage)
-    index = _INDEX.get_mt(anno_path) if lineage == "mt" else _INDEX.get_y(anno_path)
-    samps = _dedup(_all_prefix_matches(index, hg))
+    return list(islice(
+        iter_clade_tree_samples(haplogroup_prefix, lineage, anno_path, exclude_modern),
+        max(max_total, 0),
+    ))
+
+
+def iter_clade_tree_samples(
+    haplogroup_prefix: str,
+    lineage: str = "mt",
+    anno_path: str = DEFAULT_ANNO_PATH,
+    exclude_modern: bool = True,
+) -> Iterator[Dict]:
+    """
+    Koko kladipuu laiskana iteraattorina, kronologisesti ilman ylärajaa —
+    suoratoistoa (vienti) varten. Rivi muunnetaan dictiksi vasta kun sitä
+    pyydetään, joten muistinkulutus ei riipu tulosjoukon koosta.
+    Indeksi ladataan heti kutsussa, ei ensimmäisellä next():llä.
+    """
+    hg    = canonical_id(haplogroup_prefix, lineage)
+    store, index, trie = _INDEX.get(anno_path, lineage)
+    rows  = _all_prefix_matches(store, index, trie, hg)
     if exclude_modern:
-        samps = _no_modern(samps)
-    return _chrono(samps)[:max_total]
+        rows = _no_modern(store, rows)
+    return map(store.row, rows)
 
 
 def get_sample_count(
@@ -712,9 +1025,9 @@ def get_sample_count(
     anno_path: str = DEFAULT_ANNO_PATH,
 ) -> int:
     """Näytemäärä haploryhmälle."""
-    hg    = _resolve(haplogroup, lineage)
-    index = _INDEX.get_mt(anno_path) if lineage == "mt" else _INDEX.get_y(anno_path)
-    return len(_dedup(_prefix_lookup(index, hg)))
+    hg    = canonical_id(haplogroup, lineage)
+    store, index, trie = _INDEX.get(anno_path, lineage)
+    return len(_prefix_lookup(index, trie, hg))
 
 
 def list_available_clades(
@@ -730,18 +1043,80 @@ def list_available_clades(
     )
 
 
+def clade_keys_by_row(lineage: str = "mt", anno_path: str = DEFAULT_ANNO_PATH) -> Dict[int, str]:
+    """Rivi → indeksiavain (kladi); esim. tiilikerrosten jakoon pääkladeittain."""
+    _, index, _ = _INDEX.get(anno_path, lineage)
+    return {r: key for key, rows in index.items() for r in rows}
+
+
+def get_geo_points(
+    bbox: BBox = WORLD,
+    haplogroup: Optional[str] = None,
+    lineage: str = "mt",
+    from_bp: Optional[int] = None,
+    to_bp: Optional[int] = None,
+    exclude_modern: bool = True,
+    anno_path: str = DEFAULT_ANNO_PATH,
+) -> List[Tuple[float, float, Optional[int], int]]:
+    """
+    Kartan näytteet alueelta: [(lon, lat, date_bp, rivi)]. Rivi annetaan
+    get_sample_row():lle vasta kun näyte piirretään yksittäisenä pisteenä.
+
+    haplogroup rajaa koko kladipuuhun (U5 → kaikki U5*); jos kladia ei ole
+    indeksissä, käytetään pisintä etuliiteosumaa. Aikaväli: ks. geo_index.bp_range.
+    """
+    store, grid = _INDEX.get_geo(anno_path)
+    lat, lon, date, modern = store.lat, store.lon, store.date, store.modern
+
+    if haplogroup:
+        _, index, trie = _INDEX.get(anno_path, lineage)
+        hg   = canonical_id(haplogroup, lineage)
+        keys = trie.descendants(hg) or [k for k in (trie.lookup(hg, min_len=2),) if k]
+        clade = set().union(*(index[k] for k in keys))
+        rows: Iterable[int] = (
+            r for r in sorted(clade) if lat[r] == lat[r] and in_bbox(lon[r], lat[r], bbox)
+        )
+    else:
+        rows = grid.query(bbox)
+
+    oldest, youngest = bp_range(from_bp, to_bp)
+    dated = oldest is not None or youngest is not None
+
+    out: List[Tuple[float, float, Optional[int], int]] = []
+    for r in rows:
+        if exclude_modern and modern[r]:
+            continue
+        d = date[r]
+        bp = None if d == _NO_DATE else 1950 - d
+        if dated and not bp_within(bp, oldest, youngest):
+            continue
+        out.append((lon[r], lat[r], bp, r))
+    return out
+
+
+def get_sample_row(row: int, anno_path: str = DEFAULT_ANNO_PATH) -> Dict:
+    """Yksittäinen näyte rivinumerolla (get_geo_points():n palauttama)."""
+    store, _ = _INDEX.get_geo(anno_path)
+    return store.row(row)
+
+
 def get_aadr_version(anno_path: str = DEFAULT_ANNO_PATH) -> str:
     """Palauttaa havaitun AADR-version ('v62' tai 'v54')."""
     _INDEX._load(anno_path)
     return _INDEX.version
 
 
+def preload(anno_path: str = DEFAULT_ANNO_PATH) -> int:
+    """Lataa indeksin heti (työprosessin käynnistyksessä). Palauttaa näytemäärän."""
+    _INDEX._load(anno_path)
+    return len(_INDEX._store)
+
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    import sys
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
     hg   = sys.argv[1] if len(sys.argv) > 1 else "U5b1"
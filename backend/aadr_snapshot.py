@@ -0,0 +1,341 @@
+"""
+aadr_snapshot.py — Parsitun AADR-indeksin binäärinen tilannevedos
+KSHM-projekti
+
+aadr_db parsii .anno-tiedoston (v62: ~22 000 riviä) csv.DictReaderilla
+ensimmäisellä käyttökerralla, joten jokainen käyttöönotto ja jokainen
+uusi työprosessi maksaa sekuntien parsinnan. Tilannevedos kirjoitetaan
+ensimmäisen parsinnan jälkeen ja luetaan myöhemmin mmap:lla.
+
+Tiedostomuoto (natiivi tavujärjestys, tarkistetaan latauksessa):
+
+    [otsake]      MAGIC (8 t) | FORMAT_VERSION (u32) | hakemiston pituus (u32)
+                  | hakemiston sijainti (u64)
+    [merkkijonot] u32-offsetit + UTF-8-data; indeksi 0 = None
+    [sarakkeet]   array-muotoiset sarakkeet 8 tavun tasaukseen
+    [hakemisto]   JSON: lähteen sormenjälki, metatiedot, sarakkeiden sijainnit
+
+Sarakkeet:
+  merkkijonosarake  → u32-indeksit merkkijonotauluun (jaettu, deduplikoitu)
+  "i" (int32)       → esim. päivämäärät, puuttuva = INT32_NONE
+  "d" (float64)     → esim. koordinaatit, puuttuva = NaN
+
+Vanhentuminen:
+  Sormenjälki = lähdetiedoston koko + mtime_ns + sha256. Jos koko ja mtime
+  täsmäävät, vedos kelpaa suoraan. Jos vain mtime on muuttunut (esim.
+  tiedosto kopioitu uudelleen käyttöönotossa), sisältö tarkistetaan
+  sha256:lla. Muuten vedos on vanhentunut ja kutsuja parsii uudelleen.
+  FORMAT_VERSION on nostettava aina kun parserin tulos muuttuu.
+
+Käyttö:
+  snap = load_snapshot(snap_path, anno_path)     # None jos puuttuu/vanhentunut
+  write_snapshot(snap_path, anno_path, columns, meta={"aadr_version": "v62"})
+
+  cd backend && python aadr_snapshot.py [anno_path]   # rakenna/päivitä vedos
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import logging
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC          = b"KSHMSNAP"
+FORMAT_VERSION = 1
+INT32_NONE     = -(2 ** 31)
+
+_HEADER = struct.Struct("<8sIIQ")
+_ALIGN  = 8
+_STR    = "s"       # merkkijonosarakkeen tyyppikoodi hakemistossa
+
+
+# ---------------------------------------------------------------------------
+# Lähteen sormenjälki
+# ---------------------------------------------------------------------------
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_fingerprint(path: str, with_hash: bool = True) -> Dict:
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        fp["sha256"] = _sha256(path)
+    return fp
+
+
+# ---------------------------------------------------------------------------
+# Luettu vedos
+# ---------------------------------------------------------------------------
+
+class Snapshot:
+    """mmap-pohjainen vedos. Numeeriset sarakkeet ovat memoryview-näkymiä ilman kopiointia."""
+
+    def __init__(self, mm: mmap.mmap, directory: Dict, strings: List[Optional[str]]):
+        self._mm       = mm
+        self._dir      = directory
+        self.strings   = strings
+        self.meta: Dict = directory.get("meta", {})
+        self.n_rows: int = directory["n_rows"]
+
+    def buffer(self, name: str) -> memoryview:
+        """Sarakkeen tavut sellaisenaan (esim. array.frombytes()-kutsulle)."""
+        code, offset, count = self._dir["columns"][name]
+        size = struct.calcsize("I" if code == _STR else code) * count
+        return memoryview(self._mm)[offset:offset + size]
+
+    def raw(self, name: str) -> memoryview:
+        """Sarakkeen tyypitetty näkymä: merkkijonosarakkeille u32-indeksit."""
+        code = self._dir["columns"][name][0]
+        return self.buffer(name).cast("I" if code == _STR else code)
+
+    def column(self, name: str) -> List:
+        """Sarake Python-listana (None puuttuville arvoille)."""
+        code = self._dir["columns"][name][0]
+        view = self.raw(name)
+        if code == _STR:
+            strings = self.strings
+            return [strings[i] for i in view]
+        if code == "i":
+            return [None if v == INT32_NONE else v for v in view]
+        return [None if math.isnan(v) else v for v in view]
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:
+            # Joku pitää vielä memoryview-näkymää — mmap vapautuu sen mukana
+            pass
+
+
+def load_snapshot(path: str, source_path: str) -> Optional[Snapshot]:
+    """Palauttaa vedoksen jos se on olemassa, ehjä ja vastaa lähdetiedostoa."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"Vedosta ei voi avata ({path}): {e}")
+        return None
+
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:           # tyhjä tiedosto
+            return None
+
+    try:
+        magic, version, dir_len, dir_at = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            logger.info(f"Vedos {path}: eri formaatti — rakennetaan uudelleen")
+            mm.close()
+            return None
+        directory = json.loads(mm[dir_at:dir_at + dir_len])
+        if directory.get("byteorder") != sys.byteorder:
+            mm.close()
+            return None
+        if not _source_matches(path, directory, source_path):
+            logger.info(f"Vedos {path} on vanhentunut — rakennetaan uudelleen")
+            mm.close()
+            return None
+        strings = _read_strings(mm, directory["strings"])
+    except (struct.error, ValueError, KeyError, TypeError, UnicodeDecodeError) as e:
+        logger.warning(f"Vedos {path} on vioittunut ({e}) — rakennetaan uudelleen")
+        mm.close()
+        return None
+
+    return Snapshot(mm, directory, strings)
+
+
+def _source_matches(path: str, directory: Dict, source_path: str) -> bool:
+    try:
+        current = source_fingerprint(source_path, with_hash=False)
+    except OSError:
+        return False
+    stored = directory.get("source", {})
+    if current["size"] != stored.get("size"):
+        return False
+    if current["mtime_ns"] == stored.get("mtime_ns"):
+        return True
+    # Sama koko, eri mtime: sisältö ratkaisee
+    if _sha256(source_path) != stored.get("sha256"):
+        return False
+    _restamp(path, directory, current["mtime_ns"])
+    return True
+
+
+def _restamp(path: str, directory: Dict, mtime_ns: int) -> None:
+    """Päivittää vedoksen mtime-tiedon, jottei sha256:ta lasketa joka käynnistyksessä."""
+    directory = dict(directory, source=dict(directory["source"], mtime_ns=mtime_ns))
+    blob = json.dumps(directory, separators=(",", ":")).encode()
+    try:
+        # Hakemisto on tiedoston lopussa: kirjoitetaan se uudelleen samaan
+        # kohtaan ja päivitetään otsakkeen pituus. Tiedostoa ei lyhennetä,
+        # jottei toisen prosessin mmap-näkymä osu katkaistuun alueeseen.
+        with open(path, "r+b") as f:
+            _, _, _, dir_at = _HEADER.unpack(f.read(_HEADER.size))
+            f.seek(dir_at)
+            f.write(blob)
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(blob), dir_at))
+    except OSError as e:
+        logger.debug(f"Vedoksen aikaleiman päivitys epäonnistui: {e}")
+
+
+def _read_strings(mm: mmap.mmap, spec: List[int]) -> List[Optional[str]]:
+    offsets_at, count, blob_at = spec
+    offsets = memoryview(mm)[offsets_at:offsets_at + 4 * (count + 1)].cast("I")
+    blob = mm[blob_at:blob_at + offsets[count]]
+    intern = sys.intern
+    strings: List[Optional[str]] = [None]
+    for i in range(1, count):
+        strings.append(intern(blob[offsets[i]:offsets[i + 1]].decode("utf-8")))
+    offsets.release()
+    return strings
+
+
+# ---------------------------------------------------------------------------
+# Kirjoitus
+# ---------------------------------------------------------------------------
+
+def write_snapshot(
+    path: str,
+    source_path: str,
+    columns: Dict[str, Tuple[str, Sequence]],
+    meta: Optional[Dict] = None,
+) -> bool:
+    """
+    Kirjoittaa vedoksen atomisesti (väliaikaistiedosto + os.replace).
+
+    Args:
+        columns: {nimi: (tyyppi, arvot)} jossa tyyppi on "s" (merkkijono),
+                 "i" (int32) tai "d" (float64). Kaikkien pituus sama.
+    Returns:
+        True jos kirjoitus onnistui.
+    """
+    lengths = {len(values) for _, values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("Sarakkeiden pituudet eroavat")
+    n_rows = lengths.pop() if lengths else 0
+
+    # Merkkijonotaulu: indeksi 0 = None
+    table: Dict[str, int] = {}
+    encoded: List[bytes] = [b""]
+    arrays: Dict[str, Tuple[str, array]] = {}
+    for name, (code, values) in columns.items():
+        if code == _STR:
+            idx = array("I")
+            for v in values:
+                if v is None:
+                    idx.append(0)
+                    continue
+                i = table.get(v)
+                if i is None:
+                    i = table[v] = len(encoded)
+                    encoded.append(v.encode("utf-8"))
+                idx.append(i)
+            arrays[name] = (code, idx)
+        elif code in ("i", "d"):
+            missing = INT32_NONE if code == "i" else math.nan
+            try:
+                arrays[name] = (code, array(code, (missing if v is None else v for v in values)))
+            except OverflowError as e:
+                logger.warning(f"Vedosta ei kirjoiteta — sarake {name} ei mahdu tyyppiin {code}: {e}")
+                return False
+        else:
+            raise ValueError(f"Tuntematon saraketyyppi: {code}")
+
+    # offsets[i]..offsets[i+1] = merkkijonon i tavut; offsets[count] = datan pituus
+    offsets = array("I", [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+
+    sections: List[Tuple[str, bytes]] = [
+        ("offsets", offsets.tobytes()),
+        ("blob", b"".join(encoded)),
+    ] + [(name, arr.tobytes()) for name, (_, arr) in arrays.items()]
+
+    try:
+        source = source_fingerprint(source_path)
+    except OSError as e:
+        logger.warning(f"Vedosta ei kirjoiteta — lähdettä ei voi lukea: {e}")
+        return False
+
+    # Osiot tasataan 8 tavuun; hakemisto kirjoitetaan viimeiseksi
+    positions: Dict[str, int] = {}
+    pos = _HEADER.size
+    for name, data in sections:
+        pos = _aligned(pos)
+        positions[name] = pos
+        pos += len(data)
+    dir_at = _aligned(pos)
+
+    dir_blob = json.dumps({
+        "byteorder": sys.byteorder,
+        "source":    source,
+        "meta":      meta or {},
+        "n_rows":    n_rows,
+        "strings":   [positions["offsets"], len(encoded), positions["blob"]],
+        "columns":   {
+            name: [code, positions[name], len(arr)]
+            for name, (code, arr) in arrays.items()
+        },
+    }, separators=(",", ":")).encode()
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(dir_blob), dir_at))
+            for name, data in sections:
+                f.write(b"\0" * (positions[name] - f.tell()))
+                f.write(data)
+            f.write(b"\0" * (dir_at - f.tell()))
+            f.write(dir_blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Vedoksen kirjoitus epäonnistui ({path}): {e}")
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+    logger.info(f"Vedos kirjoitettu: {path} ({n_rows} riviä, {len(encoded) - 1} merkkijonoa)")
+    return True
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+# ---------------------------------------------------------------------------
+# CLI — vedoksen esirakennus käyttöönotossa
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import time
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    import aadr_db
+    path = sys.argv[1] if len(sys.argv) > 1 else aadr_db.DEFAULT_ANNO_PATH
+    start = time.perf_counter()
+    print(f"Versio: {aadr_db.get_aadr_version(path)}")
+    print(f"Indeksi ladattu {time.perf_counter() - start:.2f} s — vedos: {aadr_db.snapshot_path(path)}")
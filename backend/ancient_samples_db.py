@@ -31,6 +31,8 @@ Haploryhmäavain on lyhyin yksilöivä etuliite:
 from __future__ import annotations
 from typing import Dict, List, Optional, Tuple
 
+from haplo_index import HaplogroupTrie
+
 # ---------------------------------------------------------------------------
 # Tyyppimääritelmät
 # ---------------------------------------------------------------------------
@@ -511,27 +513,23 @@ def get_samples_for_haplogroup(haplogroup: str) -> List[AncientSample]:
         get_samples_for_haplogroup("R1b-M269")    → R1b-näytteet
         get_samples_for_haplogroup("R1b-L21")     → R1b-näytteet
     """
-    hg = haplogroup.strip()
-    hg_upper = hg.upper()
-
     # 1. Täsmällinen osuma (case-insensitive)
-    for key in HAPLOGROUP_SAMPLES:
-        if key.upper() == hg_upper:
-            return HAPLOGROUP_SAMPLES[key]
-
     # 2. Etuliitehaku: valitaan pisin sopiva avain (tarkempi voittaa)
-    best_key: Optional[str] = None
-    best_len: int = 0
-    for key in HAPLOGROUP_SAMPLES:
-        key_upper = key.upper()
-        if hg_upper.startswith(key_upper) and len(key_upper) > best_len:
-            best_key = key
-            best_len = len(key_upper)
-
-    if best_key:
-        return HAPLOGROUP_SAMPLES[best_key]
-
-    return []
+    key = _samples_trie().lookup(haplogroup)
+    return HAPLOGROUP_SAMPLES[key] if key else []
+
+
+_TRIE: Optional[HaplogroupTrie] = None
+_TRIE_SOURCE_SIZE = -1
+
+
+def _samples_trie() -> HaplogroupTrie:
+    """Etuliitepuu HAPLOGROUP_SAMPLES-avaimille — rakennetaan uudelleen vain jos avaimia lisätään."""
+    global _TRIE, _TRIE_SOURCE_SIZE
+    if _TRIE is None or _TRIE_SOURCE_SIZE != len(HAPLOGROUP_SAMPLES):
+        _TRIE = HaplogroupTrie(HAPLOGROUP_SAMPLES.keys())
+        _TRIE_SOURCE_SIZE = len(HAPLOGROUP_SAMPLES)
+    return _TRIE
 
 
 def get_sample_by_id(sample_id: str) -> Optional[AncientSample]:
@@ -37,6 +37,8 @@ Hakufunktiot:
 from __future__ import annotations
 from typing import Dict, List, Optional
 
+from haplo_index import HaplogroupTrie
+
 
 # ---------------------------------------------------------------------------
 # Päärekisteri
@@ -698,26 +700,22 @@ def get_basal_context(haplogroup: str) -> Optional[Dict]:
       get_basal_context("K1a4a1")     → K-konteksti
       get_basal_context("H1-T16189C") → None (H ei ole basaali tässä mielessä)
     """
-    hg_up = haplogroup.upper().strip()
+    # 1. Täsmällinen osuma, 2. pisin etuliiteosuma
+    key = _basal_trie().lookup(haplogroup)
+    return BASAL_MARKERS[key] if key else None
 
-    # 1. Täsmällinen osuma
-    for key, val in BASAL_MARKERS.items():
-        if key.upper() == hg_up:
-            return val
 
-    # 2. Pisin etuliiteosuma
-    best_key = None
-    best_len = 0
-    for key in BASAL_MARKERS:
-        k = key.upper()
-        if hg_up.startswith(k) and len(k) > best_len:
-            best_key = key
-            best_len = len(k)
+_TRIE: Optional[HaplogroupTrie] = None
+_TRIE_SOURCE_SIZE = -1
 
-    if best_key:
-        return BASAL_MARKERS[best_key]
 
-    return None
+def _basal_trie() -> HaplogroupTrie:
+    """Etuliitepuu BASAL_MARKERS-avaimille — rakennetaan uudelleen vain jos avaimia lisätään."""
+    global _TRIE, _TRIE_SOURCE_SIZE
+    if _TRIE is None or _TRIE_SOURCE_SIZE != len(BASAL_MARKERS):
+        _TRIE = HaplogroupTrie(BASAL_MARKERS.keys())
+        _TRIE_SOURCE_SIZE = len(BASAL_MARKERS)
+    return _TRIE
 
 
 def is_basal(haplogroup: str) -> bool:
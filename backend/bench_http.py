@@ -0,0 +1,109 @@
+"""
+bench_http.py — http_utils:n uusintayritysten ja määräajan tarkistus
+KSHM-projekti
+
+Käynnistää paikallisen stub-palvelimen ja ajaa http_get:n sitä vasten:
+
+  flaky        503, 503, 200      → onnistuu kahden uusinnan jälkeen
+  retry-after  429 + Retry-After: 3600 joka kerta
+               ilman määräaikaa   → odotus rajattu KSHM_HTTP_BACKOFF_MAX:iin
+               määräajalla 0.5 s  → ReadTimeout heti (ei odoteta tuntia)
+  down         503 joka kerta, määräajalla 2 s → uusinnat loppuvat ja
+                                    503 palautuu määräajan sisällä
+  hang         vastaa 5 s viiveellä, määräajalla 1 s → aikaraja lyhenee
+
+Kukin tapaus tulostaa kyselyjen määrän, keston ja tuloksen; poikkeama
+odotetusta → exit 1. Ajo kestää muutaman sekunnin (BACKOFF_MAX = 1 s).
+
+Käyttö:
+  cd backend && python bench_http.py
+"""
+
+from __future__ import annotations
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("KSHM_HTTP_BACKOFF", "0.1")
+os.environ.setdefault("KSHM_HTTP_BACKOFF_MAX", "1")
+
+import requests
+
+import http_utils
+
+_hits = defaultdict(int)
+
+
+class _Stub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0].strip("/")
+        _hits[path] += 1
+        if path == "flaky" and _hits[path] >= 3:
+            self._reply(200)
+        elif path == "retry-after":
+            self._reply(429, {"Retry-After": "3600"})
+        elif path == "hang":
+            time.sleep(5)
+            self._reply(200)
+        else:
+            self._reply(503)
+
+    def _reply(self, status, headers=None):
+        body = b"{}"
+        try:
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # asiakas luovutti jo
+
+    def log_message(self, *args):
+        pass
+
+
+def _case(base, path, budget, expect, max_seconds):
+    start = time.monotonic()
+    try:
+        with http_utils.deadline(None if budget is None else start + budget):
+            result = str(http_utils.http_get(f"{base}/{path}", timeout=10).status_code)
+    except requests.RequestException as e:
+        result = type(e).__name__
+    elapsed = time.monotonic() - start
+    ok = result == expect and elapsed <= max_seconds
+    label = "ei määräaikaa" if budget is None else f"määräaika {budget:g} s"
+    print(f"  {path:<12} {label:<15} {_hits[path]:>2} kyselyä  {elapsed:5.2f} s  → {result:<12} "
+          f"{'ok' if ok else f'ODOTETTU {expect} ≤ {max_seconds:g} s'}")
+    return ok
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    print(f"stub {base}, uusintoja {http_utils.MAX_RETRIES}, BACKOFF_MAX {http_utils.BACKOFF_MAX:g} s")
+
+    cases = [
+        ("flaky", None, "200", 3.0),
+        # 3 uusintaa × rajattu Retry-After (1 s), ei 3 × 3600 s
+        ("retry-after", None, "429", 3 * http_utils.BACKOFF_MAX + 1.0),
+    ]
+    ok = all([_case(base, *c) for c in cases])
+    _hits.clear()
+    cases = [
+        ("retry-after", 0.5, "ReadTimeout", 0.5),
+        ("down", 2.0, "503", 2.0),
+        ("hang", 1.0, "ReadTimeout", 1.5),
+    ]
+    ok = all([_case(base, *c) for c in cases]) and ok
+    server.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+bench_i18n.py — get_text()-läpäisykyvyn mikrobenchmark
+KSHM-projekti
+
+Vertaa esikäännettyä katalogia vanhaan toteutukseen, joka rakensi koko
+get_translation_templates()-sanakirjan jokaisella kutsulla.
+
+Käyttö:
+  cd backend && python bench_i18n.py [kierrokset]
+"""
+
+from __future__ import annotations
+import sys
+import time
+from typing import Optional
+
+import i18n_utils
+from i18n_utils import get_text, get_translation_templates, get_default_language
+
+
+def _legacy_get_text(key: str, lang: Optional[str] = None, **kwargs) -> str:
+    """Alkuperäinen toteutus ennen katalogia — vain vertailua varten."""
+    templates = get_translation_templates()
+    lang = lang or get_default_language()
+    if key not in templates:
+        raise KeyError(f"Translation key not found: {key}")
+    translations = templates[key]
+    template = translations.get(lang) or translations.get(get_default_language())
+    return template.format(**kwargs)
+
+
+# Tyypillinen tarinan kutsujoukko (_safe_get_text-kutsut story_utils:ssa)
+_CALLS = [
+    ("intro", "fi", {"haplogroup": "H1"}),
+    ("intro", "en", {"haplogroup": "U5b1"}),
+    ("intro", "ja", {"haplogroup": "N-M46"}),
+    ("intro", "xx", {"haplogroup": "H1"}),   # tukematon kieli → fallback
+]
+
+
+def _run(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key, lang, kwargs in _CALLS:
+            func(key, lang, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(rounds: int = 20000) -> None:
+    # Tulosten on oltava identtiset
+    for key, lang, kwargs in _CALLS:
+        assert get_text(key, lang, **kwargs) == _legacy_get_text(key, lang, **kwargs)
+
+    i18n_utils._CATALOG = None
+    calls = rounds * len(_CALLS)
+    cold_start = time.perf_counter()
+    get_text("intro", "fi", haplogroup="H1")
+    cold = time.perf_counter() - cold_start
+
+    legacy = _run(_legacy_get_text, rounds)
+    catalog = _run(get_text, rounds)
+
+    print(f"get_text-kutsuja:     {calls}")
+    print(f"katalogin rakennus:   {cold * 1e3:.2f} ms (kerran)")
+    print(f"vanha toteutus:       {calls / legacy:>12,.0f} kutsua/s  ({legacy / calls * 1e6:.2f} µs/kutsu)")
+    print(f"katalogi:             {calls / catalog:>12,.0f} kutsua/s  ({catalog / calls * 1e6:.2f} µs/kutsu)")
+    print(f"nopeutus:             {legacy / catalog:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,197 @@
+"""
+bench_pdf.py — BloodlinePDF:n PDF-kohtainen alustuskustannus
+KSHM-projekti
+
+Vertaa yhden PDF:n alustusta (fontit + tyylit + dokumenttipohja):
+
+  ennen   jokainen BloodlinePDF luki ja parsi kolme TTF-tiedostoa
+          (TTFont) ja rakensi getSampleStyleSheet():n + kuusi omaa tyyliä
+  nyt     fontit rekisteröidään kerran prosessissa ja tyylit rakennetaan
+          kerran fonttijoukkoa kohden (pdf_utils.register_fonts/get_styles)
+
+Lisäksi mitataan kokonainen generate_pdf_from_story esimerkkitarinalla,
+jotta näkyy paljonko alustus oli koko PDF:n ajasta.
+
+Sisällysluettelo: kaksilinjainen raportti (mtDNA + Y-DNA, paljon jaksoja)
+rakennettuna multiBuild-tilassa (ReportLabin TableOfContents, vähintään
+kaksi taittokierrosta) vs. yhden kierroksen tilassa (BloodlinePDF.build).
+
+Fragmenttivälimuisti: sama raportti kokonaan taitettuna vs. välimuistista
+(kansi + tallennettu runko + muistiinpanot yhdistettynä pypdf:llä).
+
+Kuvat: logot + images/-valokuvat (osa kahdesti) sellaisenaan vs.
+image_assets.py:n esiskaalatut johdannaiset — PDF:n koko, taittoaika ja
+arvioitu SMTP-lähetysaika (base64 +33 %, SMTP_MBIT Mbit/s, oletus 10).
+
+Ilman fonttihakemistoa käytetään ReportLabin mukana tulevia Vera-fontteja
+Playfair/Lora-tiedostojen sijaisina (sama TTF-parsinta, eri kirjasin).
+
+Käyttö:
+  cd backend && python bench_pdf.py [fonttihakemisto|-] [kierroksia] [jaksoja/linja]
+"""
+
+from __future__ import annotations
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import reportlab
+
+import image_assets
+import pdf_utils
+
+_FONT_FILES = ("PlayfairDisplay-Regular.ttf", "PlayfairDisplay-Italic.ttf", "Lora-Regular.ttf")
+_VERA = ("Vera.ttf", "VeraIt.ttf", "Vera.ttf")
+
+_STORY = {
+    "title": "U5b1 – Metsästäjä-keräilijöiden perintö",
+    "subtitle": "Äitilinjan matka",
+    "sections": [
+        {"title": f"Luku {i}", "content": "Muinainen DNA kertoo liikkeistä ja kohtaamisista. " * 40}
+        for i in range(1, 9)
+    ],
+}
+
+
+def _lineage_story(title: str, episodes: int) -> dict:
+    return {
+        "title": title,
+        "sections": [
+            {"title": f"{title}: jakso {i} ({12000 - i * 150} BP)",
+             "content": "Näyte, sijainti ja ajoitus kytkeytyvät aikajanaan. " * 25}
+            for i in range(1, episodes + 1)
+        ],
+    }
+
+
+def _image_story() -> dict:
+    photos = sorted(str(p) for p in (image_assets.REPO_ROOT / "images").glob("*.jpg"))[:6]
+    images = [str(image_assets.REPO_ROOT / "logo-3.png"), str(image_assets.REPO_ROOT / "logo-4.png")]
+    images += photos + photos[:2]          # toistuvat kuvat upotetaan kerran
+    return {
+        "title": "Kuvat",
+        "sections": [{"title": os.path.basename(p), "image": p, "content": "Kuvateksti. " * 20}
+                     for p in images],
+    }
+
+
+def _stand_in_fonts(tmp: str) -> str:
+    src = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+    for name, vera in zip(_FONT_FILES, _VERA):
+        shutil.copy(os.path.join(src, vera), os.path.join(tmp, name))
+    return tmp
+
+
+def _per_pdf(fn, rounds: int, warmup: int = 0) -> float:
+    for _ in range(warmup):             # välimuistit ja tuonnit ennen mittausta
+        fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main(font_dir: str, rounds: int, episodes: int) -> None:
+    loaded = pdf_utils.register_fonts(font_dir)
+    print(f"fontit: {font_dir} ({'custom' if loaded else 'EI LÖYTYNYT — builtinit'}), {rounds} kierrosta")
+
+    with tempfile.TemporaryDirectory() as out:
+        path = os.path.join(out, "bench.pdf")
+
+        def old_setup():
+            pdf_utils._register_font_files(font_dir)
+            pdf_utils._build_styles.__wrapped__(pdf_utils.font_names())
+            pdf_utils.BloodlinePDF(path)
+
+        def new_setup():
+            pdf_utils.BloodlinePDF(path)
+
+        def full_pdf():
+            pdf_utils.generate_pdf_from_story(_STORY, output_path=path, use_cache=False)
+
+        old = _per_pdf(old_setup, rounds)
+        new = _per_pdf(new_setup, rounds)
+        full = _per_pdf(full_pdf, rounds)
+
+    print(f"alustus ennen:        {old:8.2f} ms / PDF")
+    print(f"alustus nyt:          {new:8.2f} ms / PDF   ({old / max(new, 1e-6):.0f}x)")
+    print(f"koko PDF nyt:         {full:8.2f} ms / PDF")
+    print(f"koko PDF ennen (arv): {full + old - new:8.2f} ms / PDF   "
+          f"(alustus {100 * (old - new) / (full + old - new):.0f} % ajasta)")
+
+    mt = _lineage_story("mtDNA U5b1", episodes)
+    y = _lineage_story("Y-DNA N-L550", episodes)
+    # Yksi kylmä ajo ei erota multiBuildin kahta taittokierrosta kohinasta
+    toc_rounds = max(rounds // 5, 3)
+    print(f"\nkaksilinjainen raportti, {episodes} jaksoa / linja, {toc_rounds} kierrosta:")
+    with tempfile.TemporaryDirectory() as out:
+        timings = {}
+        for label, multipass in (("multiBuild", True), ("yksi kierros", False)):
+            path = os.path.join(out, f"{multipass}.pdf")
+            ms = _per_pdf(lambda: pdf_utils.generate_pdf_from_story(
+                mt, story_y=y, output_path=path, notes="Muistiinpanot", multipass=multipass,
+                use_cache=False), toc_rounds, warmup=1)
+            timings[label] = ms
+            print(f"  {label:<13} {ms:9.1f} ms / PDF   {os.path.getsize(path) / 1024:7.0f} kt")
+    print(f"  nopeutus      {timings['multiBuild'] / timings['yksi kierros']:9.2f}x")
+
+    if pdf_utils.PdfWriter is None:
+        print("\nfragmenttivälimuisti: pypdf puuttuu, ohitetaan")
+        return
+    print(f"\nfragmenttivälimuisti, {toc_rounds} kierrosta:")
+    with tempfile.TemporaryDirectory() as out, tempfile.TemporaryDirectory() as frags:
+        pdf_utils.FRAGMENT_DIR = frags
+        path = os.path.join(out, "frag.pdf")
+
+        def render(use_cache, user):
+            pdf_utils.generate_pdf_from_story(mt, story_y=y, output_path=path, user_name=user,
+                                              notes="Muistiinpanot", use_cache=use_cache)
+
+        full = _per_pdf(lambda: render(False, "Testi"), toc_rounds, warmup=1)
+        start = time.perf_counter()
+        render(True, "Ensimmäinen")
+        cold = (time.perf_counter() - start) * 1000
+        users = iter(range(toc_rounds))
+        warm = _per_pdf(lambda: render(True, f"Tilaaja {next(users)}"), toc_rounds)
+    print(f"  koko taitto   {full:9.1f} ms / PDF")
+    print(f"  kylmä         {cold:9.1f} ms (runko tallennetaan)")
+    print(f"  lämmin        {warm:9.1f} ms / PDF   ({full / max(warm, 1e-6):.1f}x)")
+
+    if not image_assets.enabled():
+        print("\nkuvat: Pillow puuttuu, ohitetaan")
+        return
+    story = _image_story()
+    mbit = float(os.getenv("SMTP_MBIT", 10))
+    print(f"\nkuvat ({len(story['sections'])} kpl), {toc_rounds} kierrosta:")
+    with tempfile.TemporaryDirectory() as out, tempfile.TemporaryDirectory() as assets:
+        image_assets.ASSET_DIR = assets
+        pil = image_assets.Image
+        results = {}
+        for label, on in (("sellaisenaan", False), ("esiskaalattu", True)):
+            image_assets.Image = pil if on else None
+            if on:  # johdannaiset luodaan ennen mittausta (levyvälimuisti)
+                image_assets._prepare_cached.cache_clear()
+                pdf_utils.generate_pdf_from_story(story, output_path=os.path.join(out, "warm.pdf"),
+                                                  use_cache=False)
+            path = os.path.join(out, f"{on}.pdf")
+            ms = _per_pdf(lambda: pdf_utils.generate_pdf_from_story(story, output_path=path, use_cache=False),
+                          toc_rounds)
+            size = os.path.getsize(path)
+            results[label] = size
+            upload = size * 4 / 3 * 8 / (mbit * 1e6)
+            print(f"  {label:<13} {ms:9.1f} ms / PDF   {size / 1024:7.0f} kt   SMTP ~{upload:5.1f} s")
+        image_assets.Image = pil
+    print(f"  koko          {results['sellaisenaan'] / results['esiskaalattu']:9.1f}x pienempi")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    rounds = int(args[1]) if len(args) > 1 else 20
+    episodes = int(args[2]) if len(args) > 2 else 60
+    if args and args[0] != "-":
+        main(args[0], rounds, episodes)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            main(_stand_in_fonts(tmp), rounds, episodes)
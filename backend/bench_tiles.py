@@ -0,0 +1,100 @@
+"""
+bench_tiles.py — Karttatiilien hyötykuorma vs. raa'at näytelistat
+KSHM-projekti
+
+Vertaa kolmea tapaa ladata kerroksen näytteet kartalle:
+
+  raaka lista   kaikki näytteet täysinä dicteinä (kuten /samples-tyyppinen
+                vastaus tai get_clade_tree_samples ilman ylärajaa)
+  tiilet        tile_builder.py:n esiklusteroidut tiilet jotka osuvat
+                Eurooppa-näkymään (bbox -12,34,45,72) kullakin zoomilla
+  geo-haku      /api/research/geo-vastaus samalle näkymälle (ad hoc)
+
+Tiilet rakennetaan väliaikaiseen hakemistoon, joten ajo ei koske
+varsinaisiin tiiliin. Lisäksi mitataan inkrementaalinen uudelleenajo
+(ei muutoksia → kerroksia ei kirjoiteta).
+
+Käyttö:
+  cd backend && python bench_tiles.py [anno_path] [kerros ...]
+"""
+
+from __future__ import annotations
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aadr_db
+import geo_index
+import tile_builder
+
+_VIEW = (-12.0, 34.0, 45.0, 72.0)
+
+
+def _viewport_tiles(zoom: int):
+    x0, y0 = tile_builder.tile_of(_VIEW[0], _VIEW[3], zoom)
+    x1, y1 = tile_builder.tile_of(_VIEW[2], _VIEW[1], zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def _raw_size(lineage: str, layer: str, anno_path: str) -> int:
+    points = tile_builder.layer_points(lineage, anno_path)[layer]
+    samples = []
+    for lon, lat, bp, ref in points:
+        kind, row = ref
+        samples.append(aadr_db.get_sample_row(row, anno_path) if kind == "aadr"
+                       else tile_builder.finnish_samples_db.get_sample_row(row))
+    return len(json.dumps(samples, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def _geo_size(lineage: str, layer: str, zoom: int, anno_path: str) -> int:
+    points = tile_builder.collect_points(_VIEW, None if layer == "all" else layer,
+                                         lineage, anno_path=anno_path)
+    collection = geo_index.feature_collection(
+        points, zoom, lambda ref: tile_builder.sample_props(ref, lineage, anno_path),
+    )
+    return len(json.dumps(collection, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def main(anno_path: str, layers) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        tile_dir = Path(tmp)
+        start = time.perf_counter()
+        stats = tile_builder.build_pyramid(anno_path, tile_dir, lineages=("mt",))
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        again = tile_builder.build_pyramid(anno_path, tile_dir, lineages=("mt",))
+        warm = time.perf_counter() - start
+
+        print(f"pyramidi (mt):        {stats['built']} kerrosta, {stats['tiles']} tiiltä, "
+              f"{stats['bytes'] / 1024:.0f} kt — {cold:.2f} s")
+        print(f"uudelleenajo:         {again['built']} rakennettu, {again['unchanged']} ennallaan — {warm:.2f} s")
+
+        manifest = tile_builder.load_manifest(tile_dir)["layers"]
+        layers = layers or ["all"] + [m["clade"] for m in sorted(
+            manifest.values(), key=lambda m: -m["samples"]) if m["clade"] != "all"][:3]
+
+        for layer in layers:
+            meta = manifest.get(f"mt/{tile_builder.layer_name(layer)}")
+            if meta is None:
+                print(f"\nkerros {layer}: ei tiiliä")
+                continue
+            raw = _raw_size("mt", layer, anno_path)
+            print(f"\nkerros mt/{layer}: {meta['samples']} näytettä, raaka lista {raw / 1024:.0f} kt")
+            print(f"  {'zoom':>4} {'tiiliä':>7} {'tiilet kt':>10} {'max tiili':>10} {'geo-haku kt':>12} {'vs. raaka':>10}")
+            for zoom in range(meta["max_zoom"] + 1):
+                sizes = []
+                for x, y in _viewport_tiles(zoom):
+                    path = tile_builder.tile_path("mt", layer, zoom, x, y, meta["fingerprint"], tile_dir)
+                    if path.is_file():
+                        sizes.append(path.stat().st_size)
+                total = sum(sizes)
+                geo = _geo_size("mt", layer, zoom, anno_path)
+                print(f"  {zoom:>4} {len(sizes):>7} {total / 1024:>10.1f} {max(sizes or [0]) / 1024:>10.1f} "
+                      f"{geo / 1024:>12.1f} {raw / max(total, 1):>9.1f}x")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if args else aadr_db.DEFAULT_ANNO_PATH, args[1:])
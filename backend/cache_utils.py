@@ -0,0 +1,241 @@
+"""
+cache_utils.py — Kaksitasoinen TTL-välimuisti (muisti-LRU + SQLite)
+KSHM-projekti
+
+Taso 1: prosessin sisäinen LRU (OrderedDict) — kuuma polku, ei I/O:ta.
+Taso 2: SQLite-tiedosto levyllä — jaettu kaikkien työprosessien kesken
+        ja säilyy uudelleenkäynnistysten yli.
+
+Jokaisella merkinnällä on vanhenemisaika (TTL). Vanhentunut merkintä on
+"stale": se palautetaan silti kutsujalle (stale-while-revalidate) ja
+kutsuja päivittää sen taustalla. Vasta kun merkintä on ollut vanhentuneena
+yli max_stale-ajan, se tulkitaan puuttuvaksi.
+
+Lukitus: globaali lukko suojaa vain muistitasoa. SQLite-luvut ja
+-kirjoitukset tehdään lukon ulkopuolella säiekohtaisilla yhteyksillä (WAL
+sallii rinnakkaiset lukijat), joten hidas levy ei sarjallista muiden
+avainten muistiosumia. Saman avaimen samanaikaiset levyluvut yhdistetään
+(single-flight): vain yksi säie lukee, muut odottavat sen tulosta.
+Kirjoitukset (harvinaisia) sarjallistetaan omalla lukollaan, jotta
+muisti- ja levytaso saavat samat arvot samassa järjestyksessä; lukijat
+eivät odota sitä.
+
+Arvot tallennetaan JSON-muodossa, joten niiden on oltava JSON-kelpoisia.
+Palautettuja arvoja ei pidä muokata — ne jaetaan kaikkien lukijoiden kesken.
+
+Käyttö:
+  cache = TieredTTLCache("haplogroup_cache.sqlite3", namespace="haplogroup")
+  value, state = cache.get("H1")        # state: "fresh" | "stale" | "miss"
+  cache.set("H1", data, ttl=3600)
+  cache.stats()                         # osuma-/ohilaskurit
+"""
+
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FRESH = "fresh"
+STALE = "stale"
+MISS  = "miss"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace  TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+class TieredTTLCache:
+    def __init__(
+        self,
+        path: Optional[str],
+        namespace: str = "default",
+        max_items: int = 256,
+        max_stale: float = 7 * 24 * 3600,
+    ):
+        """
+        Args:
+            path:       SQLite-tiedoston polku; tyhjä/None → vain muistitaso
+            namespace:  erottaa eri käyttäjät samassa tiedostossa
+            max_items:  LRU-tason koko
+            max_stale:  kuinka kauan vanhentunutta arvoa saa vielä tarjoilla (s)
+        """
+        self._path      = path or None
+        self._namespace = namespace
+        self._max_items = max_items
+        self._max_stale = max_stale
+        self._lru: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._loading: Dict[str, threading.Event] = {}
+        self._stats: Dict[str, int] = {
+            "memory_hits": 0, "disk_hits": 0, "stale_hits": 0,
+            "misses": 0, "sets": 0, "disk_errors": 0,
+        }
+
+    # -----------------------------------------------------
+    # Levytaso
+    # -----------------------------------------------------
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """Säie- ja prosessikohtainen yhteys — avataan uudelleen fork():n jälkeen."""
+        if not self._path:
+            return None
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def _disk_error(self) -> None:
+        with self._lock:
+            self._stats["disk_errors"] += 1
+
+    def _disk_get(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            db = self._db()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self._namespace, key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disk_error()
+            logger.warning(f"Välimuistin luku epäonnistui ({key}): {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, payload: str, expires_at: float) -> None:
+        try:
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self._namespace, key, payload, expires_at),
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            self._disk_error()
+            logger.warning(f"Välimuistin kirjoitus epäonnistui ({key}): {e}")
+
+    def _load(self, key: str) -> Tuple[Optional[Tuple[Any, float]], str]:
+        """
+        Merkintä muistista tai levyltä → (merkintä, tilastoavain). Levyluku
+        tehdään lukon ulkopuolella; saman avaimen rinnakkaiset lukijat
+        odottavat ensimmäisen tulosta (single-flight).
+        """
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                return entry, "memory_hits"
+            waiter = self._loading.get(key)
+            owner = waiter is None
+            if owner:
+                waiter = self._loading[key] = threading.Event()
+
+        if not owner:
+            waiter.wait()
+            with self._lock:
+                return self._lru.get(key), "disk_hits"
+
+        entry = None
+        try:
+            entry = self._disk_get(key)
+        finally:
+            with self._lock:
+                current = self._lru.get(key)
+                if current is not None:
+                    entry = current          # set() ehti väliin: uudempi arvo voittaa
+                elif entry is not None:
+                    self._remember(key, entry)
+                del self._loading[key]
+            waiter.set()
+        return entry, "disk_hits"
+
+    # -----------------------------------------------------
+    # Julkinen API
+    # -----------------------------------------------------
+
+    def get(self, key: str) -> Tuple[Optional[Any], str]:
+        """Palauttaa (arvo, tila) jossa tila on FRESH, STALE tai MISS."""
+        entry, source = self._load(key)
+        now = time.time()
+        with self._lock:
+            if entry is None or now > entry[1] + self._max_stale:
+                self._stats["misses"] += 1
+                return None, MISS
+
+            value, expires_at = entry
+            if now > expires_at:
+                self._stats["stale_hits"] += 1
+                return value, STALE
+            self._stats[source] += 1
+            return value, FRESH
+
+    def set(self, key: str, value: Any, ttl: float) -> Any:
+        """Tallentaa arvon molemmille tasoille ja palauttaa tallennetun (JSON-normalisoidun) arvon."""
+        expires_at = time.time() + ttl
+        # Sarjallistetaan kerran: muistitasolle tallennetaan sama JSON-muoto
+        # kuin levylle, jotta molemmat tasot palauttavat identtisen arvon.
+        payload = json.dumps(value, ensure_ascii=False)
+        stored = json.loads(payload)
+        # _write_lock: kaksi samanaikaista set():iä päätyy molemmille
+        # tasoille samassa järjestyksessä. get() ei ota tätä lukkoa.
+        with self._write_lock:
+            with self._lock:
+                self._remember(key, (stored, expires_at))
+                self._stats["sets"] += 1
+            self._disk_set(key, payload, expires_at)
+        return stored
+
+    def invalidate(self, key: str) -> None:
+        with self._write_lock:
+            with self._lock:
+                self._lru.pop(key, None)
+            try:
+                db = self._db()
+                if db is not None:
+                    db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self._namespace, key))
+                    db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Välimuistin tyhjennys epäonnistui ({key}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["memory_items"] = len(self._lru)
+        hits = out["memory_hits"] + out["disk_hits"] + out["stale_hits"]
+        total = hits + out["misses"]
+        out["hit_ratio"] = round(hits / total, 3) if total else 0.0
+        return out
+
+    def _remember(self, key: str, entry: Tuple[Any, float]) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max_items:
+            self._lru.popitem(last=False)
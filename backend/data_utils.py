@@ -1,115 +1,111 @@
-import requests
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
+import os
 import re
 import json
+import time
+import threading
 import logging
 
+from cache_utils import TieredTTLCache, FRESH, STALE
+from haplo_normalize import Haplogroup, resolve, cache_stats as normalize_cache_stats
+from http_utils import deadline, http_get
+
 logger = logging.getLogger(__name__)
 
 # ------------------------------
-# Lineage type detection
+# Lähteiden rinnakkaishaku
 # ------------------------------
 
-# Y-DNA haplogroup root letters (ISOGG-standardin mukaan)
-_Y_DNA_ROOTS = frozenset("ABCDEFGHIJKLMNOPQRST")
-
-# mtDNA haplogroup root letters
-_MT_DNA_ROOTS = frozenset([
-    "L", "M", "N",          # makrohaplogrupit
-    "A", "B", "C", "D",     # Aasia / Amerikat
-    "E", "F", "G",           # Aasia
-    "H", "HV",               # Eurooppa
-    "I", "J", "K",           # Eurooppa / Lähi-itä
-    "P", "Q", "R",           # Oseania / Etelä-Aasia
-    "T", "U", "V", "W", "X", "Y", "Z",  # Eurooppa / Aasia
-])
-
-# Eksplisiittinen Y-DNA-etuliitteiden lista — nämä ovat yksiselitteisesti Y-DNA:ta
-# vaikka niiden juurikirjain löytyy myös mtDNA:sta
-_Y_DNA_EXPLICIT_PREFIXES = (
-    "A0", "A00", "A1", "A2", "A3",
-    "B2", "B4",
-    "C1", "C2", "C3",
-    "DE", "D1", "D2",
-    "E1", "E2",
-    "F1", "F2",
-    "G1", "G2",
-    # H1/H2 poistettu — konfliktoi mtDNA:n kanssa
-    "I1", "I2",
-    # J1/J2 poistettu — J1/J2 on sekä Y-DNA (J1a, J2a) että mtDNA (J1c, J2b)
-    # ilman kolmatta kirjainta/numeroa ei voida erottaa → ambiguous
-    # K1/K2 poistettu — konfliktoi mtDNA:n kanssa
-    "L1",
-    # M1 poistettu — konfliktoi mtDNA:n kanssa
-    "N1", "N2",
-    "O1", "O2",
-    "P1",
-    "Q1",
-    "R1", "R2",
-    "S1",
-    # T1 poistettu — konfliktoi mtDNA:n kanssa
-)
-
-# mtDNA-etuliitteet — tarkistetaan VASTA Y-DNA-tarkistuksen jälkeen
-_MT_DNA_EXPLICIT_PREFIXES = (
-    "MT-", "MTDNA",
-    "L0", "L1", "L2", "L3", "L4", "L5", "L6",
-    "M1", "M2", "M3", "M4", "M5", "M6", "M7", "M8", "M9",
-    "HV0", "HV1", "HV2",
-    "H1", "H2", "H3", "H4", "H5", "H6", "H7",
-    "U1", "U2", "U3", "U4", "U5", "U6", "U7", "U8",
-    "K1", "K2",
-    "T1", "T2",
-    "X2",
-)
-
+# Koko haun aikabudjetti sekunteina — tämän jälkeen valmistumattomat lähteet ohitetaan
+FETCH_BUDGET_SECONDS = float(os.getenv("KSHM_FETCH_BUDGET", 12.0))
 
-def detect_lineage_type(haplogroup: str) -> str:
-    """
-    Tunnistaa haploryhmän linjatypin (Y-DNA / mtDNA / ambiguous).
-
-    Logiikka (järjestys on tärkeä — Y-DNA tarkistetaan ennen mtDNA):
-    1. Alkaa MT- tai MTDNA- → yksiselitteisesti mtDNA
-    2. Alkaa Y-kirjaimella → Y-DNA
-    3. Eksplisiittiset Y-DNA-etuliitteet → Y-DNA  (tarkistetaan ENNEN mtDNA)
-    4. Eksplisiittiset mtDNA-etuliitteet → mtDNA
-    5. Yksittäiskirjaimet joita käytetään vain mtDNA:ssa → mtDNA
-    6. Muut → "ambiguous" (ei arvata väärin)
-
-    Huom: J1/J2 ovat Y-DNA:ta (ISOGG), H1-H7 ovat mtDNA:ta.
-    Kontekstiriippuvaiset tapaukset (esim. pelkkä "A", "N") → ambiguous.
-    """
-    hg = haplogroup.upper().strip()
-    if not hg:
-        return "ambiguous"
-
-    # 1. Selkeät MT-etuliitteet
-    if hg.startswith("MT-") or hg.startswith("MTDNA"):
-        return "mtDNA"
+# Lähdekohtaiset määräajat; puuttuva lähde saa oletuksen
+_DEFAULT_SOURCE_DEADLINE = float(os.getenv("KSHM_SOURCE_DEADLINE", 5.0))
+SOURCE_DEADLINES: Dict[str, float] = {
+    "fetch_from_pubmed": 10.0,
+}
 
-    # 2. Y-kirjaimella alkavat
-    if hg.startswith("Y"):
-        return "Y-DNA"
+_FETCH_WORKERS = int(os.getenv("KSHM_FETCH_WORKERS", 16))
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
 
-    # 3. Eksplisiittiset Y-DNA-etuliitteet (ENNEN mtDNA-tarkistusta)
-    for prefix in _Y_DNA_EXPLICIT_PREFIXES:
-        if hg.startswith(prefix):
-            return "Y-DNA"
 
-    # 4. Eksplisiittiset mtDNA-etuliitteet
-    for prefix in _MT_DNA_EXPLICIT_PREFIXES:
-        if hg.startswith(prefix):
-            return "mtDNA"
+def _get_executor() -> ThreadPoolExecutor:
+    """Prosessikohtainen säiepooli — luodaan uudelleen fork():n jälkeen."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="kshm-fetch")
+        _executor_pid = os.getpid()
+    return _executor
 
-    # 5. Yksittäiskirjaimet jotka ovat yksiselitteisesti mtDNA-käytössä
-    #    (ei esiinny Y-DNA-puussa juuritasolla)
-    mtdna_only_singles = {"V", "W", "X"}
-    if hg[0] in mtdna_only_singles:
-        return "mtDNA"
 
-    # 6. Epäselvä — ei arvata
-    return "ambiguous"
+class _SourceTask:
+    """
+    Yhden lähteen ajo säiepoolissa. Lähteen määräaika alkaa vasta kun
+    säie ottaa tehtävän (jonotus jaetussa poolissa ei syö sitä), mutta ei
+    koskaan ylitä kutsujan kokonaisbudjettia. Määräaika annetaan myös
+    http_utils.deadline():lle, joten lähteen HTTP-pyynnöt ja niiden
+    uusinnat päättyvät siihen eikä säie jää roikkumaan kutsujan luovuttua.
+    """
 
+    __slots__ = ("func", "seconds", "budget_end", "started", "deadline", "future")
+
+    def __init__(self, func: Callable[[str], Dict], budget_end: float):
+        self.func = func
+        self.seconds = SOURCE_DEADLINES.get(func.__name__, _DEFAULT_SOURCE_DEADLINE)
+        self.budget_end = budget_end
+        self.started = threading.Event()
+        self.deadline = budget_end
+        self.future: Optional[Future] = None
+
+    def __call__(self, haplogroup: str) -> Optional[Dict]:
+        self.deadline = min(time.monotonic() + self.seconds, self.budget_end)
+        self.started.set()
+        if self.deadline <= time.monotonic():
+            return None                      # kutsuja on jo luovuttanut
+        with deadline(self.deadline):
+            return self.func(haplogroup)
+
+    def result(self) -> Optional[Dict]:
+        """Odottaa tulosta määräaikaan asti; FutureTimeout jos ei ehdi."""
+        if not self.started.wait(max(0.0, self.budget_end - time.monotonic())):
+            raise FutureTimeout()
+        return self.future.result(timeout=max(0.0, self.deadline - time.monotonic()))
+
+
+def _fan_out(
+    source_funcs: List[Callable[[str], Dict]],
+    haplogroup: str,
+    budget: float = FETCH_BUDGET_SECONDS,
+) -> List[Tuple[Callable[[str], Dict], Optional[Dict]]]:
+    """
+    Kutsuu kaikki lähteet rinnakkain ja palauttaa (funktio, tulos) -parit
+    source_funcs-järjestyksessä, jotta merge_data-tulos pysyy vakaana.
+    Lähde joka kaatuu tai ylittää oman määräaikansa (laskettuna ajon
+    alusta) tai kokonaisbudjetin saa tulokseksi None.
+    """
+    executor = _get_executor()
+    budget_end = time.monotonic() + budget
+    tasks = [_SourceTask(f, budget_end) for f in source_funcs]
+    for task in tasks:
+        task.future = executor.submit(task, haplogroup)
+
+    results: List[Tuple[Callable[[str], Dict], Optional[Dict]]] = []
+    for task in tasks:
+        name = task.func.__name__
+        try:
+            results.append((task.func, task.result()))
+        except FutureTimeout:
+            # Aloittamaton tehtävä poistuu jonosta; käynnissä oleva päättyy
+            # omaan määräaikaansa (http_utils.deadline)
+            task.future.cancel()
+            logger.warning(f"Lähde {name} ylitti määräajan — ohitetaan")
+            results.append((task.func, None))
+        except Exception as e:
+            logger.warning(f"Virhe lähteessä {name}: {e}")
+            results.append((task.func, None))
+    return results
 
 # ------------------------------
 # Structured description fragments
@@ -211,23 +207,101 @@ def calculate_reliability(new_data: Dict) -> int:
     return score
 
 
+# ------------------------------
+# Välimuisti (LRU + SQLite, stale-while-revalidate)
+# ------------------------------
+
+# Lähdekohtaiset TTL:t sekunteina. Koostetun datan TTL on pienin niistä
+# lähteistä, jotka osallistuivat hakuun.
+_DEFAULT_SOURCE_TTL = float(os.getenv("KSHM_SOURCE_TTL", 7 * 24 * 3600))
+SOURCE_TTLS: Dict[str, float] = {
+    "fetch_from_pubmed": 24 * 3600,
+}
+# Jos verkkolähde (SOURCE_TTLS-listalla) epäonnistui, osittainen tulos
+# pidetään välimuistissa vain hetken, ettei katkos jää voimaan päiväksi.
+_DEGRADED_TTL = float(os.getenv("KSHM_DEGRADED_TTL", 300))
+
+_CACHE = TieredTTLCache(
+    os.getenv("KSHM_CACHE_PATH", "haplogroup_cache.sqlite3"),
+    namespace="haplogroup_data",
+    max_items=int(os.getenv("KSHM_CACHE_SIZE", 256)),
+)
+_refreshing: set = set()
+_refresh_lock = threading.Lock()
+
+
+def get_cache_stats() -> Dict:
+    """Välimuistin osuma-/ohilaskurit (debug-endpointia varten)."""
+    stats = _CACHE.stats()
+    stats["refreshing"] = len(_refreshing)
+    stats["normalize"] = normalize_cache_stats()
+    return stats
+
+
+def _refresh_in_background(hg: Haplogroup) -> None:
+    """Päivittää vanhentuneen merkinnän taustalla; sama avain vain kerran kerrallaan."""
+    key = hg.cache_key
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def _run():
+        try:
+            data, ttl = _aggregate_haplogroup_data(hg)
+            _CACHE.set(key, data, ttl)
+        except Exception as e:
+            logger.warning(f"Taustapäivitys epäonnistui ({key}): {e}")
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=_run, name=f"kshm-refresh-{key}", daemon=True).start()
+
+
 # ------------------------------
 # Core interface
 # ------------------------------
 
-def fetch_full_haplogroup_data(haplogroup: str) -> Dict:
+def fetch_full_haplogroup_data(haplogroup: str, lineage: Optional[str] = None) -> Dict:
     """
     Yhdistää globaalisti useista lähteistä haploryhmädataa ja palauttaa
     yhtenäisen arkeogeneettisen tietorakenteen.
     Tämä moduuli EI muodosta käyttäjätekstiä – vain raakadataa ja faktarakenteita.
+
+    Tulos tulee välimuistista jos mahdollista. Vanhentunut tulos palautetaan
+    heti ja päivitetään taustalla, joten kuuma polku ei odota verkkoa.
+    Palautettua sanakirjaa ei pidä muokata.
+
+    Nimi ratkaistaan kanoniseksi (haplo_normalize): Y-linjalla
+    "n1c1a1a1a1" ja "N-L550" jakavat saman välimuistimerkinnän. lineage
+    ("mt"/"y") on vihje silloin kun linja tiedetään (tilauksen kentät);
+    ilman sitä vanhat ISOGG-nimet jäävät epäselviksi eivätkä muutu Y:ksi.
     """
-    haplogroup = haplogroup.upper().strip()
-    if not re.match(r'^[A-Z0-9-]+$', haplogroup):
-        raise ValueError(f"Virheellinen haploryhmä: {haplogroup}")
+    hg = resolve(haplogroup, lineage)
+    if not hg.valid:
+        raise ValueError(f"Virheellinen haploryhmä: {hg.id}")
+
+    cached, state = _CACHE.get(hg.cache_key)
+    if state == FRESH:
+        return cached
+    if state == STALE:
+        _refresh_in_background(hg)
+        return cached
+
+    data, ttl = _aggregate_haplogroup_data(hg)
+    return _CACHE.set(hg.cache_key, data, ttl)
+
 
+def _aggregate_haplogroup_data(hg: Haplogroup) -> Tuple[Dict, float]:
+    """
+    Varsinainen koostaminen kaikista lähteistä.
+    Palauttaa (data, ttl) jossa ttl on osallistuneiden lähteiden pienin TTL.
+    """
+    haplogroup = hg.id
     data: Dict = {
         "haplogroup": haplogroup,
-        "lineage_type": detect_lineage_type(haplogroup),
+        "lineage_type": hg.lineage_type,
         "description_fragments": [],   # List[DescriptionFragment]
         "regions": [],
         "ancient_samples": [],
@@ -291,9 +365,15 @@ def fetch_full_haplogroup_data(haplogroup: str) -> Dict:
         fetch_analysis_tools,
     ]
 
-    for source_func in source_funcs:
+    # Lähteet haetaan rinnakkain; yhdistäminen tehdään aina source_funcs-järjestyksessä
+    ttl = _DEFAULT_SOURCE_TTL
+    for source_func, new_data in _fan_out(source_funcs, haplogroup):
+        name = source_func.__name__
+        if name in SOURCE_TTLS:
+            ttl = min(ttl, SOURCE_TTLS[name] if new_data else _DEGRADED_TTL)
+        if new_data is None:
+            continue
         try:
-            new_data = source_func(haplogroup)
             data = merge_data(data, new_data)
             data["reliability_score"] += calculate_reliability(new_data)
         except Exception as e:
@@ -337,7 +417,7 @@ def fetch_full_haplogroup_data(haplogroup: str) -> Dict:
 
     data["reliability_score"] = min(100, data["reliability_score"])
 
-    return data
+    return data, ttl
 
 
 # ------------------------------
@@ -425,15 +505,21 @@ def render_fragments(fragments: List[DescriptionFragment], lang: str = "en") ->
 # Dynaamiset lähteet
 # ------------------------------
 
+# Verkkolähteiden osoitteet — ylikirjoitettavissa (esim. paikallinen stub-palvelin)
+PUBMED_ESEARCH_URL = os.getenv(
+    "PUBMED_ESEARCH_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+)
+
+
 def fetch_from_pubmed(haplogroup: str) -> Dict:
     try:
-        url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+        url = PUBMED_ESEARCH_URL
         params = {
             "db": "pubmed",
             "term": f"{haplogroup} haplogroup ancient DNA",
             "retmode": "xml",
         }
-        response = requests.get(url, params=params, timeout=10)
+        response = http_get(url, params=params, timeout=10)
         if response.status_code == 200:
             count_match = re.search(r'<Count>(\d+)</Count>', response.text)
             num_papers = int(count_match.group(1)) if count_match else 0
@@ -16,6 +16,9 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_EMAIL = os.getenv("SMTP_EMAIL", "raportit@kshm.fi")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SENDER_NAME = os.getenv("SENDER_NAME", "Kadonneen Sukuhistorian Metsästäjä")
+# Yhteyden ja yksittäisen SMTP-komennon aikaraja sekunteina: jumiutunut
+# palvelin ei saa pitää tilauksen työprosessia ikuisesti
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 60))
 
 
 # -----------------------------
@@ -32,7 +35,7 @@ def _send_email_message(msg: EmailMessage) -> bool:
     context = ssl.create_default_context()
 
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT) as server:
             server.starttls(context=context)
             server.login(SMTP_EMAIL, SMTP_PASSWORD)
             server.send_message(msg)
@@ -149,10 +152,10 @@ def send_story_email_from_haplogroup(
     Luo tarinan, PDF:n ja lähettää sähköpostin yhdellä kutsulla.
     """
     from story_utils import generate_story_from_haplogroup
-    from pdf_utils import generate_pdf
+    import render_service
 
     story = generate_story_from_haplogroup(haplogroup, lang=lang, tone=tone)
-    generate_pdf(story, filename=pdf_path, lang=lang)
+    render_service.render_pdf(story, output_path=pdf_path, lang=lang)
 
     return send_email_with_pdf(
         to_email=to_email,
@@ -177,10 +180,10 @@ def send_dual_story_email_from_haplogroups(
     """
 
     from story_utils import generate_dual_story_from_haplogroups
-    from pdf_utils import generate_pdf
+    import render_service
 
     story = generate_dual_story_from_haplogroups(y_haplogroup, mt_haplogroup, lang=lang, tone=tone)
-    generate_pdf(story, filename=pdf_path, lang=lang)
+    render_service.render_pdf(story, output_path=pdf_path, lang=lang)
 
     return send_email_with_pdf(
         to_email=to_email,
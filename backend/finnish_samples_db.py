@@ -38,6 +38,9 @@ import logging
 from collections import defaultdict
 from typing import Dict, List, Optional, Tuple
 
+from geo_index import WORLD, BBox, GeoGrid, bp_range, bp_within
+from haplo_index import HaplogroupTrie
+
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -375,6 +378,8 @@ class _FinnishIndex:
         self._by_mt:   Dict[str, List[Dict]] = defaultdict(list)
         self._by_site: Dict[str, List[Dict]] = defaultdict(list)
         self._all:     List[Dict] = []
+        self._mt_trie  = HaplogroupTrie()
+        self._geo      = GeoGrid((), ())
         self._loaded = False
 
     def _load(self,
@@ -419,6 +424,9 @@ class _FinnishIndex:
         self._by_mt   = by_mt
         self._by_site = by_site
         self._all     = list({s["id"]: s for s in all_samples}.values())
+        self._mt_trie = HaplogroupTrie(by_mt.keys())
+        # Sijaintiruudukko bbox-hakuihin — rivi = indeksi self._all-listassa
+        self._geo     = GeoGrid([s.get("lat") for s in self._all], [s.get("lon") for s in self._all])
         self._loaded  = True
 
         logger.info(f"Finnish DB ladattu: {len(self._all)} uniikkia näytettä, "
@@ -427,6 +435,8 @@ class _FinnishIndex:
     def get_by_mt(self)   -> Dict[str, List[Dict]]: self._load(); return self._by_mt
     def get_by_site(self) -> Dict[str, List[Dict]]: self._load(); return self._by_site
     def get_all(self)     -> List[Dict]:             self._load(); return self._all
+    def get_mt_trie(self) -> HaplogroupTrie:         self._load(); return self._mt_trie
+    def get_geo(self)     -> GeoGrid:                self._load(); return self._geo
 
 
 _INDEX = _FinnishIndex()
@@ -436,23 +446,10 @@ _INDEX = _FinnishIndex()
 # Etuliitehaku
 # ---------------------------------------------------------------------------
 
-def _prefix_lookup(index: Dict[str, List[Dict]], haplogroup: str) -> List[Dict]:
-    """Pisin etuliiteosuma — sama logiikka kuin aadr_db.py:ssä."""
-    hg_up = haplogroup.upper().strip()
-
-    # Täsmällinen
-    for key, samples in index.items():
-        if key.upper() == hg_up:
-            return samples
-
-    # Pisin etuliite
-    best_key, best_len = None, 0
-    for key in index:
-        k = key.upper()
-        if hg_up.startswith(k) and len(k) > best_len:
-            best_key, best_len = key, len(k)
-
-    return index[best_key] if best_key else []
+def _prefix_lookup(index: Dict[str, List[Dict]], trie: HaplogroupTrie, haplogroup: str) -> List[Dict]:
+    """Täsmällinen tai pisin etuliiteosuma — sama etuliitepuu kuin aadr_db.py:ssä."""
+    key = trie.lookup(haplogroup)
+    return index[key] if key else []
 
 
 # ---------------------------------------------------------------------------
@@ -474,7 +471,7 @@ def get_finnish_samples(
         Lista näytteistä vanhimmasta uusimpaan.
     """
     index = _INDEX.get_by_mt()
-    samples = _prefix_lookup(index, haplogroup)
+    samples = _prefix_lookup(index, _INDEX.get_mt_trie(), haplogroup)
     dated   = sorted([s for s in samples if s["date_ce"] is not None], key=lambda x: x["date_ce"])
     undated = [s for s in samples if s["date_ce"] is None]
     return (dated + undated)[:n]
@@ -531,6 +528,43 @@ def get_sample_count(haplogroup: str) -> int:
     return len(get_finnish_samples(haplogroup, n=9999))
 
 
+def get_geo_points(
+    bbox: BBox = WORLD,
+    haplogroup: Optional[str] = None,
+    from_bp: Optional[int] = None,
+    to_bp: Optional[int] = None,
+) -> List[Tuple[float, float, Optional[int], int]]:
+    """
+    Kartan näytteet alueelta: [(lon, lat, date_bp, rivi)] — sama muoto kuin
+    aadr_db.get_geo_points(). haplogroup rajaa koko kladipuuhun (mtDNA).
+    """
+    grid    = _INDEX.get_geo()
+    samples = _INDEX.get_all()
+    keys: Optional[set] = None
+    if haplogroup:
+        trie = _INDEX.get_mt_trie()
+        keys = set(trie.descendants(haplogroup)) or {k for k in (trie.lookup(haplogroup),) if k}
+
+    oldest, youngest = bp_range(from_bp, to_bp)
+    dated = oldest is not None or youngest is not None
+
+    out: List[Tuple[float, float, Optional[int], int]] = []
+    for r in grid.query(bbox):
+        s = samples[r]
+        if keys is not None and s.get("mt") not in keys:
+            continue
+        bp = None if s.get("date_ce") is None else 1950 - s["date_ce"]
+        if dated and not bp_within(bp, oldest, youngest):
+            continue
+        out.append((grid.lon[r], grid.lat[r], bp, r))
+    return out
+
+
+def get_sample_row(row: int) -> Dict:
+    """Yksittäinen näyte rivinumerolla (get_geo_points():n palauttama)."""
+    return _INDEX.get_all()[row]
+
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
@@ -0,0 +1,240 @@
+"""
+geo_index.py — Ruudukkoindeksi näytteiden sijainneille + klusterointi
+KSHM-projekti
+
+Karttasivut (map.html, u5a1_map.html, w3a1_map.html) tarvitsevat vain
+näkyvän alueen näytteet. GeoGrid jakaa pisteet kiinteän kokoisiin
+lat/lon-ruutuihin (oletus 1°), joten bbox-haku käy läpi vain alueen
+ruudut eikä koko aineistoa. Indeksi rakennetaan kerran aadr_db:n ja
+finnish_samples_db:n latauksessa; pisteen tunniste on lähteen rivinumero.
+
+Matalilla zoom-tasoilla pisteet yhdistetään palvelimella klustereiksi
+(ruutu ≈ 1/4 karttatiilen leveydestä), ja klustereiden määrää
+karkeutetaan kunnes tulos mahtuu max_features-rajaan — vastauksen koko
+on rajattu riippumatta siitä, montako näytettä alueella on.
+
+Käyttö:
+  grid   = GeoGrid(lat_array, lon_array)
+  rows   = grid.query(parse_bbox("19.0,59.5,32.0,70.5"))
+  geo    = feature_collection(points, zoom=5, feature_props=lambda ref: {...})
+
+Ympäristömuuttujat:
+  GEO_GRID_CELL_DEG      — indeksiruudun koko asteina (oletus: 1.0)
+  GEO_CLUSTER_MAX_ZOOM   — tästä zoomista alkaen yksittäiset pisteet (oletus: 8)
+  GEO_MAX_FEATURES       — GeoJSON-piirteiden enimmäismäärä (oletus: 2000)
+"""
+
+from __future__ import annotations
+import math
+import os
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+GRID_CELL_DEG     = float(os.getenv("GEO_GRID_CELL_DEG", 1.0))
+CLUSTER_MAX_ZOOM  = int(os.getenv("GEO_CLUSTER_MAX_ZOOM", 8))
+MAX_FEATURES      = int(os.getenv("GEO_MAX_FEATURES", 2000))
+
+# (min_lon, min_lat, max_lon, max_lat) — GeoJSON-järjestys
+BBox = Tuple[float, float, float, float]
+
+# (lon, lat, date_bp tai None, viite) — viite annetaan takaisin feature_props:lle
+GeoPoint = Tuple[float, float, Optional[int], Any]
+
+WORLD: BBox = (-180.0, -90.0, 180.0, 90.0)
+
+
+def parse_bbox(text: Optional[str]) -> BBox:
+    """
+    "min_lon,min_lat,max_lon,max_lat" → BBox. Tyhjä → koko maailma.
+    min_lon > max_lon tarkoittaa päivämäärärajan ylitystä (sallittu).
+    """
+    if not text:
+        return WORLD
+    parts = text.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox: odotettiin 4 lukua (min_lon,min_lat,max_lon,max_lat)")
+    min_lon, min_lat, max_lon, max_lat = (float(p) for p in parts)
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise ValueError("bbox: arvojen on oltava äärellisiä")
+    if min_lat > max_lat:
+        raise ValueError("bbox: min_lat > max_lat")
+    return (
+        max(min_lon, -180.0), max(min_lat, -90.0),
+        min(max_lon, 180.0), min(max_lat, 90.0),
+    )
+
+
+def _split_antimeridian(bbox: BBox) -> List[BBox]:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        return [bbox]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+
+def _as_float_array(values: Sequence[Optional[float]]) -> array:
+    """array("d") sellaisenaan, muuten kopio jossa None → NaN."""
+    if isinstance(values, array) and values.typecode == "d":
+        return values
+    return array("d", (math.nan if v is None else float(v) for v in values))
+
+
+class GeoGrid:
+    """
+    Kiinteä lat/lon-ruudukko: (ruutu_x, ruutu_y) → rivinumerot.
+    Rivit joilta puuttuu koordinaatti (None/NaN) jätetään pois.
+    """
+
+    __slots__ = ("cell", "lat", "lon", "_cells", "_size")
+
+    def __init__(
+        self,
+        lat: Sequence[Optional[float]],
+        lon: Sequence[Optional[float]],
+        cell_deg: float = GRID_CELL_DEG,
+    ):
+        self.cell = cell_deg
+        self.lat = _as_float_array(lat)
+        self.lon = _as_float_array(lon)
+        cells: Dict[Tuple[int, int], array] = {}
+        size = 0
+        for r, (la, lo) in enumerate(zip(self.lat, self.lon)):
+            if la != la or lo != lo:             # NaN
+                continue
+            key = (self._cell_of(lo), self._cell_of(la))
+            bucket = cells.get(key)
+            if bucket is None:
+                bucket = cells[key] = array("I")
+            bucket.append(r)
+            size += 1
+        self._cells = cells
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell_of(self, deg: float) -> int:
+        return math.floor(deg / self.cell)
+
+    def query(self, bbox: BBox = WORLD) -> Iterator[int]:
+        """Rivit bbox:n sisällä (reunat mukaan lukien), ruutujärjestyksessä."""
+        lat, lon = self.lat, self.lon
+        for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox):
+            x0, x1 = self._cell_of(min_lon), self._cell_of(max_lon)
+            y0, y1 = self._cell_of(min_lat), self._cell_of(max_lat)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+                # Laaja alue: ruutuja on vähemmän kuin alueen ruutuavaimia
+                keys = [k for k in self._cells if x0 <= k[0] <= x1 and y0 <= k[1] <= y1]
+            else:
+                keys = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+            for key in keys:
+                bucket = self._cells.get(key)
+                if bucket is None:
+                    continue
+                inner = x0 < key[0] < x1 and y0 < key[1] < y1
+                for r in bucket:
+                    if inner or (min_lon <= lon[r] <= max_lon and min_lat <= lat[r] <= max_lat):
+                        yield r
+
+
+def in_bbox(lon: float, lat: float, bbox: BBox) -> bool:
+    """Yksittäisen pisteen tarkistus (myös päivämäärärajan ylittävä bbox)."""
+    return any(
+        min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+        for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox)
+    )
+
+
+def bp_range(from_bp: Optional[int], to_bp: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    from_bp/to_bp → (vanhin, nuorin) BP. from_bp = aikavälin alku (vanhempi
+    pää), to_bp = loppu; jos molemmat annetaan, järjestyksellä ei ole väliä.
+    """
+    if from_bp is not None and to_bp is not None and from_bp < to_bp:
+        from_bp, to_bp = to_bp, from_bp
+    return from_bp, to_bp
+
+
+def bp_within(date_bp: Optional[int], oldest: Optional[int], youngest: Optional[int]) -> bool:
+    """Päiväämätön näyte ei osu mihinkään aikaväliin."""
+    if date_bp is None:
+        return False
+    return (oldest is None or date_bp <= oldest) and (youngest is None or date_bp >= youngest)
+
+
+# ---------------------------------------------------------------------------
+# Klusterointi ja GeoJSON
+# ---------------------------------------------------------------------------
+
+def cluster_cell_deg(zoom: int) -> float:
+    """Klusteriruudun leveys asteina: ~1/4 web mercator -tiilen leveydestä."""
+    return 360.0 / (2 ** max(zoom, 0) * 4)
+
+
+def _cluster(points: Sequence[GeoPoint], cell: float) -> Tuple[List[GeoPoint], List[Dict]]:
+    buckets: Dict[Tuple[int, int], List[GeoPoint]] = {}
+    for p in points:
+        buckets.setdefault((math.floor(p[0] / cell), math.floor(p[1] / cell)), []).append(p)
+
+    singles: List[GeoPoint] = []
+    clusters: List[Dict] = []
+    for members in buckets.values():
+        if len(members) == 1:
+            singles.append(members[0])
+            continue
+        n = len(members)
+        dates = [p[2] for p in members if p[2] is not None]
+        clusters.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [
+                    round(sum(p[0] for p in members) / n, 5),
+                    round(sum(p[1] for p in members) / n, 5),
+                ],
+            },
+            "properties": {
+                "cluster":     True,
+                "point_count": n,
+                "oldest_bp":   max(dates) if dates else None,
+                "youngest_bp": min(dates) if dates else None,
+            },
+        })
+    return singles, clusters
+
+
+def feature_collection(
+    points: Sequence[GeoPoint],
+    zoom: int,
+    feature_props: Callable[[Any], Dict],
+    max_features: int = MAX_FEATURES,
+) -> Dict:
+    """
+    GeoJSON FeatureCollection pisteistä. zoom < CLUSTER_MAX_ZOOM → klusterit;
+    jos piirteitä olisi yli max_features, klusteriruutua kasvatetaan
+    (myös suurella zoomilla) kunnes tulos mahtuu rajaan.
+    """
+    clustered = zoom < CLUSTER_MAX_ZOOM or len(points) > max_features
+    if clustered:
+        cell = cluster_cell_deg(zoom)
+        singles, clusters = _cluster(points, cell)
+        while len(singles) + len(clusters) > max_features and cell < 360.0:
+            cell *= 2
+            singles, clusters = _cluster(points, cell)
+    else:
+        singles, clusters = list(points), []
+
+    features = clusters
+    for lon, lat, date_bp, ref in singles:
+        props = feature_props(ref)
+        props["date_bp"] = date_bp
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": props,
+        })
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "sample_count": len(points),
+        "clustered": clustered,
+    }
@@ -0,0 +1,112 @@
+"""
+haplo_index.py — Jaettu etuliitepuu (trie) haploryhmähakuihin
+KSHM-projekti
+
+aadr_db, finnish_samples_db, ancient_samples_db ja basal_markers tekevät
+kaikki saman haun: täsmällinen osuma, muuten pisin etuliiteosuma (ja
+aadr_db:ssä lisäksi koko kladipuu). Aiemmin jokainen kävi kaikki avaimet
+läpi ja kutsui .upper() jokaiselle avaimelle jokaisella haulla.
+
+HaplogroupTrie rakennetaan kerran indeksin latauksessa. Avaimet
+normalisoidaan (isot kirjaimet, ei välilyöntejä eikä ~-päätettä) ja
+kaikki haut ovat O(haun pituus):
+
+  exact(hg)               → täsmällinen avain tai None
+  longest_prefix(hg, n)   → pisin avain joka on hg:n etuliite (väh. n merkkiä)
+  lookup(hg, n)           → exact, muuten longest_prefix
+  descendants(hg)         → kaikki avaimet jotka alkavat hg:llä (kladipuu)
+
+Palautetut avaimet ovat alkuperäisiä (normalisoimattomia) avaimia, joten
+niillä voi indeksoida alkuperäistä sanakirjaa. Jos useampi avain
+normalisoituu samaksi, ensimmäisenä lisätty voittaa — sama tulos kuin
+aiemmalla lineaarisella haulla.
+
+Käyttö:
+  trie = HaplogroupTrie(index.keys())
+  key  = trie.lookup("U5b1b1a1")          # esim. "U5b1"
+  keys = trie.descendants("U5")           # kaikki U5*-avaimet
+"""
+
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional
+
+
+def normalize_key(haplogroup: str) -> str:
+    """Hakuavaimen normalisointi: isot kirjaimet, ei välilyöntejä eikä ~-päätettä."""
+    return haplogroup.upper().strip().rstrip("~")
+
+
+class _Node:
+    __slots__ = ("children", "key", "order")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.key: Optional[str] = None     # alkuperäinen avain jos tähän päättyy avain
+        self.order: int = -1               # lisäysjärjestys (vakaa tulosjärjestys)
+
+
+class HaplogroupTrie:
+    __slots__ = ("_root", "_size")
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self._root = _Node()
+        self._size = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: str) -> None:
+        node = self._root
+        for ch in normalize_key(key):
+            nxt = node.children.get(ch)
+            if nxt is None:
+                nxt = node.children[ch] = _Node()
+            node = nxt
+        if node.key is None:
+            node.key = key
+            node.order = self._size
+            self._size += 1
+
+    def _walk(self, hg_norm: str) -> Optional[_Node]:
+        node = self._root
+        for ch in hg_norm:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def exact(self, haplogroup: str) -> Optional[str]:
+        node = self._walk(normalize_key(haplogroup))
+        return node.key if node is not None else None
+
+    def longest_prefix(self, haplogroup: str, min_len: int = 1) -> Optional[str]:
+        best: Optional[str] = None
+        node = self._root
+        for depth, ch in enumerate(normalize_key(haplogroup), start=1):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.key is not None and depth >= min_len:
+                best = node.key
+        return best
+
+    def lookup(self, haplogroup: str, min_len: int = 1) -> Optional[str]:
+        """Täsmällinen osuma, muuten pisin etuliiteosuma."""
+        return self.exact(haplogroup) or self.longest_prefix(haplogroup, min_len)
+
+    def descendants(self, haplogroup: str) -> List[str]:
+        """Kaikki avaimet jotka alkavat haplogroup-etuliitteellä, lisäysjärjestyksessä."""
+        start = self._walk(normalize_key(haplogroup))
+        if start is None:
+            return []
+        found: List[_Node] = []
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                found.append(node)
+            stack.extend(node.children.values())
+        found.sort(key=lambda n: n.order)
+        return [n.key for n in found]
@@ -0,0 +1,263 @@
+"""
+haplo_normalize.py — Haploryhmänimien normalisointi (kanoninen ID + linja)
+KSHM-projekti
+
+Käyttäjän syöte voi olla "u5b1~", "N1c1a1a1a1" (vanha ISOGG-nimi),
+"N-L550" (terminaali-SNP) tai tutkimus-JSONin alias. Aiemmin aadr_db,
+research_api, data_utils ja tilausputki normalisoivat nimen kukin
+omalla tavallaan jokaisella kutsulla. Nyt nimi ratkaistaan kerran:
+
+  resolve(hg, lineage)       → Haplogroup(id, lineage, valid)
+  canonical_id(hg, lineage)  → pelkkä kanoninen ID
+
+Kanoninen ID = isot kirjaimet, ei reunavälilyöntejä eikä ~-päätettä
+(sama kuin haplo_index.normalize_key), ja Y-DNA:n vaihtoehtoiset nimet
+korvattu _Y_ALIASES-taulukon kanonisella SNP-nimellä. Funktio on
+idempotentti: resolve(resolve(x).id, resolve(x).lineage) == resolve(x),
+joten jo ratkaistun ID:n välittäminen eteenpäin on turvallista ja
+toinen kutsu on pelkkä LRU-osuma.
+
+Linja: "mt" | "y" | None (epäselvä). Vihje (lineage="mt"/"y"/"mtDNA"/
+"Y-DNA") voittaa aina; ilman vihjettä linja päätellään nimestä
+(SNP-muotoinen nimi tai alias → y, muuten detect_lineage_type).
+Alias-taulukkoa käytetään vain Y-linjalle — mtDNA:n N1c on eri asia kuin
+Y:n N1c. Siksi pelkkä taulukossa oleminen ei tee nimestä Y-nimeä: vanhat
+ISOGG-nimet (N1c, N3) ovat myös mtDNA-nimiä, joten ilman vihjettä ne
+jäävät epäselviksi (linja None) ja Y-tulkinta vaatii vihjeen "y".
+
+Tutkimus-JSONien aliakset (research_api) avainnetaan saman
+canonical_id():n kautta, joten "h1-t16189c~" ja "H1-T16189C" osuvat
+samaan raporttiin.
+
+Käyttö:
+  hg = resolve("N1c1", "y")          # Haplogroup('N-M46', 'y')
+  hg = resolve("n1c1", "mt")         # Haplogroup('N1C1', 'mt')
+  hg = resolve("n1c1")               # Haplogroup('N1C1', None)
+  canonical_id("U5b1~", "mt")       # 'U5B1'
+"""
+
+from __future__ import annotations
+import re
+from functools import lru_cache
+from typing import Dict, Optional
+
+from haplo_index import normalize_key
+
+_CACHE_SIZE = 4096
+
+# Kelvollinen kanoninen ID (data_utils hylkää muut ennen lähdehakuja)
+_VALID_ID = re.compile(r"^[A-Z0-9-]+$")
+
+# Y-DNA:n SNP-muotoinen nimi: "N-L550", "R-M269", "I-M253"
+_SNP_NAME = re.compile(r"^[A-Z]{1,2}-[A-Z]+[0-9]")
+
+
+# ---------------------------------------------------------------------------
+# Y-DNA: vaihtoehtoiset nimet → kanoninen SNP-nimi (N-Tat nimikaos)
+# ---------------------------------------------------------------------------
+
+_Y_ALIASES: Dict[str, str] = {
+    # SNP-pohjaiset
+    "N-M46": "N-M46",   "N-TAT": "N-M46",
+    "N-P105": "N-M46",  "N-M178": "N-M46",
+    # Vanhat ISOGG-nimet
+    "N3": "N-M46",      "N1C": "N-M46",     "N1C1": "N-M46",
+    # Eurooppalaiset SNP-nimet
+    "N-L1026": "N-L1026",
+    "N-VL29":  "N-L1026",
+    "N-L550":  "N-L550",
+    "N-Z1936": "N-Z1936",
+    "N-Z1925": "N-Z1936",
+    # Eupedian vanhat ISOGG-nimet
+    "N1C1A1A1A1": "N-L550",
+    "N1C1A1A1A2": "N-Z1936",
+    "N1C1A1A": "N-L1026",
+}
+
+
+# ---------------------------------------------------------------------------
+# Linjan tunnistus
+# ---------------------------------------------------------------------------
+
+# Y-DNA haplogroup root letters (ISOGG-standardin mukaan)
+_Y_DNA_ROOTS = frozenset("ABCDEFGHIJKLMNOPQRST")
+
+# mtDNA haplogroup root letters
+_MT_DNA_ROOTS = frozenset([
+    "L", "M", "N",          # makrohaplogrupit
+    "A", "B", "C", "D",     # Aasia / Amerikat
+    "E", "F", "G",           # Aasia
+    "H", "HV",               # Eurooppa
+    "I", "J", "K",           # Eurooppa / Lähi-itä
+    "P", "Q", "R",           # Oseania / Etelä-Aasia
+    "T", "U", "V", "W", "X", "Y", "Z",  # Eurooppa / Aasia
+])
+
+# Eksplisiittinen Y-DNA-etuliitteiden lista — nämä ovat yksiselitteisesti Y-DNA:ta
+# vaikka niiden juurikirjain löytyy myös mtDNA:sta
+_Y_DNA_EXPLICIT_PREFIXES = (
+    "A0", "A00", "A1", "A2", "A3",
+    "B2", "B4",
+    "C1", "C2", "C3",
+    "DE", "D1", "D2",
+    "E1", "E2",
+    "F1", "F2",
+    "G1", "G2",
+    # H1/H2 poistettu — konfliktoi mtDNA:n kanssa
+    "I1", "I2",
+    # J1/J2 poistettu — J1/J2 on sekä Y-DNA (J1a, J2a) että mtDNA (J1c, J2b)
+    # ilman kolmatta kirjainta/numeroa ei voida erottaa → ambiguous
+    # K1/K2 poistettu — konfliktoi mtDNA:n kanssa
+    "L1",
+    # M1 poistettu — konfliktoi mtDNA:n kanssa
+    "N1", "N2",
+    "O1", "O2",
+    "P1",
+    "Q1",
+    "R1", "R2",
+    "S1",
+    # T1 poistettu — konfliktoi mtDNA:n kanssa
+)
+
+# mtDNA-etuliitteet — tarkistetaan VASTA Y-DNA-tarkistuksen jälkeen
+_MT_DNA_EXPLICIT_PREFIXES = (
+    "MT-", "MTDNA",
+    "L0", "L1", "L2", "L3", "L4", "L5", "L6",
+    "M1", "M2", "M3", "M4", "M5", "M6", "M7", "M8", "M9",
+    "HV0", "HV1", "HV2",
+    "H1", "H2", "H3", "H4", "H5", "H6", "H7",
+    "U1", "U2", "U3", "U4", "U5", "U6", "U7", "U8",
+    "K1", "K2",
+    "T1", "T2",
+    "X2",
+)
+
+
+def detect_lineage_type(haplogroup: str) -> str:
+    """
+    Tunnistaa haploryhmän linjatypin (Y-DNA / mtDNA / ambiguous).
+
+    Logiikka (järjestys on tärkeä — Y-DNA tarkistetaan ennen mtDNA):
+    1. Alkaa MT- tai MTDNA- → yksiselitteisesti mtDNA
+    2. Alkaa Y-kirjaimella → Y-DNA
+    3. Eksplisiittiset Y-DNA-etuliitteet → Y-DNA  (tarkistetaan ENNEN mtDNA)
+    4. Eksplisiittiset mtDNA-etuliitteet → mtDNA
+    5. Yksittäiskirjaimet joita käytetään vain mtDNA:ssa → mtDNA
+    6. Muut → "ambiguous" (ei arvata väärin)
+
+    Huom: J1/J2 ovat Y-DNA:ta (ISOGG), H1-H7 ovat mtDNA:ta.
+    Kontekstiriippuvaiset tapaukset (esim. pelkkä "A", "N") → ambiguous.
+    """
+    hg = haplogroup.upper().strip()
+    if not hg:
+        return "ambiguous"
+
+    # 1. Selkeät MT-etuliitteet
+    if hg.startswith("MT-") or hg.startswith("MTDNA"):
+        return "mtDNA"
+
+    # 2. Y-kirjaimella alkavat
+    if hg.startswith("Y"):
+        return "Y-DNA"
+
+    # 3. Eksplisiittiset Y-DNA-etuliitteet (ENNEN mtDNA-tarkistusta)
+    for prefix in _Y_DNA_EXPLICIT_PREFIXES:
+        if hg.startswith(prefix):
+            return "Y-DNA"
+
+    # 4. Eksplisiittiset mtDNA-etuliitteet
+    for prefix in _MT_DNA_EXPLICIT_PREFIXES:
+        if hg.startswith(prefix):
+            return "mtDNA"
+
+    # 5. Yksittäiskirjaimet jotka ovat yksiselitteisesti mtDNA-käytössä
+    #    (ei esiinny Y-DNA-puussa juuritasolla)
+    mtdna_only_singles = {"V", "W", "X"}
+    if hg[0] in mtdna_only_singles:
+        return "mtDNA"
+
+    # 6. Epäselvä — ei arvata
+    return "ambiguous"
+
+
+_LINEAGE_HINTS: Dict[str, str] = {
+    "mt": "mt", "mtdna": "mt", "mitochondrial": "mt",
+    "y": "y", "y-dna": "y", "ydna": "y",
+}
+
+_LINEAGE_TYPES = {"mt": "mtDNA", "y": "Y-DNA", None: "ambiguous"}
+_LINEAGE_OF_TYPE = {"mtDNA": "mt", "Y-DNA": "y"}
+
+
+def normalize_lineage(lineage: Optional[str]) -> Optional[str]:
+    """"mt"/"mtDNA"/"Y-DNA"/"y" → "mt" | "y"; tuntematon tai tyhjä → None."""
+    if not lineage:
+        return None
+    return _LINEAGE_HINTS.get(lineage.strip().lower())
+
+
+# ---------------------------------------------------------------------------
+# Ratkaisu
+# ---------------------------------------------------------------------------
+
+class Haplogroup:
+    """Ratkaistu haploryhmä. Muuttumaton; jaetaan LRU:sta kaikille kutsujille."""
+
+    __slots__ = ("id", "lineage", "valid")
+
+    def __init__(self, id: str, lineage: Optional[str]):
+        self.id = id
+        self.lineage = lineage
+        self.valid = bool(_VALID_ID.match(id))
+
+    @property
+    def lineage_type(self) -> str:
+        """data_utils-muoto: "mtDNA" | "Y-DNA" | "ambiguous"."""
+        return _LINEAGE_TYPES[self.lineage]
+
+    @property
+    def cache_key(self) -> str:
+        """Välimuistiavain: sama ID eri linjoilla (esim. J1A) on eri haploryhmä."""
+        return f"{self.id}@{self.lineage}" if self.lineage else self.id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Haplogroup) and (self.id, self.lineage) == (other.id, other.lineage)
+
+    def __hash__(self) -> int:
+        return hash((self.id, self.lineage))
+
+    def __repr__(self) -> str:
+        return f"Haplogroup({self.id!r}, {self.lineage!r})"
+
+
+def _infer_lineage(key: str) -> Optional[str]:
+    if key in _Y_ALIASES:
+        # SNP-muotoinen alias ("N-TAT") on Y:tä; vanha ISOGG-nimi (N1C1, N3)
+        # on myös mtDNA-nimi → epäselvä, vaikka detect_lineage_type sanoisi Y
+        return "y" if "-" in key else None
+    if not key.startswith("MT") and _SNP_NAME.match(key):
+        return "y"
+    return _LINEAGE_OF_TYPE.get(detect_lineage_type(key))
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def resolve(haplogroup: str, lineage: Optional[str] = None) -> Haplogroup:
+    """
+    Mikä tahansa syöte → Haplogroup(kanoninen ID, linja).
+    lineage on vihje ("mt"/"y"/"mtDNA"/"Y-DNA"); None → päätellään nimestä.
+    """
+    key = normalize_key(haplogroup or "")
+    line = normalize_lineage(lineage) or (_infer_lineage(key) if key else None)
+    if line == "y":
+        key = _Y_ALIASES.get(key, key)
+    return Haplogroup(key, line)
+
+
+def canonical_id(haplogroup: str, lineage: Optional[str] = None) -> str:
+    return resolve(haplogroup, lineage).id
+
+
+def cache_stats() -> Dict[str, int]:
+    """LRU:n osuma-/ohilaskurit (debug-endpointia varten)."""
+    info = resolve.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,193 @@
+"""
+http_utils.py — Jaettu HTTP-asiakaskerros verkkopohjaisille lähteille
+KSHM-projekti
+
+Kaikki data_utils.fetch_from_* -funktiot jotka tekevät oikeaa verkko-I/O:ta
+käyttävät tätä moduulia suoran requests.get-kutsun sijaan:
+
+  - yksi requests.Session per prosessi → TCP/TLS-yhteydet uudelleenkäytetään
+    (keep-alive), kättelyä ei tehdä joka tilaukselle uudestaan
+  - rajattu yhteysmäärä per isäntä (pool_block=True → ylimenevät odottavat)
+  - uusintayritykset 429/5xx-vastauksille eksponentiaalisella, satunnaistetulla
+    viiveellä; Retry-After-otsaketta noudatetaan (NCBI:n rajoitukset), mutta
+    enintään KSHM_HTTP_BACKOFF_MAX sekuntia kerrallaan
+  - määräaika: deadline()-lohkon sisällä jokaisen pyynnön aikaraja on
+    enintään jäljellä oleva aika, eikä uusintayritystä odoteta jos viive
+    ylittäisi määräajan (→ requests.ReadTimeout). Kutsuja (data_utils._fan_out)
+    ei siis jätä säiettä roikkumaan tuntikausiksi Retry-After: 3600 -vastauksen
+    jälkeen
+
+Ympäristömuuttujat:
+  KSHM_HTTP_POOL_SIZE     — yhteyksiä per isäntä (oletus: 8)
+  KSHM_HTTP_RETRIES       — uusintayritysten enimmäismäärä (oletus: 3)
+  KSHM_HTTP_BACKOFF       — perusviive sekunteina (oletus: 0.5)
+  KSHM_HTTP_BACKOFF_MAX   — viiveen yläraja sekunteina (oletus: 10)
+
+Lähteiden osoitteet ovat ympäristömuuttujilla ylikirjoitettavissa, joten
+koko kerrosta voi testata paikallista stub-palvelinta vasten, esim.
+  PUBMED_ESEARCH_URL=http://127.0.0.1:8099/esearch.fcgi
+
+Käyttö:
+  from http_utils import http_get, deadline
+  with deadline(time.monotonic() + 10):
+      response = http_get(url, params={...}, timeout=10)
+
+Tarkistus stub-palvelinta vasten: cd backend && python bench_http.py
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Asetukset
+# ---------------------------------------------------------------------------
+
+POOL_SIZE     = int(os.getenv("KSHM_HTTP_POOL_SIZE", 8))
+MAX_RETRIES   = int(os.getenv("KSHM_HTTP_RETRIES", 3))
+BACKOFF       = float(os.getenv("KSHM_HTTP_BACKOFF", 0.5))
+BACKOFF_MAX   = float(os.getenv("KSHM_HTTP_BACKOFF_MAX", 10))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+USER_AGENT = "KSHM/1.1 (+https://kshm.fi)"
+
+
+# ---------------------------------------------------------------------------
+# Määräaika (säiekohtainen)
+# ---------------------------------------------------------------------------
+
+_deadline = threading.local()
+
+
+@contextmanager
+def deadline(at: Optional[float]) -> Iterator[None]:
+    """
+    Lohkon pyynnöille absoluuttinen määräaika (time.monotonic()-aikaa).
+    Sisäkkäisissä lohkoissa aiempi määräaika voittaa. None → ei rajaa.
+    """
+    previous = getattr(_deadline, "at", None)
+    if at is not None and previous is not None:
+        at = min(at, previous)
+    _deadline.at = at if at is not None else previous
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+def remaining_time() -> Optional[float]:
+    """Sekunteja määräaikaan, tai None jos määräaikaa ei ole asetettu."""
+    at = getattr(_deadline, "at", None)
+    return None if at is None else at - time.monotonic()
+
+
+class _BoundedRetry(Retry):
+    """
+    Retry jonka Retry-After-odotus on rajattu BACKOFF_MAX:iin ja joka
+    luovuttaa heti, jos seuraava odotus ylittäisi säikeen määräajan.
+    """
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, BACKOFF_MAX)
+
+    def sleep(self, response=None) -> None:
+        remaining = remaining_time()
+        if remaining is not None:
+            wait = self.get_retry_after(response) if (self.respect_retry_after_header and response) else None
+            if not wait:
+                wait = self.get_backoff_time()
+            if wait >= remaining:
+                raise ReadTimeoutError(None, None, f"määräaika ylittyisi ({wait:.1f} s odotus, {remaining:.1f} s jäljellä)")
+        super().sleep(response)
+
+
+def _build_retry() -> Retry:
+    kwargs = dict(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        backoff_factor=BACKOFF,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        # urllib3 >= 2: satunnaistettu viive ja yläraja
+        return _BoundedRetry(backoff_jitter=BACKOFF, backoff_max=BACKOFF_MAX, **kwargs)
+    except TypeError:
+        return _BoundedRetry(**kwargs)
+
+
+def build_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """Uusi Session jolla on rajattu yhteyspooli ja uusintayrityslogiikka."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=_build_retry(),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+# ---------------------------------------------------------------------------
+# Prosessikohtainen singleton
+# ---------------------------------------------------------------------------
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Palauttaa prosessin jaetun Sessionin. fork():n jälkeen lapsiprosessi
+    luo oman — yhteyspoolia ei jaeta prosessien kesken.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def close_session() -> None:
+    """Sulkee jaetun Sessionin (esim. sammutuksessa)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def http_get(url: str, params: Optional[Dict] = None, timeout: float = 10, **kwargs) -> requests.Response:
+    """
+    requests.get-yhteensopiva GET jaetun Sessionin kautta. deadline()-lohkossa
+    aikaraja lyhenee jäljellä olevaan aikaan; ylittynyt määräaika → ReadTimeout.
+    """
+    remaining = remaining_time()
+    if remaining is not None:
+        if remaining <= 0:
+            raise requests.ReadTimeout(f"määräaika ylitetty ennen pyyntöä: {url}")
+        timeout = min(timeout, remaining)
+    return get_session().get(url, params=params, timeout=timeout, **kwargs)
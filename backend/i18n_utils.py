@@ -1,4 +1,11 @@
-from typing import Dict, List, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+import logging
+import string
+import threading
+
+logger = logging.getLogger(__name__)
 
 
 SUPPORTED_LANGUAGES = [
@@ -1270,13 +1277,48 @@ def get_translation_templates() -> Dict[str, Dict[str, str]]:
     }
 
 
+# ---------------------------------------------------------------------------
+# KÄÄNNÖSKATALOGI
+# get_translation_templates() rakentaa koko sanakirjan joka kutsulla, joten
+# sitä ei kutsuta get_text():stä. Katalogi rakennetaan kerran ensimmäisellä
+# käytöllä muuttumattomaksi (avain, kieli) → template -taulukoksi, jossa
+# fallback-ketju (haluttu kieli → oletuskieli) on jo ratkaistu.
+# ---------------------------------------------------------------------------
+
+_CATALOG: Optional[Mapping[Tuple[str, str], str]] = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def _build_catalog() -> Mapping[Tuple[str, str], str]:
+    default = get_default_language()
+    catalog: Dict[Tuple[str, str], str] = {}
+    for key, translations in get_translation_templates().items():
+        fallback = translations.get(default)
+        for lang in set(SUPPORTED_LANGUAGES) | set(translations):
+            template = translations.get(lang) or fallback
+            if template:
+                catalog[(key, lang)] = template
+    return MappingProxyType(catalog)
+
+
+def _get_catalog() -> Mapping[Tuple[str, str], str]:
+    global _CATALOG
+    if _CATALOG is None:
+        with _CATALOG_LOCK:
+            if _CATALOG is None:
+                _CATALOG = _build_catalog()
+    return _CATALOG
+
+
 def get_text(key: str, lang: Optional[str] = None, **kwargs) -> str:
-    templates = get_translation_templates()
+    catalog = _get_catalog()
     lang = lang or get_default_language()
-    if key not in templates:
-        raise KeyError(f"Translation key not found: {key}")
-    translations = templates[key]
-    template = translations.get(lang) or translations.get(get_default_language())
+    template = catalog.get((key, lang))
+    if template is None:
+        # Tukemattoman kielen tapauksessa oletuskieli
+        template = catalog.get((key, get_default_language()))
+        if template is None:
+            raise KeyError(f"Translation key not found: {key}")
     try:
         return template.format(**kwargs)
     except KeyError as e:
@@ -1585,23 +1627,111 @@ STYLE_PROFILE_TEMPLATES: Dict[str, Dict[str, str]] = {
 }
 
 
-def get_style_profile(lang: str = "en", tone: str = "academic") -> Dict[str, str]:
+# ---------------------------------------------------------------------------
+# KÄÄNNETYT TEMPLATET
+# Jokainen tyyliprofiilin template jäsennetään kerran osiin (literaali, kenttä).
+# Kenttälista tunnetaan latausvaiheessa, joten template jonka kenttiä
+# story_utils ei tarjoa havaitaan heti käännettäessä eikä jokaisessa
+# renderöinnissä KeyErrorina.
+# ---------------------------------------------------------------------------
+
+# Kentät jotka story_utils välittää kullekin osiolle
+STYLE_PROFILE_FIELDS: Dict[str, frozenset] = {
+    "introduction":                 frozenset({"haplogroup", "time_depth", "regions"}),
+    "sample_entry":                 frozenset({"sample_id", "date", "location", "culture", "context"}),
+    "famous_person_entry":          frozenset({"name", "era", "region", "significance"}),
+    "hotspot_entry":                frozenset({"location", "period", "description", "significance"}),
+    "culture_entry":                frozenset({"culture", "period", "region", "description"}),
+    "regional_profile":             frozenset({"region", "time_span", "key_finds", "cultures", "description"}),
+    "modern_distribution":          frozenset({"regions"}),
+    "sources_section":              frozenset({"sources", "providers", "tools", "reliability"}),
+    "legal_section":                frozenset(),
+    "genealogy_comparison_section": frozenset(),
+    "dual_encounters_section":      frozenset({"y", "mt", "regions"}),
+    "dual_love_story_section":      frozenset({"y", "mt"}),
+    "dual_heritage_section":        frozenset({"y", "mt"}),
+    "heritage_section":             frozenset({"haplogroup"}),
+}
+
+_FORMATTER = string.Formatter()
+
+
+class CompiledTemplate:
     """
-    Palauttaa tyyliprofiili-sanakirjan lokalisoituine template-merkkijonoineen.
+    Esijäsennetty str.format-template: kenttälista selvitetään kerran
+    käännettäessä. format(**kwargs) on yhteensopiva str.format:n kanssa;
+    itse renderöinti jätetään C-toteutukselle (format_map), joka on
+    nopeampi kuin Python-tason osien yhdistely.
+    """
+    __slots__ = ("source", "fields")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.fields = frozenset(
+            field for _, field, _, _ in _FORMATTER.parse(source) if field is not None
+        )
+
+    def format(self, **kwargs) -> str:
+        return self.source.format_map(kwargs)
+
+    def __str__(self) -> str:
+        return self.source
+
+    def __repr__(self) -> str:
+        return f"CompiledTemplate({self.source!r})"
+
+
+def _compile_section(section_key: str, lang: str) -> CompiledTemplate:
+    """
+    Kääntää osion templaten fallback-ketjulla (kieli → en → first available).
+    Jos templaten kentät eivät vastaa STYLE_PROFILE_FIELDS-määrittelyä,
+    siirrytään ketjussa seuraavaan ja kirjataan varoitus kerran.
+    """
+    translations = STYLE_PROFILE_TEMPLATES[section_key]
+    allowed = STYLE_PROFILE_FIELDS.get(section_key)
+    candidates = [
+        (lang, translations.get(lang)),
+        (_DEFAULT_LANG, translations.get(_DEFAULT_LANG)),
+        ("first", next(iter(translations.values()))),
+    ]
+    first: Optional[CompiledTemplate] = None
+    for cand_lang, source in candidates:
+        if not source:
+            continue
+        compiled = CompiledTemplate(source)
+        first = first or compiled
+        if allowed is None or compiled.fields <= allowed:
+            return compiled
+        logger.warning(
+            f"Style template '{section_key}' ({cand_lang}) uses unknown fields "
+            f"{sorted(compiled.fields - allowed)} — falling back"
+        )
+    return first
+
+
+@lru_cache(maxsize=256)
+def _compiled_style_profile(lang: str, tone: str) -> Mapping[str, CompiledTemplate]:
+    return MappingProxyType({
+        section_key: _compile_section(section_key, lang)
+        for section_key in STYLE_PROFILE_TEMPLATES
+    })
+
+
+def get_style_profile(lang: str = "en", tone: str = "academic") -> Mapping[str, CompiledTemplate]:
+    """
+    Palauttaa tyyliprofiilin: osio → käännetty template (CompiledTemplate).
+    Profiili rakennetaan kerran per (kieli, sävy) ja jaetaan kaikkien tarinoiden
+    kesken; sitä ei pidä muokata.
     Fallback-ketju: haluttu kieli → en → first available.
 
     Args:
         lang:  BCP-47-kielikoodi, esim. "fi", "en", "zh"
         tone:  "academic" | "narrative" | "adventure"  (tuleva laajennus)
     """
-    result: Dict[str, str] = {}
-    for section_key, translations in STYLE_PROFILE_TEMPLATES.items():
-        result[section_key] = (
-            translations.get(lang)
-            or translations.get(_DEFAULT_LANG)
-            or next(iter(translations.values()))
-        )
-    return result
+    # Tukemattomat kielet käyttävät oletuskieltä — välimuisti ei kasva käyttäjäsyötteen mukana
+    if lang not in SUPPORTED_LANGUAGES:
+        lang = _DEFAULT_LANG
+    return _compiled_style_profile(lang, tone)
 
 
 def get_style_profile_template(section: str, lang: str = "en") -> str:
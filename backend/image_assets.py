@@ -0,0 +1,263 @@
+"""
+image_assets.py — PDF-kuvien esiskaalaus ja sisältöhashilla avattu välimuisti
+KSHM-projekti
+
+BloodlinePDF.add_image upotti kuvat levyltä sellaisenaan: logo-3.png ja
+logo-4.png ovat ~1 Mt, ja images/-hakemiston valokuvat (ancient_samples_db:n
+"image"-kenttä) jopa 4 Mt ja 2500 px leveitä, vaikka PDF:n palsta on 14 cm.
+Jokainen sähköpostiliite kantoi siis moninkertaisen määrän pikseleitä.
+
+prepare() tekee lähdekuvasta tulostusversion:
+
+  1. skaalaus    leveys enintään palstan leveys × PDF_IMAGE_DPI
+                 (LANCZOS; pienempiä kuvia ei suurenneta)
+  2. pakkaus     läpinäkymätön kuva → JPEG (PDF_IMAGE_QUALITY);
+                 aito alfakanava → PNG (optimize)
+  3. välimuisti  <PDF_IMAGE_CACHE_DIR>/<sha256>_<leveys_px>.jpg|png;
+                 enintään PDF_IMAGE_MAX_FILES tiedostoa, vähiten
+                 käytetyt (mtime) poistetaan — myös vanhan _FORMATin
+
+Avain lasketaan lähteen sisällöstä, ei polusta: sama kuva eri nimillä
+tuottaa saman johdannaisen. ReportLab upottaa saman tiedostonimen
+dokumenttiin vain kerran, joten toistuva kuva päätyy PDF:ään yhtenä
+XObjectina. Lähdettä käytetään sellaisenaan vain, jos se on palstaan
+mahtuva, EXIF-suunnaton baseline-JPEG ja johdannaista pienempi: muut
+muodot ReportLab purkaa raakapikseleiksi, joten niiden tiedostokoko ei
+kerro PDF-kokoa.
+
+Pillow on valinnainen: ilman sitä prepare() palauttaa lähdepolun ja
+PDF:t syntyvät kuten ennenkin.
+
+Ympäristömuuttujat:
+  PDF_IMAGE_DPI          — tulostustarkkuus (oletus: 200)
+  PDF_IMAGE_QUALITY      — JPEG-laatu (oletus: 82)
+  PDF_IMAGE_CACHE_DIR    — johdannaisten hakemisto (oletus: data/pdf_images;
+                           tyhjä = ei levyvälimuistia, johdannainen tehdään
+                           silti kerran prosessissa)
+  PDF_IMAGE_MAX_FILES    — tiedostoja välimuistissa enintään (oletus: 1000)
+
+Käyttö:
+  path = image_assets.prepare("images/lascaux-horse.jpg", width_pt=14 * cm)
+  cd backend && python image_assets.py [kuva ...]   # koko ennen/jälkeen
+"""
+
+from __future__ import annotations
+import hashlib
+import io
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # ei esiskaalausta: kuvat upotetaan sellaisenaan
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT       = Path(__file__).parent.parent
+PRINT_DPI       = int(os.getenv("PDF_IMAGE_DPI", 200))
+JPEG_QUALITY    = int(os.getenv("PDF_IMAGE_QUALITY", 82))
+ASSET_DIR       = os.getenv("PDF_IMAGE_CACHE_DIR", str(REPO_ROOT / "data" / "pdf_images"))
+MAX_FILES       = int(os.getenv("PDF_IMAGE_MAX_FILES", 1000))
+
+# Johdannaisen muoto vaihtuu → vanhat tiedostot eivät enää osu
+# (2: .src-merkintä vain baseline-JPEG-lähteille; 3: ei EXIF-suunnattuja)
+_FORMAT = 3
+
+_MEMORY_DIR = None
+_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    return Image is not None
+
+
+def resolve_path(path: str) -> Optional[str]:
+    """
+    Kuvan polku levyllä. Tietokantojen polut ("images/x.jpg") ovat
+    suhteessa repon juureen, joten ne löytyvät myös backend/-hakemistosta
+    ajettaessa. URL tai puuttuva tiedosto → None.
+    """
+    if not path or "://" in path:
+        return None
+    if os.path.isfile(path):
+        return path
+    candidate = REPO_ROOT / path
+    return str(candidate) if candidate.is_file() else None
+
+
+def target_width_px(width_pt: float, dpi: int = PRINT_DPI) -> int:
+    """Palstan leveys (pt) → pikselit tulostustarkkuudella."""
+    return max(int(math.ceil(width_pt / 72.0 * dpi)), 1)
+
+
+def _cache_dir() -> str:
+    global _MEMORY_DIR
+    if ASSET_DIR:
+        return ASSET_DIR
+    with _LOCK:
+        if _MEMORY_DIR is None:
+            _MEMORY_DIR = tempfile.mkdtemp(prefix="kshm_pdf_images_")
+        return _MEMORY_DIR
+
+
+def _has_alpha(img) -> bool:
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def _embeds_as_is(img, width_px: int) -> bool:
+    """
+    ReportLab upottaa vain baseline-JPEGin sellaisenaan (DCTDecode). Muut
+    (WEBP, PNG, progressiivinen JPEG — myös .jpg-päätteisinä) se purkaa
+    raakapikseleiksi ja Flate-pakkaa, jolloin pieni lähdetiedosto voi
+    paisua PDF:ssä moninkertaiseksi. Vain tällainen lähde voi voittaa
+    johdannaisen tiedostokoolla. ReportLab ei myöskään käännä kuvaa
+    EXIF-suunnan mukaan, joten suuntamerkitty lähde ei kelpaa.
+    """
+    return (img.format == "JPEG" and not img.info.get("progressive")
+            and not img.info.get("progression") and img.mode in ("RGB", "L")
+            and img.width <= width_px and img.getexif().get(0x0112, 1) == 1)
+
+
+def _encode(data: bytes, width_px: int) -> Tuple[bytes, str, bool]:
+    """Lähteen tavut → (johdannaisen tavut, pääte, kelpaako lähde sellaisenaan)."""
+    img = Image.open(io.BytesIO(data))
+    as_is = _embeds_as_is(img, width_px)
+    img = ImageOps.exif_transpose(img)
+    if img.width > width_px:
+        height = max(round(img.height * width_px / img.width), 1)
+        img = img.resize((width_px, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if _has_alpha(img):
+        img.convert("RGBA").save(out, "PNG", optimize=True)
+        return out.getvalue(), "png", as_is
+    img.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue(), "jpg", as_is
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        # mkstemp luo tiedoston tilassa 0600; välimuisti jaetaan API- ja
+        # työprosessikäyttäjien kesken
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _prune(directory: str) -> None:
+    """Pitää välimuistin MAX_FILES tiedostossa; LRU-järjestys = mtime."""
+    try:
+        entries = [e for e in os.scandir(directory) if not e.name.endswith(".tmp")]
+    except OSError:
+        return
+    if len(entries) <= MAX_FILES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+@lru_cache(maxsize=256)
+def _prepare_cached(path: str, mtime_ns: int, size: int, width_px: int) -> str:
+    # mtime_ns/size ovat mukana vain välimuistin avaimessa: muuttunut
+    # lähdetiedosto luetaan ja hashataan uudelleen
+    with open(path, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    stem = os.path.join(_cache_dir(), f"{digest}_{width_px}_v{_FORMAT}")
+    for ext in ("jpg", "png", "src"):
+        cached = f"{stem}.{ext}"
+        try:
+            os.utime(cached)        # LRU-järjestys = mtime
+        except OSError:
+            continue
+        return path if ext == "src" else cached
+
+    try:
+        derived, ext, as_is = _encode(data, width_px)
+    except Exception as e:
+        logger.warning("Kuvan esikäsittely epäonnistui (%s): %s", path, e)
+        return path
+    if as_is and len(derived) >= len(data):
+        # Baseline-JPEG on jo pienempi: merkitään, ettei kuvaa pakata joka kerta uudelleen
+        _write_atomic(f"{stem}.src", b"")
+        _prune(os.path.dirname(stem))
+        return path
+    _write_atomic(f"{stem}.{ext}", derived)
+    _prune(os.path.dirname(stem))
+    logger.info("PDF-kuva %s: %d kt → %d kt", os.path.basename(path),
+                len(data) // 1024, len(derived) // 1024)
+    return f"{stem}.{ext}"
+
+
+def prepare(path: str, width_pt: float, dpi: int = PRINT_DPI) -> Optional[str]:
+    """
+    Tulostusversio kuvasta `path` palstalle jonka leveys on width_pt.
+    Palauttaa johdannaisen polun, lähdepolun (Pillow puuttuu / baseline-
+    JPEG-lähde on jo pienempi / käsittely epäonnistui) tai None jos kuvaa
+    ei löydy.
+    """
+    source = resolve_path(path)
+    if source is None:
+        return None
+    if not enabled():
+        return source
+    st = os.stat(source)
+    key = (os.path.abspath(source), st.st_mtime_ns, st.st_size, target_width_px(width_pt, dpi))
+    out = _prepare_cached(*key)
+    if out != key[0]:
+        try:
+            os.utime(out)           # LRU-järjestys = mtime
+        except OSError:
+            # Toinen prosessi karsi johdannaisen: tehdään se uudelleen
+            _prepare_cached.cache_clear()
+            out = _prepare_cached(*key)
+    return out
+
+
+def cache_stats() -> dict:
+    info = _prepare_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "enabled": enabled()}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if not enabled():
+        sys.exit("Pillow puuttuu (pip install Pillow)")
+    column_pt = 14 / 2.54 * 72
+    paths = sys.argv[1:] or [str(REPO_ROOT / "logo-3.png"), str(REPO_ROOT / "logo-4.png")] + sorted(
+        str(p) for p in (REPO_ROOT / "images").glob("*") if p.is_file())
+    before = after = 0
+    for p in paths:
+        out = prepare(p, column_pt)
+        if out is None:
+            print(f"{p}: ei löydy")
+            continue
+        a, b = os.path.getsize(resolve_path(p)), os.path.getsize(out)
+        before, after = before + a, after + b
+        print(f"{os.path.basename(p):<45} {a / 1024:8.0f} kt → {b / 1024:7.0f} kt")
+    if before:
+        print(f"{'yhteensä':<45} {before / 1024:8.0f} kt → {after / 1024:7.0f} kt ({100 * after / before:.0f} %)")
@@ -2,15 +2,12 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr, Field
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
-import uuid
-import os
 import logging
 
-from data_utils import fetch_full_haplogroup_data
-from story_utils import generate_story_from_haplogroup
-from pdf_utils import generate_pdf_from_story
-from email_utils import send_email_with_pdf
+from data_utils import fetch_full_haplogroup_data, get_cache_stats
+from order_queue import enqueue_order, get_order_status
 
 # ─────────────────────────────────────────────
 # App setup  (app ENSIN, router JÄLKEEN)
@@ -40,6 +37,10 @@ from fastapi import APIRouter
 for route in research_app.routes:
     app.routes.append(route)
 
+# ...ja käynnistys-/sammutuskoukut (research-datan tiedostovahti)
+app.router.on_startup.extend(research_app.router.on_startup)
+app.router.on_shutdown.extend(research_app.router.on_shutdown)
+
 # ─────────────────────────────────────────────
 # Logging
 # ─────────────────────────────────────────────
@@ -66,6 +67,17 @@ class OrderResponse(BaseModel):
     order_id: str
 
 
+class OrderStatus(BaseModel):
+    order_id: str
+    status: str                 # queued | running | done | failed
+    stage: str                  # queued | fetch | story | pdf | email | done
+    error: Optional[str] = None
+    attempts: int
+    created_at: float
+    updated_at: float
+    finished_at: Optional[float] = None
+
+
 # ─────────────────────────────────────────────
 # Routes
 # ─────────────────────────────────────────────
@@ -75,88 +87,37 @@ async def health_check():
     return {"status": "ok", "version": app.version}
 
 
-@app.post("/api/order_report", response_model=OrderResponse)
+@app.post("/api/order_report", response_model=OrderResponse, status_code=202)
 async def order_report(order: OrderRequest):
+    """
+    Tallentaa tilauksen jonoon ja palauttaa heti 202 + order_id.
+    Raporttiputken (data → tarina → PDF → sähköposti) ajaa order_worker.py.
+    """
     try:
         logger.info(f"New report order: {order.haplogroup} for {order.email}")
-
-        # 1. Fetch haplogroup data (mtDNA)
-        haplo_data_mt = fetch_full_haplogroup_data(order.haplogroup)
-        if not haplo_data_mt or "error" in haplo_data_mt:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Haploryhmälle {order.haplogroup} ei löytynyt tietoja."
-            )
-
-        # 2. Fetch Y-DNA jos annettu
-        haplo_data_y = None
-        if order.haplogroup_y:
-            haplo_data_y = fetch_full_haplogroup_data(order.haplogroup_y)
-            if not haplo_data_y or "error" in haplo_data_y:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Haploryhmälle {order.haplogroup_y} ei löytynyt tietoja."
-                )
-
-        # 3. Generoi tarinat
-        story_mt = generate_story_from_haplogroup(
-            haplogroup=order.haplogroup,
-            lang=order.language,
-            tone=order.tone,
-        )
-
-        story_y = None
-        if haplo_data_y:
-            story_y = generate_story_from_haplogroup(
-                haplogroup=order.haplogroup_y,
-                lang=order.language,
-                tone=order.tone,
-            )
-
-        # 4. Generoi PDF
-        order_id = str(uuid.uuid4())[:8]
-        safe_name = order.name.replace(" ", "").replace("/", "")
-        filename = f"{order.haplogroup}_{safe_name}_{order_id}.pdf"
-        output_dir = "generated_reports"
-        os.makedirs(output_dir, exist_ok=True)
-        pdf_path = os.path.join(output_dir, filename)
-
-        generate_pdf_from_story(
-            story_mt=story_mt,
-            story_y=story_y,
-            output_path=pdf_path,
-            user_name=order.name,
-            notes=order.notes,
-            lang=order.language,
-        )
-
-        # 5. Lähetä sähköposti
-        send_email_with_pdf(
-            to_email=order.email,
-            pdf_path=pdf_path,
-            haplogroup=order.haplogroup,
-            lang=order.language,
-            user_name=order.name,
-        )
-
-        logger.info(f"Report sent successfully: {pdf_path}")
-
+        order_id = await run_in_threadpool(enqueue_order, order.model_dump(mode="json"))
         return OrderResponse(
-            message="Raportti luotu ja lähetetty onnistuneesti.",
+            message="Tilaus vastaanotettu. Raportti luodaan ja lähetetään sähköpostiisi.",
             order_id=order_id
         )
 
-    except HTTPException:
-        raise
-
     except Exception as e:
-        logger.exception("Unexpected error while processing order")
+        logger.exception("Unexpected error while queueing order")
         raise HTTPException(
             status_code=500,
-            detail="Palvelimella tapahtui virhe raporttia luotaessa."
+            detail="Palvelimella tapahtui virhe tilausta tallennettaessa."
         )
 
 
+@app.get("/api/order_report/{order_id}", response_model=OrderStatus)
+async def order_status(order_id: str):
+    """Tilauksen tila ja putken vaihe (queued → fetch → story → pdf → email → done)."""
+    status = await run_in_threadpool(get_order_status, order_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Tilausta ei löytynyt.")
+    return OrderStatus(**status)
+
+
 @app.get("/api/debug/haplogroup/{haplogroup}")
 async def debug_haplogroup(haplogroup: str):
     """Raakadata haploryhmästä – vain kehityskäyttöön."""
@@ -170,6 +131,12 @@ async def debug_haplogroup(haplogroup: str):
         raise HTTPException(status_code=500, detail="Virhe tietojen haussa.")
 
 
+@app.get("/api/debug/cache")
+async def debug_cache():
+    """Haploryhmädatan välimuistin osuma-/ohilaskurit – vain kehityskäyttöön."""
+    return get_cache_stats()
+
+
 # ─────────────────────────────────────────────
 # Käynnistys
 # ─────────────────────────────────────────────
@@ -0,0 +1,313 @@
+"""
+order_queue.py — Kestävä tilausjono (SQLite)
+KSHM-projekti
+
+/api/order_report ei enää aja raporttiputkea pyynnön sisällä, vaan tallentaa
+tilauksen tähän jonoon ja palauttaa heti 202 + order_id. Erillinen
+työprosessipooli (order_worker.py) hakee tilaukset jonosta ja ajaa vaiheet:
+
+    queued → fetch → story → pdf → email → done
+                                          ↘ failed (virheviesti talteen)
+
+Jono on tavallinen SQLite-tiedosto WAL-tilassa, joten se säilyy uudelleen-
+käynnistysten yli ja useampi prosessi voi käyttää sitä yhtä aikaa.
+Tilauksen varaus tehdään BEGIN IMMEDIATE -transaktiossa, joten kaksi
+työprosessia ei koskaan saa samaa tilausta.
+
+Varaus (lease) pysyy voimassa niin kauan kuin työprosessi sykkii
+(heartbeat, updated_at). Työprosessin kirjoitukset ovat ehdollisia
+(worker = ? AND status = 'running'): jos varaus on ehditty palauttaa
+jonoon ja toinen työprosessi on ottanut tilauksen, vanha ajo ei enää
+muuta riviä vaan saa tiedon menetetystä varauksesta (False).
+
+Ympäristömuuttujat:
+  ORDER_QUEUE_PATH      — jonotiedoston polku (oletus: order_queue.sqlite3)
+  ORDER_MAX_ATTEMPTS    — montako kertaa kaatunut tilaus yritetään (oletus: 3)
+
+Käyttö:
+  from order_queue import enqueue_order, get_order_status
+  order_id = enqueue_order({"name": "...", "email": "...", "haplogroup": "H1"})
+  status   = get_order_status(order_id)
+"""
+
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Asetukset
+# ---------------------------------------------------------------------------
+
+DEFAULT_QUEUE_PATH = os.getenv("ORDER_QUEUE_PATH", "order_queue.sqlite3")
+MAX_ATTEMPTS       = int(os.getenv("ORDER_MAX_ATTEMPTS", 3))
+
+# Tilat ja putken vaiheet
+STATUS_QUEUED  = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE    = "done"
+STATUS_FAILED  = "failed"
+
+STAGES = ("queued", "fetch", "story", "pdf", "email", "done")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id    TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    error       TEXT,
+    pdf_path    TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS orders_status_created ON orders (status, created_at);
+"""
+
+
+# ---------------------------------------------------------------------------
+# Yhteydet — yksi per prosessi ja säie
+# ---------------------------------------------------------------------------
+
+_local = threading.local()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    """
+    Palauttaa säiekohtaisen yhteyden. Yhteyttä ei jaeta fork():n yli:
+    pid tallennetaan ja lapsiprosessi avaa oman yhteytensä.
+    """
+    conns: Dict[Tuple[int, str], sqlite3.Connection] = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = (os.getpid(), path)
+    conn = conns.get(key)
+    if conn is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None → transaktiot hallitaan itse (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        conns[key] = conn
+    return conn
+
+
+def _row_to_status(row: sqlite3.Row) -> Dict:
+    return {
+        "order_id":    row["order_id"],
+        "status":      row["status"],
+        "stage":       row["stage"],
+        "error":       row["error"],
+        "attempts":    row["attempts"],
+        "created_at":  row["created_at"],
+        "updated_at":  row["updated_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Julkinen API — HTTP-puoli
+# ---------------------------------------------------------------------------
+
+def enqueue_order(payload: Dict, queue_path: str = DEFAULT_QUEUE_PATH) -> str:
+    """Tallentaa tilauksen jonoon ja palauttaa order_id:n."""
+    conn = _connect(queue_path)
+    data = json.dumps(payload, ensure_ascii=False)
+    now = time.time()
+    # Lyhyt 8 merkin ID kuten ennenkin — törmäyksessä arvotaan uusi
+    for _ in range(5):
+        order_id = str(uuid.uuid4())[:8]
+        try:
+            conn.execute(
+                "INSERT INTO orders (order_id, payload, status, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (order_id, data, STATUS_QUEUED, "queued", now, now),
+            )
+            return order_id
+        except sqlite3.IntegrityError:
+            continue
+    raise RuntimeError("order_id-törmäys: uutta tunnistetta ei saatu varattua")
+
+
+def get_order_status(order_id: str, queue_path: str = DEFAULT_QUEUE_PATH) -> Optional[Dict]:
+    """Tilauksen tila ja vaihe, tai None jos tilausta ei ole."""
+    row = _connect(queue_path).execute(
+        "SELECT * FROM orders WHERE order_id = ?", (order_id,)
+    ).fetchone()
+    return _row_to_status(row) if row else None
+
+
+def queue_depth(queue_path: str = DEFAULT_QUEUE_PATH) -> Dict[str, int]:
+    """Tilausten määrä tiloittain (valvontaa varten)."""
+    rows = _connect(queue_path).execute(
+        "SELECT status, COUNT(*) AS n FROM orders GROUP BY status"
+    ).fetchall()
+    return {r["status"]: r["n"] for r in rows}
+
+
+# ---------------------------------------------------------------------------
+# Julkinen API — työprosessipuoli
+# ---------------------------------------------------------------------------
+
+def claim_next_order(worker: str, queue_path: str = DEFAULT_QUEUE_PATH) -> Optional[Tuple[str, Dict]]:
+    """
+    Varaa vanhimman jonossa olevan tilauksen atomisesti.
+    Palauttaa (order_id, payload) tai None jos jono on tyhjä.
+    """
+    conn = _connect(queue_path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT order_id, payload FROM orders WHERE status = ? "
+            "ORDER BY created_at LIMIT 1",
+            (STATUS_QUEUED,),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE orders SET status = ?, stage = ?, worker = ?, attempts = attempts + 1, "
+            "updated_at = ? WHERE order_id = ?",
+            (STATUS_RUNNING, "fetch", worker, time.time(), row["order_id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row["order_id"], json.loads(row["payload"])
+
+
+def _owned(worker: Optional[str]) -> Tuple[str, Tuple]:
+    """WHERE-lisäys: rivi on yhä tämän työprosessin käsittelyssä (tai ehto ohitetaan)."""
+    if worker is None:
+        return "", ()
+    return " AND worker = ? AND status = ?", (worker, STATUS_RUNNING)
+
+
+def set_order_stage(order_id: str, stage: str, queue_path: str = DEFAULT_QUEUE_PATH,
+                    worker: Optional[str] = None) -> bool:
+    """
+    Päivittää käynnissä olevan tilauksen vaiheen (ja samalla sykkeen).
+    worker annettu → False jos varaus on menetetty.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Tuntematon vaihe: {stage}")
+    cond, args = _owned(worker)
+    return _connect(queue_path).execute(
+        "UPDATE orders SET stage = ?, updated_at = ? WHERE order_id = ?" + cond,
+        (stage, time.time(), order_id) + args,
+    ).rowcount > 0
+
+
+def heartbeat(order_id: str, worker: str, queue_path: str = DEFAULT_QUEUE_PATH) -> bool:
+    """Pidentää varausta. False → tilaus on palautettu jonoon tai toisella työprosessilla."""
+    cond, args = _owned(worker)
+    return _connect(queue_path).execute(
+        "UPDATE orders SET updated_at = ? WHERE order_id = ?" + cond,
+        (time.time(), order_id) + args,
+    ).rowcount > 0
+
+
+def complete_order(order_id: str, pdf_path: str, queue_path: str = DEFAULT_QUEUE_PATH,
+                   worker: Optional[str] = None) -> bool:
+    now = time.time()
+    cond, args = _owned(worker)
+    return _connect(queue_path).execute(
+        "UPDATE orders SET status = ?, stage = 'done', pdf_path = ?, error = NULL, "
+        "updated_at = ?, finished_at = ? WHERE order_id = ?" + cond,
+        (STATUS_DONE, pdf_path, now, now, order_id) + args,
+    ).rowcount > 0
+
+
+def fail_order(order_id: str, error: str, queue_path: str = DEFAULT_QUEUE_PATH,
+               worker: Optional[str] = None) -> bool:
+    now = time.time()
+    cond, args = _owned(worker)
+    return _connect(queue_path).execute(
+        "UPDATE orders SET status = ?, error = ?, updated_at = ?, finished_at = ? "
+        "WHERE order_id = ?" + cond,
+        (STATUS_FAILED, error, now, now, order_id) + args,
+    ).rowcount > 0
+
+
+def retry_order(order_id: str, error: str, queue_path: str = DEFAULT_QUEUE_PATH,
+                worker: Optional[str] = None) -> Optional[str]:
+    """
+    Tilapäinen virhe (esim. SMTP): tilaus palautetaan jonoon, ellei
+    ORDER_MAX_ATTEMPTS ole täynnä — silloin se merkitään epäonnistuneeksi.
+    Palauttaa uuden tilan, tai None jos varaus oli jo menetetty.
+    """
+    now = time.time()
+    cond, args = _owned(worker)
+    conn = _connect(queue_path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT attempts FROM orders WHERE order_id = ?" + cond, (order_id,) + args,
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        if row["attempts"] >= MAX_ATTEMPTS:
+            status = STATUS_FAILED
+            conn.execute(
+                "UPDATE orders SET status = ?, error = ?, updated_at = ?, finished_at = ? "
+                "WHERE order_id = ?",
+                (status, error, now, now, order_id),
+            )
+        else:
+            status = STATUS_QUEUED
+            conn.execute(
+                "UPDATE orders SET status = ?, stage = 'queued', worker = NULL, error = ?, "
+                "updated_at = ? WHERE order_id = ?",
+                (status, error, now, order_id),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return status
+
+
+def requeue_stale_orders(lease_seconds: float, queue_path: str = DEFAULT_QUEUE_PATH) -> int:
+    """
+    Palauttaa jonoon tilaukset joiden työprosessi on kaatunut kesken
+    (ei sykettä lease_seconds-aikaan). Yrityskertojen ylittyessä
+    tilaus merkitään epäonnistuneeksi. Palauttaa käsiteltyjen määrän.
+    """
+    conn = _connect(queue_path)
+    cutoff = time.time() - lease_seconds
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        failed = conn.execute(
+            "UPDATE orders SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+            "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+            (STATUS_FAILED, "Työprosessi keskeytyi liian monta kertaa.", time.time(),
+             time.time(), STATUS_RUNNING, cutoff, MAX_ATTEMPTS),
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE orders SET status = ?, stage = 'queued', worker = NULL, updated_at = ? "
+            "WHERE status = ? AND updated_at < ?",
+            (STATUS_QUEUED, time.time(), STATUS_RUNNING, cutoff),
+        ).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if failed or requeued:
+        logger.warning(f"Jumiin jääneet tilaukset: {requeued} palautettu jonoon, {failed} epäonnistunut")
+    return failed + requeued
@@ -0,0 +1,320 @@
+"""
+order_worker.py — Raporttiputken työprosessipooli
+KSHM-projekti
+
+Hakee tilauksia order_queue-jonosta ja ajaa raporttiputken vaiheet:
+
+    fetch  → fetch_full_haplogroup_data (mtDNA + valinnainen Y-DNA)
+    story  → generate_story
+    pdf    → generate_pdf_from_story (render_service-prosessissa)
+    email  → send_email_with_pdf
+
+Jokainen vaihe kirjataan jonoon, joten GET /api/order_report/{order_id}
+näyttää etenemisen. Taustasäie sykkii varausta ORDER_LEASE_SECONDS/4
+välein koko putken ajan, joten pitkäkään vaihe ei palaudu jonoon toiselle
+työprosessille. Jos varaus silti menetetään, sähköpostia ei lähetetä
+eikä riviä enää kirjoiteta. Tilapäinen virhe (SMTP) palauttaa tilauksen
+jonoon kunnes ORDER_MAX_ATTEMPTS täyttyy. Pooli skaalautuu API-prosessista riippumatta:
+käynnistä niin monta työprosessia kuin PDF- ja SMTP-kuorma vaatii.
+
+PDF taitetaan työprosessin omassa yhden prosessin RenderPoolissa, joten
+jumiutunut taitto katkeaa RENDER_TIMEOUT-aikarajaan ja paisunut
+renderöintiprosessi kierrätetään (ks. render_service.py).
+
+Ympäristömuuttujat:
+  ORDER_WORKERS         — työprosessien määrä (oletus: 2)
+  ORDER_POLL_INTERVAL   — tyhjän jonon kyselyväli sekunteina (oletus: 1.0)
+  ORDER_LEASE_SECONDS   — milloin ilman sykettä ollut tilaus palautetaan jonoon (oletus: 900)
+  REPORT_OUTPUT_DIR     — PDF-tiedostojen hakemisto (oletus: generated_reports)
+
+Käyttö:
+  cd backend && python order_worker.py          # ORDER_WORKERS prosessia
+  cd backend && python order_worker.py 4        # 4 prosessia
+"""
+
+from __future__ import annotations
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+import render_service
+from order_queue import (
+    DEFAULT_QUEUE_PATH,
+    claim_next_order,
+    complete_order,
+    fail_order,
+    heartbeat,
+    requeue_stale_orders,
+    retry_order,
+    set_order_stage,
+)
+
+logger = logging.getLogger("kshm-worker")
+
+# ---------------------------------------------------------------------------
+# Asetukset
+# ---------------------------------------------------------------------------
+
+DEFAULT_WORKERS = int(os.getenv("ORDER_WORKERS", 2))
+POLL_INTERVAL   = float(os.getenv("ORDER_POLL_INTERVAL", 1.0))
+LEASE_SECONDS   = float(os.getenv("ORDER_LEASE_SECONDS", 900))
+OUTPUT_DIR      = os.getenv("REPORT_OUTPUT_DIR", "generated_reports")
+
+
+class OrderError(Exception):
+    """Tilausta ei voida käsitellä (esim. haploryhmälle ei löydy dataa). Ei uusintayritystä."""
+
+
+class RetryableError(Exception):
+    """Tilapäinen virhe (esim. SMTP) — tilaus yritetään uudelleen ORDER_MAX_ATTEMPTS asti."""
+
+
+class LeaseLost(Exception):
+    """Varaus palautettiin jonoon kesken ajon; tilaus on jo toisen työprosessin."""
+
+
+class _Heartbeat:
+    """Taustasäie joka pidentää tilauksen varausta process_orderin ajan."""
+
+    __slots__ = ("order_id", "worker", "queue_path", "interval", "_stop", "_thread")
+
+    def __init__(self, order_id: str, worker: str, queue_path: str, interval: float):
+        self.order_id = order_id
+        self.worker = worker
+        self.queue_path = queue_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{order_id}", daemon=True)
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if not heartbeat(self.order_id, self.worker, self.queue_path):
+                    logger.warning(f"[{self.order_id}] varaus menetetty")
+                    return
+            except Exception:
+                # Lukittu tai hetkellisesti saavuttamaton jono: seuraava syke yrittää uudelleen
+                logger.exception(f"[{self.order_id}] syke epäonnistui")
+
+
+# ---------------------------------------------------------------------------
+# Raporttiputki — yksi tilaus
+# ---------------------------------------------------------------------------
+
+def process_order(
+    order_id: str,
+    order: Dict,
+    queue_path: str = DEFAULT_QUEUE_PATH,
+    render_pool: Optional[render_service.RenderPool] = None,
+    worker: Optional[str] = None,
+) -> str:
+    """
+    Ajaa koko putken yhdelle tilaukselle ja palauttaa PDF:n polun.
+    Sama logiikka kuin aiemmin main.order_report:ssa, mutta data haetaan
+    vain kerran: tarina rakennetaan jo haetusta datasta.
+    render_pool: PDF-taiton pooli (oletus: render_service.get_pool()).
+    worker: varauksen omistaja; annettu → vaihekirjaukset ovat ehdollisia
+    ja menetetty varaus keskeyttää putken (LeaseLost) ennen sähköpostia.
+    """
+    def stage(name: str) -> None:
+        if not set_order_stage(order_id, name, queue_path, worker=worker):
+            raise LeaseLost(f"varaus menetetty ennen vaihetta {name}")
+
+    # Raskaat moduulit tuodaan vasta työprosessissa
+    from data_utils import fetch_full_haplogroup_data
+    from haplo_normalize import resolve
+    from story_utils import generate_story
+    from email_utils import send_email_with_pdf
+
+    # Nimet ratkaistaan kerran kanonisiksi (esim. Y "n1c1" → N-M46);
+    # sama ID kulkee haulle, tiedostonimeen ja sähköpostiin. Pääkenttään
+    # saa syöttää mtDNA- tai Y-nimen (tilaa.html), joten linja päätellään
+    # nimestä; vanhat ISOGG-nimet (N1c1) jäävät silloin epäselviksi.
+    hg_main      = resolve(order["haplogroup"])
+    hg_y         = resolve(order["haplogroup_y"], "y") if order.get("haplogroup_y") else None
+    haplogroup   = hg_main.id
+    lang         = order.get("language") or "fi"
+    tone         = order.get("tone") or "academic"
+    name         = order["name"]
+
+    # 1. Fetch haplogroup data (mtDNA + Y-DNA jos annettu)
+    stage("fetch")
+    haplo_data_mt = _fetch_or_fail(fetch_full_haplogroup_data, hg_main)
+    haplo_data_y = _fetch_or_fail(fetch_full_haplogroup_data, hg_y) if hg_y else None
+
+    # 2. Generoi tarinat
+    stage("story")
+    story_mt = generate_story(haplo_data_mt, lang=lang, tone=tone)
+    story_y = generate_story(haplo_data_y, lang=lang, tone=tone) if haplo_data_y else None
+
+    # 3. Generoi PDF
+    stage("pdf")
+    safe_name = name.replace(" ", "").replace("/", "")
+    filename = f"{haplogroup}_{safe_name}_{order_id}.pdf"
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    pdf_path = os.path.join(OUTPUT_DIR, filename)
+
+    (render_pool or render_service.get_pool()).render_pdf(
+        story_mt=story_mt,
+        story_y=story_y,
+        output_path=pdf_path,
+        user_name=name,
+        notes=order.get("notes"),
+        lang=lang,
+    )
+
+    # 4. Lähetä sähköposti
+    stage("email")
+    sent = send_email_with_pdf(
+        to_email=order["email"],
+        pdf_path=pdf_path,
+        haplogroup=haplogroup,
+        lang=lang,
+        user_name=name,
+    )
+    if not sent:
+        raise RetryableError("Sähköpostin lähetys epäonnistui.")
+
+    return pdf_path
+
+
+def _fetch_or_fail(fetch, hg) -> Dict:
+    try:
+        data = fetch(hg.id, hg.lineage)
+    except ValueError as e:
+        raise OrderError(str(e))
+    if not data or "error" in data:
+        raise OrderError(f"Haploryhmälle {hg.id} ei löytynyt tietoja.")
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Työprosessin silmukka
+# ---------------------------------------------------------------------------
+
+def worker_loop(
+    queue_path: str = DEFAULT_QUEUE_PATH,
+    poll_interval: float = POLL_INTERVAL,
+    max_orders: Optional[int] = None,
+) -> int:
+    """
+    Käsittelee tilauksia kunnes saa SIGTERM/SIGINT:n (tai max_orders täyttyy).
+    Palauttaa käsiteltyjen tilausten määrän.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    handled = 0
+    last_reap = 0.0
+    # Yksi tilaus kerrallaan → yksi renderöintiprosessi riittää; pooli tuo
+    # aikarajan ja muistikierrätyksen
+    render_pool = render_service.RenderPool(workers=1, queue_size=0)
+    logger.info(f"Työprosessi käynnissä: {worker}")
+
+    while not stopping and (max_orders is None or handled < max_orders):
+        now = time.monotonic()
+        if now - last_reap > LEASE_SECONDS / 4:
+            requeue_stale_orders(LEASE_SECONDS, queue_path)
+            last_reap = now
+
+        claimed = claim_next_order(worker, queue_path)
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+
+        order_id, order = claimed
+        logger.info(f"[{order_id}] aloitetaan: {order.get('haplogroup')} for {order.get('email')}")
+        try:
+            with _Heartbeat(order_id, worker, queue_path, LEASE_SECONDS / 4):
+                pdf_path = process_order(order_id, order, queue_path, render_pool, worker)
+            if complete_order(order_id, pdf_path, queue_path, worker=worker):
+                logger.info(f"[{order_id}] Report sent successfully: {pdf_path}")
+            else:
+                logger.warning(f"[{order_id}] valmis, mutta varaus oli jo menetetty")
+        except LeaseLost as e:
+            logger.warning(f"[{order_id}] keskeytetään: {e}")
+        except OrderError as e:
+            fail_order(order_id, str(e), queue_path, worker=worker)
+            logger.warning(f"[{order_id}] {e}")
+        except RetryableError as e:
+            status = retry_order(order_id, str(e), queue_path, worker=worker)
+            logger.warning(f"[{order_id}] {e} → {status or 'varaus menetetty'}")
+        except Exception as e:
+            logger.exception(f"[{order_id}] Unexpected error while processing order")
+            fail_order(order_id, f"Palvelimella tapahtui virhe raporttia luotaessa: {e}",
+                       queue_path, worker=worker)
+        handled += 1
+
+    render_pool.close()
+    logger.info(f"Työprosessi pysähtyy: {worker} ({handled} tilausta)")
+    return handled
+
+
+def _worker_main(queue_path: str, poll_interval: float) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(processName)s %(levelname)s: %(message)s")
+    worker_loop(queue_path, poll_interval)
+
+
+def run_worker_pool(
+    workers: int = DEFAULT_WORKERS,
+    queue_path: str = DEFAULT_QUEUE_PATH,
+    poll_interval: float = POLL_INTERVAL,
+) -> None:
+    """
+    Käynnistää `workers` työprosessia ja odottaa niiden päättymistä.
+    SIGTERM/SIGINT välitetään lapsille, jotka viimeistelevät käsittelyssä
+    olevan tilauksen ennen pysähtymistä.
+    """
+    procs: List[multiprocessing.Process] = []
+    for i in range(max(1, workers)):
+        p = multiprocessing.Process(
+            target=_worker_main,
+            args=(queue_path, poll_interval),
+            name=f"kshm-worker-{i}",
+        )
+        p.start()
+        procs.append(p)
+
+    def _forward(signum, frame):
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+
+    for p in procs:
+        p.join()
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WORKERS
+    print(f"Käynnistetään {n} työprosessia, jono: {DEFAULT_QUEUE_PATH}")
+    run_worker_pool(n)
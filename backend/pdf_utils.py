@@ -2,6 +2,7 @@
 # KSHM – Archaeogenetic Bloodline Book PDF Engine
 
 from reportlab.platypus import (
+    Flowable,
     Paragraph,
     Spacer,
     Image,
@@ -14,11 +15,26 @@ from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib import colors
 from reportlab.lib.units import cm
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate
+from functools import lru_cache
+from xml.sax.saxutils import escape
+import hashlib
+import io
+import json
 import os
+import threading
+
+import image_assets
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, NameObject
+except ImportError:  # no fragment cache: every PDF is laid out in full
+    PdfReader = PdfWriter = None
 
 
 # =========================================================
@@ -28,13 +44,14 @@ import os
 # Seurataan onnistuiko custom-fonttien rekisteröinti
 _CUSTOM_FONTS_LOADED = False
 
+# Font directory (absolute path) -> whether registration succeeded.
+# pdfmetrics keeps registered fonts process-wide, so each directory is
+# parsed once per process and the TTFont objects are shared by every PDF.
+_FONT_DIRS = {}
+_FONT_LOCK = threading.Lock()
 
-def register_fonts(font_path="fonts"):
-    """
-    Register custom fonts if available.
-    Falls back to built-in fonts if not found.
-    """
-    global _CUSTOM_FONTS_LOADED
+
+def _register_font_files(font_path):
     try:
         pdfmetrics.registerFont(
             TTFont("Playfair", os.path.join(font_path, "PlayfairDisplay-Regular.ttf"))
@@ -45,9 +62,39 @@ def register_fonts(font_path="fonts"):
         pdfmetrics.registerFont(
             TTFont("Lora", os.path.join(font_path, "Lora-Regular.ttf"))
         )
-        _CUSTOM_FONTS_LOADED = True
+        return True
     except Exception:
-        _CUSTOM_FONTS_LOADED = False
+        return False
+
+
+def register_fonts(font_path="fonts"):
+    """
+    Register custom fonts if available.
+    Falls back to built-in fonts if not found.
+
+    The TTF files are read only on the first call for a directory;
+    later calls just restore the cached result.
+    """
+    global _CUSTOM_FONTS_LOADED
+    key = os.path.abspath(font_path)
+    with _FONT_LOCK:
+        loaded = _FONT_DIRS.get(key)
+        if loaded is None:
+            loaded = _FONT_DIRS[key] = _register_font_files(font_path)
+        _CUSTOM_FONTS_LOADED = loaded
+    return loaded
+
+
+def font_names():
+    """(serif, serif italic, body) font names for the registered font set."""
+    if _CUSTOM_FONTS_LOADED:
+        return "Playfair", "Playfair-Italic", "Lora"
+    return "Times-Roman", "Times-Italic", "Helvetica"
+
+
+# Once per process, at import (the order worker imports this module lazily,
+# so in practice this happens at worker start).
+register_fonts()
 
 
 # =========================================================
@@ -64,12 +111,19 @@ SEPIA_ACCENT = colors.HexColor("#6e4f2c")
 # =========================================================
 
 def get_styles():
+    """
+    Shared stylesheet for the registered font set. Built once per font set
+    and reused by every PDF, so callers must not modify it.
+    """
+    return _build_styles(font_names())
+
+
+@lru_cache(maxsize=None)
+def _build_styles(fonts):
     styles = getSampleStyleSheet()
 
-    # Fonttinimet — käytetään custom-fontteja jos rekisteröity, muuten builtinit
-    f_serif = "Playfair" if _CUSTOM_FONTS_LOADED else "Times-Roman"
-    f_serif_italic = "Playfair-Italic" if _CUSTOM_FONTS_LOADED else "Times-Italic"
-    f_body = "Lora" if _CUSTOM_FONTS_LOADED else "Helvetica"
+    # Fonttinimet — custom-fontit jos rekisteröity, muuten builtinit
+    f_serif, f_serif_italic, f_body = fonts
 
     styles.add(
         ParagraphStyle(
@@ -150,28 +204,147 @@ def get_styles():
 # =========================================================
 
 def add_page_number(canvas, doc):
-    page_num_text = f"{doc.page}"
-    canvas.setFont("Lora", 9)
+    page_num_text = f"{doc.page + getattr(doc, 'page_offset', 0)}"
+    canvas.setFont(font_names()[2], 9)
     canvas.setFillColor(SEPIA_ACCENT)
     canvas.drawRightString(19.5 * cm, 1.5 * cm, page_num_text)
 
 
+# =========================================================
+# TABLE OF CONTENTS & BOOKMARKS (single pass)
+# =========================================================
+#
+# ReportLab's TableOfContents only settles under multiBuild, which lays
+# the whole document out at least twice. Chapter titles are known before
+# the build, so the TOC is drawn in the same pass instead: each entry
+# draws its page number through a PDF form XObject that is defined only
+# when the chapter itself is laid out (a forward reference, like the
+# usual "page X of Y" trick). Chapters and sections also get PDF
+# bookmarks and outline entries.
+
+TOC_NUMBER_WIDTH = 1.5 * cm
+
+
+def _toc_form_name(key):
+    return f"toc-page-{key}"
+
+
+def _define_toc_page_form(canvas, key, page, style):
+    canvas.beginForm(_toc_form_name(key), lowerx=-TOC_NUMBER_WIDTH, lowery=-style.fontSize,
+                     upperx=0, uppery=style.leading)
+    canvas.setFont(style.fontName, style.fontSize)
+    canvas.setFillColor(style.textColor)
+    canvas.drawRightString(0, 0, str(page))
+    canvas.endForm()
+
+
+class TOCEntry(Flowable):
+    """One TOC line: title on the left, forward-referenced page number on the right."""
+
+    def __init__(self, text, key, style):
+        super().__init__()
+        self.text = text
+        self.key = key
+        self.style = style
+        self._para = None
+
+    def wrap(self, availWidth, availHeight):
+        self._para = Paragraph(self.text, self.style)
+        _, height = self._para.wrap(availWidth - TOC_NUMBER_WIDTH, availHeight)
+        self.width, self.height = availWidth, height
+        return availWidth, height
+
+    def draw(self):
+        canvas = self.canv
+        self._para.drawOn(canvas, 0, 0)
+        baseline = self.height - pdfmetrics.getAscent(self.style.fontName, self.style.fontSize)
+        canvas.saveState()
+        canvas.translate(self.width, baseline)
+        canvas.doForm(_toc_form_name(self.key))
+        canvas.restoreState()
+        canvas.linkRect("", self.key, (0, 0, self.width, self.height), relative=1)
+
+
+class _NextPageMark(Flowable):
+    """
+    Zero-size marker at the end of a fragment: resolves the TOC page number
+    of a chapter that starts on the page after this fragment (rendered
+    separately and merged in, see generate_pdf_from_story).
+    """
+
+    def __init__(self, key, style, page_offset):
+        super().__init__()
+        self.key, self.style, self.page_offset = key, style, page_offset
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        page = self.canv.getPageNumber() + self.page_offset + 1
+        _define_toc_page_form(self.canv, self.key, page, self.style)
+        # Placeholder destination so the TOC link resolves inside this
+        # fragment; /XYZ marks it for _retarget_forward_links after merging
+        self.canv.bookmarkPage(self.key, fit="XYZ", left=0, top=0)
+
+
+class BloodlineDocTemplate(BaseDocTemplate):
+    """
+    Records chapter/section flowables as they are laid out: PDF bookmark,
+    outline entry, and (for chapters) the TOC page-number form and a
+    TOCEntry notification for ReportLab's multi-pass TableOfContents.
+    page_offset shifts printed page numbers for a fragment that is merged
+    after other pages.
+    """
+
+    def __init__(self, filename, toc_style=None, page_offset=0, **kw):
+        super().__init__(filename, **kw)
+        self.toc_style = toc_style
+        self.page_offset = page_offset
+        self.toc_pages = {}
+
+    def beforeDocument(self):
+        self.toc_pages = {}
+        self._outline_levels = 0
+
+    def afterFlowable(self, flowable):
+        mark = getattr(flowable, "bookmark", None)
+        if mark is None:
+            return
+        key, level = mark
+        canvas = self.canv
+        text = flowable.getPlainText()
+
+        # An outline level may only go one deeper than the previous entry
+        level = min(level, self._outline_levels)
+        self._outline_levels = level + 1
+        canvas.bookmarkPage(key)
+        canvas.addOutlineEntry(text, key, level=level, closed=level > 0)
+
+        if level == 0:
+            page = self.page + self.page_offset
+            self.toc_pages[key] = page
+            self.notify("TOCEntry", (0, text, page, key))
+            _define_toc_page_form(canvas, key, page, self.toc_style)
+
+
 # =========================================================
 # MAIN PDF GENERATOR CLASS
 # =========================================================
 
 class BloodlinePDF:
 
-    def __init__(self, output_path):
+    def __init__(self, output_path, page_offset=0):
         register_fonts()
         self.styles = get_styles()
-        self.doc = BaseDocTemplate(
+        self.doc = BloodlineDocTemplate(
             output_path,
             pagesize=A4,
             rightMargin=2.5 * cm,
             leftMargin=2.5 * cm,
             topMargin=2.5 * cm,
             bottomMargin=2.5 * cm,
+            toc_style=self.styles["BodyLora"],
+            page_offset=page_offset,
         )
 
         frame = Frame(
@@ -186,15 +359,21 @@ class BloodlinePDF:
         self.doc.addPageTemplates([template])
 
         self.story = []
+        self._toc_slot = None      # story index of the TOC placeholder
+        self._chapters = []        # (title, bookmark key) in story order
+        self._sections = 0
+        self._next_chapter = None  # (title, key) of a chapter merged in after this document
 
     # -----------------------------------------------------
     # COVER PAGE
     # -----------------------------------------------------
 
-    def add_cover(self, title, subtitle, slogan):
+    def add_cover(self, title, subtitle, slogan, user_name=None):
         self.story.append(Spacer(1, 6 * cm))
         self.story.append(Paragraph(title, self.styles["TitlePlayfair"]))
         self.story.append(Paragraph(subtitle, self.styles["Subtitle"]))
+        if user_name:
+            self.story.append(Paragraph(escape(user_name), self.styles["Subtitle"]))
         self.story.append(Spacer(1, 2 * cm))
         self.story.append(Paragraph(f"<i>{slogan}</i>", self.styles["Caption"]))
         self.story.append(PageBreak())
@@ -204,28 +383,45 @@ class BloodlinePDF:
     # -----------------------------------------------------
 
     def add_table_of_contents(self):
+        """
+        TOC of all chapters (also those added after this call). The entries
+        are filled in at build() time.
+        """
         self.story.append(Paragraph("Sisällysluettelo", self.styles["HeadingChapter"]))
-        toc = TableOfContents()
-        toc.levelStyles = [
-            self.styles["BodyLora"],
-        ]
-        self.story.append(toc)
+        self._toc_slot = len(self.story)
+        self.story.append(None)
         self.story.append(PageBreak())
 
     # -----------------------------------------------------
     # CHAPTER
     # -----------------------------------------------------
 
-    def add_chapter(self, title):
-        self.story.append(Paragraph(title, self.styles["HeadingChapter"]))
+    def add_chapter(self, title, key=None):
+        key = key or f"ch{len(self._chapters) + 1}"
+        heading = Paragraph(title, self.styles["HeadingChapter"])
+        heading.bookmark = (key, 0)
+        self._chapters.append((title, key))
+        self.story.append(heading)
         self.story.append(Spacer(1, 12))
 
+    def add_next_chapter(self, title, key):
+        """
+        List a chapter in this document's TOC that is rendered separately and
+        starts on the page after this document ends (its add_chapter must use
+        the same key so the TOC link resolves after merging).
+        """
+        self._chapters.append((title, key))
+        self._next_chapter = (title, key)
+
     # -----------------------------------------------------
     # SECTION
     # -----------------------------------------------------
 
     def add_section(self, title):
-        self.story.append(Paragraph(title, self.styles["HeadingSection"]))
+        self._sections += 1
+        heading = Paragraph(title, self.styles["HeadingSection"])
+        heading.bookmark = (f"sec{self._sections}", 1)
+        self.story.append(heading)
 
     # -----------------------------------------------------
     # PARAGRAPH
@@ -239,8 +435,16 @@ class BloodlinePDF:
     # -----------------------------------------------------
 
     def add_image(self, image_path, caption=None, width=14 * cm):
-        if os.path.exists(image_path):
-            img = Image(image_path, width=width, preserveAspectRatio=True)
+        """
+        Embed an image scaled to `width`. The file is swapped for its
+        print-resolution derivative (image_assets.prepare); derivatives are
+        named by content hash, so a picture repeated in the document is
+        embedded once. Missing files and URLs are skipped.
+        """
+        path = image_assets.prepare(image_path, width)
+        if path is not None:
+            px_w, px_h = ImageReader(path).getSize()
+            img = Image(path, width=width, height=width * px_h / px_w)
             self.story.append(Spacer(1, 20))
             self.story.append(img)
             if caption:
@@ -258,67 +462,230 @@ class BloodlinePDF:
     # BUILD PDF
     # -----------------------------------------------------
 
-    def build(self):
-        self.doc.multiBuild(self.story)
+    def build(self, multipass=False):
+        """
+        Lay the document out once, with the TOC page numbers resolved in the
+        same pass. multipass=True uses ReportLab's TableOfContents and
+        multiBuild instead (at least two full layout passes; kept for
+        comparison in bench_pdf.py).
+        """
+        story = self.story
+        if self._toc_slot is not None:
+            if multipass:
+                toc = TableOfContents()
+                toc.levelStyles = [self.styles["BodyLora"]]
+                toc_flowables = [toc]
+            else:
+                toc_flowables = [TOCEntry(title, key, self.styles["BodyLora"])
+                                 for title, key in self._chapters]
+            story = story[:self._toc_slot] + toc_flowables + story[self._toc_slot + 1:]
+        if self._next_chapter is not None:
+            story = story + [_NextPageMark(self._next_chapter[1], self.styles["BodyLora"], self.doc.page_offset)]
+
+        if multipass:
+            self.doc.multiBuild(story)
+        else:
+            self.doc.build(story)
+
+
+# =========================================================
+# FRAGMENT CACHE (invariant chapters)
+# =========================================================
+#
+# Everything except the cover (user name) and the notes chapter is the
+# same for every order with the same stories: same haplogroups, language,
+# tone and data. That body (TOC + lineage chapters) is rendered once into
+# a cached PDF. Each order then lays out only its cover and notes, with
+# page numbers offset to their final position, and merges the three with
+# pypdf. The cache key is a hash of the story dicts themselves, which
+# carry the haplogroup, language, tone and data-derived text, plus the
+# font set and layout version; any data change gives a new key.
+#
+# PDF_FRAGMENT_DIR       cache directory (default: pdf_fragments; empty = off)
+# PDF_FRAGMENT_MAX_FILES cached bodies kept, least recently used dropped (default: 500)
+
+FRAGMENT_DIR = os.getenv("PDF_FRAGMENT_DIR", "pdf_fragments")
+FRAGMENT_MAX_FILES = int(os.getenv("PDF_FRAGMENT_MAX_FILES", 500))
+FRAGMENT_FORMAT = 1
+NOTES_TITLE = "Your Notes"
+NOTES_KEY = "notes"
+
+
+def fragment_cache_enabled():
+    return bool(FRAGMENT_DIR) and PdfWriter is not None
+
+
+def _story_images(*stories):
+    """Prepared image paths; derivative names carry the content hash."""
+    return [
+        image_assets.prepare(section["image"], 14 * cm)
+        for story in stories if story
+        for section in story.get("sections", [])
+        if isinstance(section, dict) and section.get("image")
+    ]
+
+
+def _fragment_key(story_mt, story_y, lang, page_offset, with_notes):
+    payload = json.dumps(
+        [FRAGMENT_FORMAT, font_names(), story_mt, story_y, lang, page_offset, with_notes,
+         _story_images(story_mt, story_y)],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:24]
+    haplogroup = "".join(ch for ch in str(story_mt.get("haplogroup", "")) if ch.isalnum() or ch in "-_")
+    return f"{haplogroup or 'report'}_{lang}_{digest}"
+
+
+def _fragment_get(key):
+    path = os.path.join(FRAGMENT_DIR, f"{key}.pdf")
+    try:
+        os.utime(path)              # LRU order = mtime
+    except OSError:
+        return None
+    return path
+
+
+def _fragment_put(key, data):
+    os.makedirs(FRAGMENT_DIR, exist_ok=True)
+    path = os.path.join(FRAGMENT_DIR, f"{key}.pdf")
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)           # atomic: concurrent readers see old or new file
+    _fragment_prune()
+    return path
+
+
+def _fragment_prune():
+    try:
+        entries = [e for e in os.scandir(FRAGMENT_DIR) if e.name.endswith(".pdf")]
+    except OSError:
+        return
+    if len(entries) <= FRAGMENT_MAX_FILES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - FRAGMENT_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
 
 
 # =========================================================
 # PUBLIC API FUNCTION
 # =========================================================
 
-def generate_pdf_from_story(story_mt, story_y=None, output_path="report.pdf", user_name="", notes="", lang="en"):
-    """
-    Generate a PDF report from story data.
-    Wrapper function for BloodlinePDF class.
-    """
-    pdf = BloodlinePDF(output_path)
-    
-    # Add cover
+def _add_cover(pdf, story_mt, user_name):
     title = story_mt.get("title", "Archaeogenetic Report")
     subtitle = story_mt.get("subtitle", "Your DNA Story")
     slogan = "Discover your ancestral journey through ancient DNA"
-    pdf.add_cover(title, subtitle, slogan)
-    
-    # Add table of contents
+    pdf.add_cover(title, subtitle, slogan, user_name)
+
+
+def _add_lineage(pdf, story, title):
+    pdf.add_chapter(title)
+    for section in story.get("sections", []):
+        if isinstance(section, dict):
+            pdf.add_section(section.get("title", "Section"))
+            if section.get("image"):
+                pdf.add_image(section["image"], caption=section.get("image_caption"))
+            content = section.get("content", "")
+            if isinstance(content, str):
+                pdf.add_paragraph(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict):
+                        pdf.add_paragraph(item.get("content", ""))
+
+
+def _add_body(pdf, story_mt, story_y):
+    """Table of contents + lineage chapters: identical for every user."""
     pdf.add_table_of_contents()
-    
+
     # Add mtDNA story
     if story_mt:
-        pdf.add_chapter(f"mtDNA: {story_mt.get('title', 'Maternal Lineage')}")
-        for section in story_mt.get("sections", []):
-            if isinstance(section, dict):
-                pdf.add_section(section.get("title", "Section"))
-                content = section.get("content", "")
-                if isinstance(content, str):
-                    pdf.add_paragraph(content)
-                elif isinstance(content, list):
-                    for item in content:
-                        if isinstance(item, dict):
-                            pdf.add_paragraph(item.get("content", ""))
-    
+        _add_lineage(pdf, story_mt, f"mtDNA: {story_mt.get('title', 'Maternal Lineage')}")
+
     # Add Y-DNA story if present
     if story_y:
         pdf.page_break()
-        pdf.add_chapter(f"Y-DNA: {story_y.get('title', 'Paternal Lineage')}")
-        for section in story_y.get("sections", []):
-            if isinstance(section, dict):
-                pdf.add_section(section.get("title", "Section"))
-                content = section.get("content", "")
-                if isinstance(content, str):
-                    pdf.add_paragraph(content)
-                elif isinstance(content, list):
-                    for item in content:
-                        if isinstance(item, dict):
-                            pdf.add_paragraph(item.get("content", ""))
-    
+        _add_lineage(pdf, story_y, f"Y-DNA: {story_y.get('title', 'Paternal Lineage')}")
+
+
+def _add_notes(pdf, notes):
+    pdf.add_chapter(NOTES_TITLE, key=NOTES_KEY)
+    pdf.add_paragraph(escape(notes))
+
+
+def _render(fill, page_offset=0):
+    buf = io.BytesIO()
+    pdf = BloodlinePDF(buf, page_offset=page_offset)
+    fill(pdf)
+    pdf.build()
+    return buf.getvalue()
+
+
+def _retarget_forward_links(writer, pages, target):
+    """Point the body's placeholder (/XYZ) TOC links at the merged-in chapter page."""
+    for page in pages:
+        for annot in page.get("/Annots") or ():
+            annot = annot.get_object()
+            dest = annot.get("/Dest")
+            if dest is not None and len(dest) > 1 and dest[1] == "/XYZ":
+                annot[NameObject("/Dest")] = ArrayObject([target.indirect_reference, NameObject("/Fit")])
+
+
+def _generate_from_fragments(story_mt, story_y, output_path, user_name, notes, lang):
+    head = PdfReader(io.BytesIO(_render(lambda pdf: _add_cover(pdf, story_mt, user_name))))
+    offset = len(head.pages)
+
+    def fill_body(pdf):
+        _add_body(pdf, story_mt, story_y)
+        if notes:
+            pdf.add_next_chapter(NOTES_TITLE, NOTES_KEY)
+
+    key = _fragment_key(story_mt, story_y, lang, offset, bool(notes))
+    body_path = _fragment_get(key)
+    if body_path is None:
+        body_path = _fragment_put(key, _render(fill_body, page_offset=offset))
+    with open(body_path, "rb") as f:
+        body = PdfReader(io.BytesIO(f.read()))
+
+    writer = PdfWriter()
+    writer.append(head)
+    writer.append(body)
+    if notes:
+        tail = _render(lambda pdf: _add_notes(pdf, notes), page_offset=offset + len(body.pages))
+        writer.append(PdfReader(io.BytesIO(tail)))
+        end = offset + len(body.pages)
+        _retarget_forward_links(writer, writer.pages[offset:end], writer.pages[end])
+    writer.write(output_path)
+
+
+def generate_pdf_from_story(story_mt, story_y=None, output_path="report.pdf", user_name="", notes="", lang="en",
+                            multipass=False, use_cache=True):
+    """
+    Generate a PDF report from story data.
+    Wrapper function for BloodlinePDF class.
+    multipass: see BloodlinePDF.build (single layout pass by default).
+    use_cache: reuse the cached invariant body (see FRAGMENT CACHE) when
+    pypdf is installed and PDF_FRAGMENT_DIR is set.
+    """
+    if use_cache and not multipass and fragment_cache_enabled():
+        _generate_from_fragments(story_mt, story_y, output_path, user_name, notes, lang)
+        return
+
+    pdf = BloodlinePDF(output_path)
+    _add_cover(pdf, story_mt, user_name)
+    _add_body(pdf, story_mt, story_y)
+
     # Add user notes if any
     if notes:
         pdf.page_break()
-        pdf.add_chapter("Your Notes")
-        pdf.add_paragraph(notes)
-    
+        _add_notes(pdf, notes)
+
     # Build the PDF
-    pdf.build()
+    pdf.build(multipass=multipass)
 
 
 def generate_pdf(story, filename="report.pdf", lang="en"):
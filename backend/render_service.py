@@ -0,0 +1,365 @@
+"""
+render_service.py — PDF-renderöinnin prosessipooli
+KSHM-projekti
+
+ReportLab-taitto (pdf_utils.generate_pdf_from_story) on puhdasta Pythonia
+ja CPU-sidottua. Kutsuvan prosessin säikeessä ajettuna se kilpailee
+GIL:stä pyyntöjen käsittelyn kanssa, eikä jumiutunutta taittoa voi
+keskeyttää. RenderPool ajaa taiton erillisissä prosesseissa:
+
+  - kiinteä määrä työprosesseja (oletus: CPU-ytimet), käynnistetään
+    tarvittaessa; kukin keskustelee poolin kanssa omalla Pipe-parillaan
+  - rajattu jono: enintään workers + queue_size työtä kerrallaan sisällä;
+    sen yli submit odottaa submit_timeout sekuntia ja nostaa RenderBusy
+    (vastapaine — kutsuja voi vastata 503 tai yrittää myöhemmin)
+  - työkohtainen aikaraja: ylittävä työprosessi tapetaan ja korvataan,
+    kutsuja saa RenderTimeout
+  - kierrätys: työprosessi korvataan uudella kun sen muistin huippu
+    (RSS) ylittää max_rss_mb tai se on tehnyt max_jobs työtä
+
+Syöte on tarina-dict(it) kuten generate_pdf_from_story:lle; tulos on
+tiedostopolku (output_path annettu) tai PDF tavuina.
+
+Ympäristömuuttujat:
+  RENDER_WORKERS         — työprosessien määrä (oletus: CPU-ytimet)
+  RENDER_QUEUE_SIZE      — jonottavien töiden enimmäismäärä (oletus: 2 × workers)
+  RENDER_SUBMIT_TIMEOUT  — kauanko täyteen jonoon odotetaan, s (oletus: 30)
+  RENDER_TIMEOUT         — yhden PDF:n aikaraja, s (oletus: 120)
+  RENDER_MAX_RSS_MB      — työprosessin muistiraja kierrätykselle (oletus: 512)
+  RENDER_MAX_JOBS        — töitä per työprosessi ennen kierrätystä (oletus: 200)
+
+Käyttö:
+  import render_service
+  path = render_service.render_pdf(story_mt, story_y, output_path="r.pdf", user_name="...")
+  data = render_service.render_pdf(story_mt)                       # bytes
+  data = await render_service.render_pdf_async(story_mt)           # FastAPI
+"""
+
+from __future__ import annotations
+import asyncio
+import atexit
+import io
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Asetukset
+# ---------------------------------------------------------------------------
+
+DEFAULT_WORKERS = int(os.getenv("RENDER_WORKERS", 0)) or (os.cpu_count() or 1)
+QUEUE_SIZE      = int(os.getenv("RENDER_QUEUE_SIZE", 0)) or 2 * DEFAULT_WORKERS
+SUBMIT_TIMEOUT  = float(os.getenv("RENDER_SUBMIT_TIMEOUT", 30.0))
+RENDER_TIMEOUT  = float(os.getenv("RENDER_TIMEOUT", 120.0))
+MAX_RSS_MB      = float(os.getenv("RENDER_MAX_RSS_MB", 512))
+MAX_JOBS        = int(os.getenv("RENDER_MAX_JOBS", 200))
+
+
+class RenderError(Exception):
+    """PDF:n renderöinti epäonnistui (virhe taitossa tai työprosessi kaatui)."""
+
+
+class RenderBusy(RenderError):
+    """Jono täynnä — työtä ei otettu vastaan submit_timeout-ajassa."""
+
+
+class RenderTimeout(RenderError):
+    """Työ ylitti aikarajan; työprosessi tapettiin."""
+
+
+# ---------------------------------------------------------------------------
+# Työprosessi
+# ---------------------------------------------------------------------------
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:             # ei-POSIX: ei muistikierrätystä
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _worker_main(conn) -> None:
+    """Työprosessin silmukka: (kwargs, to_bytes) sisään, (tila, tulos, rss) ulos."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # pooli hoitaa pysäytyksen
+    import pdf_utils                                  # fontit rekisteröidään kerran tässä
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        kwargs, to_bytes = job
+        try:
+            if to_bytes:
+                buf = io.BytesIO()
+                pdf_utils.generate_pdf_from_story(output_path=buf, **kwargs)
+                result = buf.getvalue()
+            else:
+                pdf_utils.generate_pdf_from_story(**kwargs)
+                result = kwargs["output_path"]
+            reply = ("ok", result)
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        conn.send(reply + (_peak_rss_mb(),))
+
+
+class _Worker:
+    __slots__ = ("process", "conn", "jobs")
+
+    def __init__(self, ctx, name: str):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), name=name, daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+
+    def stop(self, wait: float = 2.0) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(wait)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Pooli
+# ---------------------------------------------------------------------------
+
+class RenderPool:
+    """
+    Kiinteän kokoinen renderöintipooli. Säieturvallinen: render_pdf
+    kutsutaan kutsujan säikeestä ja se odottaa tulosta (tai poikkeusta).
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+        timeout: float = RENDER_TIMEOUT,
+        submit_timeout: float = SUBMIT_TIMEOUT,
+        max_rss_mb: float = MAX_RSS_MB,
+        max_jobs: int = MAX_JOBS,
+    ):
+        self.size = max(1, workers)
+        self.timeout = timeout
+        self.submit_timeout = submit_timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_jobs = max_jobs
+        # spawn: pooli luodaan usein monisäikeisestä palvelinprosessista
+        self._ctx = multiprocessing.get_context("spawn")
+        self._admission = threading.BoundedSemaphore(self.size + max(0, queue_size))
+        self._cond = threading.Condition()
+        self._idle: List[_Worker] = []
+        self._running = 0           # käynnissä olevat työprosessit (vapaat + varatut)
+        self._spawned = 0
+        self._closed = False
+        self._stats = {"jobs": 0, "errors": 0, "timeouts": 0, "busy": 0, "recycled": 0}
+
+    # -- työprosessien hallinta ---------------------------------------------
+
+    def _count(self, key: str) -> None:
+        with self._cond:
+            self._stats[key] += 1
+
+    def _checkout(self) -> _Worker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RenderError("Renderöintipooli on suljettu")
+                if self._idle:
+                    return self._idle.pop()
+                if self._running < self.size:
+                    self._running += 1
+                    self._spawned += 1
+                    name = f"kshm-render-{self._spawned}"
+                    break
+                self._cond.wait()
+        try:
+            return _Worker(self._ctx, name)
+        except Exception:
+            self._discard(None)
+            raise
+
+    def _checkin(self, worker: _Worker, rss_mb: float) -> None:
+        worker.jobs += 1
+        if (self.max_rss_mb and rss_mb >= self.max_rss_mb) or \
+                (self.max_jobs and worker.jobs >= self.max_jobs):
+            logger.info(f"Kierrätetään {worker.process.name}: {worker.jobs} työtä, muistihuippu {rss_mb:.0f} Mt")
+            self._count("recycled")
+            worker.stop()
+            self._discard(None)
+            return
+        with self._cond:
+            if self._closed:
+                worker.stop()
+                self._running -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker: Optional[_Worker]) -> None:
+        """Tapetun/kierrätetyn työprosessin paikka vapautuu (uusi käynnistyy tarvittaessa)."""
+        if worker is not None:
+            worker.kill()
+        with self._cond:
+            self._running -= 1
+            self._cond.notify()
+
+    # -- julkinen API ------------------------------------------------------
+
+    def render_pdf(
+        self,
+        story_mt: Dict,
+        story_y: Optional[Dict] = None,
+        output_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Union[str, bytes]:
+        """
+        Renderöi PDF:n työprosessissa. output_path annettu → palauttaa polun,
+        muuten PDF:n tavuina. kwargs välitetään generate_pdf_from_story:lle
+        (user_name, notes, lang). Nostaa RenderBusy / RenderTimeout / RenderError.
+        """
+        job_kwargs = dict(kwargs, story_mt=story_mt, story_y=story_y)
+        if output_path is not None:
+            job_kwargs["output_path"] = os.fspath(output_path)
+        timeout = self.timeout if timeout is None else timeout
+
+        if not self._admission.acquire(timeout=self.submit_timeout):
+            self._count("busy")
+            raise RenderBusy(f"Renderöintijono täynnä ({self.submit_timeout:g} s odotus)")
+        try:
+            worker = self._checkout()
+            start = time.monotonic()
+            # Kaikki poikkeukset (myös esim. PicklingError lähetyksessä tai
+            # KeyboardInterrupt odotuksessa) hylkäävät työprosessin: muuten
+            # se jäisi varatuksi ja yhden prosessin pooli jumittuisi
+            try:
+                worker.conn.send((job_kwargs, output_path is None))
+                done = worker.conn.poll(timeout)
+                if done:
+                    status, result, rss_mb = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                self._count("errors")
+                self._discard(worker)
+                raise RenderError(f"Renderöintiprosessi kaatui: {e}")
+            except BaseException:
+                self._count("errors")
+                self._discard(worker)
+                raise
+            if not done:
+                self._count("timeouts")
+                self._discard(worker)
+                raise RenderTimeout(f"PDF-renderöinti ylitti aikarajan ({timeout:g} s)")
+
+            self._checkin(worker, rss_mb)
+            self._count("jobs")
+            logger.debug(f"PDF renderöity {time.monotonic() - start:.2f} s ({worker.process.name})")
+            if status != "ok":
+                self._count("errors")
+                raise RenderError(result)
+            return result
+        finally:
+            self._admission.release()
+
+    async def render_pdf_async(self, story_mt: Dict, story_y: Optional[Dict] = None, **kwargs) -> Union[str, bytes]:
+        """render_pdf tapahtumasilmukasta: odotus säiepoolissa, taitto työprosessissa."""
+        return await asyncio.to_thread(self.render_pdf, story_mt, story_y, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return dict(self._stats, workers=self._running, idle=len(self._idle), size=self.size)
+
+    def close(self) -> None:
+        """Pysäyttää vapaat työprosessit; varatut pysähtyvät kun niiden työ palaa."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._running -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
+
+    def __enter__(self) -> "RenderPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ---------------------------------------------------------------------------
+# Prosessikohtainen oletuspooli
+# ---------------------------------------------------------------------------
+
+_POOL: Optional[RenderPool] = None
+_POOL_PID: Optional[int] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> RenderPool:
+    """Prosessikohtainen pooli ympäristömuuttujien asetuksilla — luodaan uudelleen fork():n jälkeen."""
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            _POOL = RenderPool()
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+def render_pdf(story_mt: Dict, story_y: Optional[Dict] = None, **kwargs) -> Union[str, bytes]:
+    return get_pool().render_pdf(story_mt, story_y, **kwargs)
+
+
+async def render_pdf_async(story_mt: Dict, story_y: Optional[Dict] = None, **kwargs) -> Union[str, bytes]:
+    return await get_pool().render_pdf_async(story_mt, story_y, **kwargs)
+
+
+def shutdown() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_PID == os.getpid():
+            _POOL.close()
+        _POOL = None
+
+
+atexit.register(shutdown)
+
+
+# ---------------------------------------------------------------------------
+# CLI — savutesti: N raporttia rinnakkain
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    story = {
+        "title": "Savutesti",
+        "sections": [{"title": f"Jakso {i}", "content": "Muinainen DNA. " * 200} for i in range(30)],
+    }
+    pool = get_pool()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n) as ex:
+        sizes = list(ex.map(lambda _: len(pool.render_pdf(story)), range(n)))
+    print(f"{n} PDF:ää {time.perf_counter() - start:.2f} s, {pool.size} työprosessia, "
+          f"{sum(sizes) / 1024:.0f} kt yhteensä — {pool.stats()}")
@@ -1,15 +1,29 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Dict, FrozenSet, Iterable, Iterator, Sequence, Tuple
+from datetime import datetime, timezone
 from pathlib import Path
+from collections import OrderedDict
+import base64
+import bisect
+import hashlib
+import itertools
 import json
+import os
 import io
 import csv
+import threading
+import zlib
 import logging
 
+import aadr_db
+import geo_index
+import haplo_normalize
+import tile_builder
+
 logger = logging.getLogger("kshm-research")
 
 app = FastAPI(
@@ -109,61 +123,663 @@ class ResearchReport(BaseModel):
 
 DATA_DIR = Path(__file__).parent.parent / "data" / "haplogroups"
 
-def _load_all() -> dict[str, ResearchReport]:
+
+class _SourceFile:
+    """Yksi parsittu data/haplogroups/*.json-tiedosto. Ei muuteta luonnin jälkeen."""
+
+    __slots__ = ("name", "mtime_ns", "size", "sha256", "report", "aliases", "payloads")
+
+    def __init__(self, name: str, mtime_ns: int, size: int, sha256: str,
+                 report: ResearchReport, aliases: Tuple[str, ...], payloads: "ReportPayloads"):
+        self.name     = name
+        self.mtime_ns = mtime_ns
+        self.size     = size
+        self.sha256   = sha256
+        self.report   = report
+        self.aliases  = aliases
+        self.payloads = payloads
+
+    def restamped(self, st: os.stat_result) -> "_SourceFile":
+        """Sama sisältö, uusi mtime (esim. touch tai uudelleenkopiointi)."""
+        return _SourceFile(self.name, st.st_mtime_ns, st.st_size, self.sha256,
+                           self.report, self.aliases, self.payloads)
+
+
+def _parse_file(path: Path, data: bytes, st: os.stat_result, sha256: str) -> _SourceFile:
+    raw = json.loads(data)
+
+    # ancient_sample_count lasketaan automaattisesti jos puuttuu
+    if "ancient_sample_count" not in raw:
+        raw["ancient_sample_count"] = len(raw.get("ancient_samples", []))
+
+    # generated_at = tiedoston muokkausaika jos puuttuu — sama arvo
+    # kaikissa työprosesseissa, joten vastaus on tavulleen vakaa
+    raw.setdefault("generated_at", _mtime_iso(st))
+
+    report = ResearchReport(**raw)
+    # Aliakset kanonisessa muodossa (haplo_normalize), raportin linja vihjeenä
+    lineage = raw.get("lineage_type")
+    aliases = tuple(haplo_normalize.canonical_id(alias, lineage) for alias in raw.get("aliases", []))
+    return _SourceFile(path.name, st.st_mtime_ns, st.st_size, sha256,
+                       report, aliases, ReportPayloads(report, data))
+
+
+def _mtime_iso(st: os.stat_result) -> str:
+    mtime = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+    return mtime.replace(tzinfo=None).isoformat() + "Z"
+
+
+# ─────────────────────────────────────────────
+# VALMIIKSI SARJALLISTETUT VASTAUKSET
+# ─────────────────────────────────────────────
+
+# Selain/CDN saa käyttää vastausta tämän ajan kysymättä; sen jälkeen
+# If-None-Match-uudelleenvalidointi maksaa vain 304-vastauksen.
+CACHE_MAX_AGE = int(os.getenv("RESEARCH_CACHE_MAX_AGE", 60))
+
+# Nostetaan kun vastausten muoto muuttuu → kaikki ETagit vaihtuvat
+_PAYLOAD_FORMAT = "1"
+
+_CSV_FIELDS = [
+    "sample_id", "date_bp", "date_bp_uncertainty",
+    "region", "country", "site", "culture",
+    "snp_quality", "coverage", "source", "doi",
+]
+
+
+class ReportPayloads:
     """
-    Lataa kaikki JSON-tiedostot data/haplogroups/-hakemistosta käynnistyksessä.
-    Rakentaa hakutaulukon: kanoninen nimi + kaikki aliases → sama objekti.
+    Yhden raportin vastaukset tavuina. Koodataan kerran per datan versio
+    (ensimmäisellä pyynnöllä) ja jaetaan kaikkien pyyntöjen kesken —
+    osuma maksaa sanakirjahaun ja tavujen kopioinnin.
+
+    ETag johdetaan lähdetiedoston sha256:sta (+ generated_at ja muoto-
+    versio), joten se on vahva: sama tagi ⇔ samat tavut.
     """
-    db: dict[str, ResearchReport] = {}
 
-    if not DATA_DIR.exists():
-        logger.warning(f"Data-hakemistoa ei löydy: {DATA_DIR}")
-        return db
+    def __init__(self, report: ResearchReport, source: bytes):
+        digest = hashlib.sha256(source)
+        digest.update(f"\0{report.generated_at}\0{_PAYLOAD_FORMAT}".encode())
+        self.version = digest.hexdigest()[:20]
+        self._report = report
+        # Sivutusta varten: vakaa järjestys (date_bp, sample_id), lajitellaan kerran
+        self.samples_by_date: Tuple[AncientSample, ...] = tuple(
+            sorted(report.ancient_samples, key=lambda s: (s.date_bp, s.sample_id))
+        )
+        self._bodies: Dict[str, bytes] = {}
+
+    def etag(self, variant: str) -> str:
+        return f'"{self.version}-{variant}"'
+
+    def body(self, variant: str) -> bytes:
+        body = self._bodies.get(variant)
+        if body is None:
+            body = self._bodies[variant] = self._encode(variant)
+        return body
+
+    def _encode(self, variant: str) -> bytes:
+        report = self._report
+        if variant == "report":
+            return report.model_dump_json().encode("utf-8")
+        if variant == "samples":
+            return json.dumps({
+                "haplogroup":   report.haplogroup,
+                "sample_count": report.ancient_sample_count,
+                "samples":      [s.model_dump() for s in report.ancient_samples],
+            }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if variant == "csv":
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=_CSV_FIELDS)
+            writer.writeheader()
+            for s in report.ancient_samples:
+                writer.writerow(s.model_dump())
+            return output.getvalue().encode("utf-8")
+        raise ValueError(f"Tuntematon vastausmuoto: {variant}")
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match-vertailu (heikko vertailu RFC 9110 mukaan, myös '*')."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (t.strip() for t in if_none_match.split(","))
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def _cached_response(
+    request: Request,
+    payloads: ReportPayloads,
+    variant: str,
+    media_type: str = "application/json",
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    etag = payloads.etag(variant)
+    cache_headers = {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_MAX_AGE}"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    return Response(
+        content=payloads.body(variant),
+        media_type=media_type,
+        headers={**cache_headers, **(headers or {})},
+    )
+
+
+# ─────────────────────────────────────────────
+# SUORATOISTETUT VIENNIT
+# ─────────────────────────────────────────────
+#
+# AADR-kladipuun vienti voi olla tuhansia rivejä. Rivit kirjoitetaan
+# generaattorista ~64 kt paloina (StreamingResponse), joten muistinkulutus
+# per vienti on vakio tulosjoukon koosta riippumatta. gzip tehdään
+# virtana (zlib, wbits=31 → gzip-kehys) jos asiakas sen hyväksyy.
+
+_STREAM_CHUNK = 64 * 1024
+
+_AADR_CSV_FIELDS = [
+    "id", "group", "location", "country", "lat", "lon", "date_bce",
+    "publication", "mt", "y", "y_isogg", "y_manual", "notes", "source",
+]
+
+_STREAM_MEDIA_TYPES = {
+    "csv":    "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _csv_lines(rows: Iterable[Dict], fields: List[str]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _chunked(lines: Iterable[str]) -> Iterator[bytes]:
+    """Kokoaa rivit ~_STREAM_CHUNK-kokoisiksi tavupaloiksi."""
+    parts: List[str] = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= _STREAM_CHUNK:
+            yield "".join(parts).encode("utf-8")
+            parts.clear()
+            size = 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Accept-Encoding sisältää gzip:n (tai *) ilman q=0:aa."""
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        q = params.strip().lower()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _stream_export(
+    request: Request,
+    rows: Iterable[Dict],
+    format: str,
+    filename: str,
+    csv_fields: List[str],
+) -> StreamingResponse:
+    """StreamingResponse CSV:nä tai NDJSON:na, gzip-pakattuna jos asiakas hyväksyy."""
+    lines = _csv_lines(rows, csv_fields) if format == "csv" else _ndjson_lines(rows)
+    body = _chunked(lines)
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}.{format}",
+        "Vary": "Accept-Encoding",
+    }
+    if _accepts_gzip(request.headers.get("accept-encoding")):
+        body = _gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=_STREAM_MEDIA_TYPES[format], headers=headers)
+
+
+# ─────────────────────────────────────────────
+# HAKUINDEKSIT
+# ─────────────────────────────────────────────
+
+class SearchIndex:
+    """
+    /api/research/search -suodattimien käänteiset indeksit. Rakennetaan kerran
+    latauksessa; haku leikkaa postausjoukkoja eikä käy raportteja läpi.
+
+      by_lineage      lineage_type (pienillä) → raporttien sijainnit
+      by_place        erillinen alue-/maanimi (pienillä) → sijainnit
+                      (näytteiden region + country, geographic_distribution.region)
+      by_snp_quality  snp_quality (pienillä) → sijainnit
+      dates           näytteiden date_bp lajiteltuna + rinnakkainen sijaintilista
+                      → aikaväli on bisect-viipale
+
+    Aluehaku on osamerkkijonohaku kuten ennenkin ("land" osuu "Finland"),
+    joten se käy läpi erillisten paikannimien sanaston — ei näytteitä —
+    ja tulos muistetaan kyselykohtaisesti.
+
+    Kokonaiset hakutulokset pidetään LRU:ssa (query_key → raporttilista),
+    joten sivutuksen jatkosivu on pelkkä viipale.
+    """
+
+    _PLACE_CACHE_SIZE = 1024
+    _RESULT_CACHE_SIZE = 256
+
+    def __init__(self, db: dict[str, ResearchReport]):
+        # Erilliset raportit latausjärjestyksessä (aliakset osoittavat samaan objektiin)
+        self.reports: List[ResearchReport] = list({id(r): r for r in db.values()}.values())
+
+        by_lineage: Dict[str, set] = {}
+        by_place: Dict[str, set] = {}
+        by_quality: Dict[str, set] = {}
+        dated: List[Tuple[int, int]] = []
+
+        for pos, report in enumerate(self.reports):
+            by_lineage.setdefault(report.lineage_type.lower(), set()).add(pos)
+            for s in report.ancient_samples:
+                by_place.setdefault(s.region.lower(), set()).add(pos)
+                by_place.setdefault(s.country.lower(), set()).add(pos)
+                by_quality.setdefault(s.snp_quality.lower(), set()).add(pos)
+                dated.append((s.date_bp, pos))
+            for g in report.geographic_distribution:
+                by_place.setdefault(g.region.lower(), set()).add(pos)
+
+        self.by_lineage: Dict[str, FrozenSet[int]] = {k: frozenset(v) for k, v in by_lineage.items()}
+        self.by_place: Dict[str, FrozenSet[int]] = {k: frozenset(v) for k, v in by_place.items()}
+        self.by_snp_quality: Dict[str, FrozenSet[int]] = {k: frozenset(v) for k, v in by_quality.items()}
+
+        dated.sort()
+        self.dates: List[int] = [d for d, _ in dated]
+        self.date_positions: List[int] = [p for _, p in dated]
+
+        self._place_cache: Dict[str, FrozenSet[int]] = {}
+        self._results: "OrderedDict[Tuple, Tuple[ResearchReport, ...]]" = OrderedDict()
+
+    def places_matching(self, needle: str) -> FrozenSet[int]:
+        """Raportit joiden jokin paikannimi sisältää needle-merkkijonon."""
+        r = needle.lower()
+        hit = self._place_cache.get(r)
+        if hit is None:
+            hit = frozenset().union(*(posts for name, posts in self.by_place.items() if r in name))
+            if len(self._place_cache) >= self._PLACE_CACHE_SIZE:
+                self._place_cache.clear()
+            self._place_cache[r] = hit
+        return hit
+
+    def dated_between(self, min_date_bp: Optional[int], max_date_bp: Optional[int]) -> FrozenSet[int]:
+        """Raportit joilla on näyte välillä [min_date_bp, max_date_bp]."""
+        lo = 0 if min_date_bp is None else bisect.bisect_left(self.dates, min_date_bp)
+        hi = len(self.dates) if max_date_bp is None else bisect.bisect_right(self.dates, max_date_bp)
+        return frozenset(self.date_positions[lo:hi])
+
+    @staticmethod
+    def query_key(
+        lineage: Optional[str] = None,
+        region: Optional[str] = None,
+        snp_quality: Optional[str] = None,
+        min_date_bp: Optional[int] = None,
+        max_date_bp: Optional[int] = None,
+    ) -> Tuple:
+        """Normalisoitu kysely: samat suodattimet → sama avain (välimuisti, kursori)."""
+        dated = bool(min_date_bp or max_date_bp)
+        return (
+            lineage.lower() if lineage else None,
+            region.lower() if region else None,
+            snp_quality.lower() if snp_quality else None,
+            min_date_bp if dated else None,
+            max_date_bp if dated else None,
+        )
+
+    def search(
+        self,
+        lineage: Optional[str] = None,
+        region: Optional[str] = None,
+        snp_quality: Optional[str] = None,
+        min_date_bp: Optional[int] = None,
+        max_date_bp: Optional[int] = None,
+    ) -> Tuple[ResearchReport, ...]:
+        """Suodattimien leikkaus latausjärjestyksessä. Tulos jaetaan — älä muokkaa."""
+        key = self.query_key(lineage, region, snp_quality, min_date_bp, max_date_bp)
+        hit = self._results.get(key)
+        if hit is not None:
+            self._results.move_to_end(key)
+            return hit
+
+        hit = tuple(self.reports[pos] for pos in self._match(*key))
+        self._results[key] = hit
+        if len(self._results) > self._RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return hit
+
+    def _match(self, lineage, region, snp_quality, min_date_bp, max_date_bp) -> List[int]:
+        postings: List[FrozenSet[int]] = []
+        if lineage:
+            postings.append(self.by_lineage.get(lineage, frozenset()))
+        if snp_quality:
+            postings.append(self.by_snp_quality.get(snp_quality, frozenset()))
+        if region:
+            postings.append(self.places_matching(region))
+        if min_date_bp or max_date_bp:
+            postings.append(self.dated_between(min_date_bp, max_date_bp))
+
+        if not postings:
+            return list(range(len(self.reports)))
+        postings.sort(key=len)
+        return sorted(postings[0].intersection(*postings[1:]))
+
+
+# ─────────────────────────────────────────────
+# SIVUTUS
+# ─────────────────────────────────────────────
+#
+# limit + cursor. Kursori on läpinäkymätön base64url-merkkijono, joka
+# sisältää datan version, kyselyn tiivisteen ja jatkokohdan (offset).
+# Palvelin jatkaa suoraan valmiista tuloslistasta (kyselytulosten LRU,
+# esilajitellut näytteet) eikä aja suodatusta uudelleen alusta.
+# Jos data on päivitetty kursorin luonnin jälkeen, kursori hylätään (410),
+# jotta sivut eivät hyppää rivien yli tai toista niitä.
+
+PAGE_SIZE_DEFAULT = int(os.getenv("RESEARCH_PAGE_SIZE", 50))
+PAGE_SIZE_MAX     = int(os.getenv("RESEARCH_PAGE_SIZE_MAX", 1000))
+
 
+def _query_digest(key: Tuple) -> str:
+    return hashlib.sha256(json.dumps(key, separators=(",", ":")).encode()).hexdigest()[:12]
+
+
+def _encode_cursor(version: str, key: Tuple, offset: int) -> str:
+    token = json.dumps({"v": version, "q": _query_digest(key), "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, version: str, key: Tuple) -> int:
+    """Kursorin jatkokohta; HTTPException jos kursori on virheellinen tai vanhentunut."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset = int(data["o"])
+        cursor_version, digest = data["v"], data["q"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Virheellinen kursori.")
+    if digest != _query_digest(key) or offset < 0:
+        raise HTTPException(status_code=400, detail="Kursori ei kuulu tähän kyselyyn.")
+    if cursor_version != version:
+        raise HTTPException(status_code=410, detail="Kursori on vanhentunut (data päivitetty) — aloita alusta.")
+    return offset
+
+
+def _page(
+    items: Sequence,
+    version: str,
+    key: Tuple,
+    limit: Optional[int],
+    cursor: Optional[str],
+) -> Tuple[Sequence, Optional[str]]:
+    """(sivun alkiot, seuraava kursori tai None). Ilman limit/cursor → kaikki."""
+    if limit is None and cursor is None:
+        return items, None
+    start = _decode_cursor(cursor, version, key) if cursor else 0
+    end = start + (limit or PAGE_SIZE_DEFAULT)
+    next_cursor = _encode_cursor(version, key, end) if end < len(items) else None
+    return items[start:end], next_cursor
+
+
+# ─────────────────────────────────────────────
+# TILANNEKUVA JA INKREMENTAALINEN LATAUS
+# ─────────────────────────────────────────────
+
+class ResearchSnapshot:
+    """
+    Muuttumaton tilannekuva koko tietokannasta: tiedostot, hakutaulukko,
+    hakuindeksit ja valmiit vastaukset. Uusi kuva julkaistaan yhdellä
+    sijoituksella (_SNAPSHOT), joten pyyntö näkee aina yhtenäisen version
+    — lukijat ottavat viittauksen kerran eivätkä tarvitse lukkoja.
+
+      version    sisällön tiiviste (tiedostonimet + sha256) — sama kaikissa
+                 työprosesseissa joilla on sama data
+      signature  (nimi, mtime_ns, koko) -monikko — tiedostovahdin halpa vertailu
+    """
+
+    __slots__ = ("files", "db", "index", "version", "signature", "_payloads")
+
+    def __init__(self, files: Dict[str, _SourceFile]):
+        self.files = files
+
+        # Kanoninen avain (tiedostonimi ilman .json, haplo_normalize) + aliakset.
+        # Lajiteltu järjestys: sama tulosjärjestys ja alias-voittaja joka latauksessa.
+        db: dict[str, ResearchReport] = {}
+        for name in sorted(files):
+            sf = files[name]
+            db[haplo_normalize.canonical_id(Path(name).stem, sf.report.lineage_type)] = sf.report
+            for alias in sf.aliases:
+                db[alias] = sf.report
+        self.db = db
+        self.index = SearchIndex(db)
+        self._payloads = {id(sf.report): sf.payloads for sf in files.values()}
+
+        digest = hashlib.sha256()
+        for name in sorted(files):
+            digest.update(f"{name}\0{files[name].sha256}\0".encode())
+        self.version = digest.hexdigest()[:12]
+        self.signature = tuple(sorted((n, f.mtime_ns, f.size) for n, f in files.items()))
+
+    def lookup(self, haplogroup: str, lineage: Optional[str] = None) -> Optional[ResearchReport]:
+        """
+        Avaimet on tallennettu raportin linjalla, joten haku tehdään samoin.
+        Ilman vihjettä kokeillaan ensin mtDNA-avainta (nimi sellaisenaan)
+        ja sitten Y-aliasta — mtDNA:n N1c1 ei näin katoa Y:n N-M46:n alle.
+        """
+        if lineage:
+            return self.db.get(haplo_normalize.canonical_id(haplogroup, lineage))
+        return (self.db.get(haplo_normalize.canonical_id(haplogroup, "mt"))
+                or self.db.get(haplo_normalize.canonical_id(haplogroup, "y")))
+
+    def payloads(self, report: ResearchReport) -> "ReportPayloads":
+        return self._payloads[id(report)]
+
+
+def _dir_signature() -> Tuple:
+    """(nimi, mtime_ns, koko) jokaiselle JSON-tiedostolle — vain stat(), ei lukemista."""
+    if not DATA_DIR.exists():
+        return ()
+    out = []
     for path in DATA_DIR.glob("*.json"):
         try:
-            raw = json.loads(path.read_text(encoding="utf-8"))
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        out.append((path.name, st.st_mtime_ns, st.st_size))
+    return tuple(sorted(out))
 
-            # ancient_sample_count lasketaan automaattisesti jos puuttuu
-            if "ancient_sample_count" not in raw:
-                raw["ancient_sample_count"] = len(raw.get("ancient_samples", []))
 
-            # generated_at asetetaan latauksessa
-            raw.setdefault("generated_at", datetime.utcnow().isoformat() + "Z")
+def _load_all(previous: Optional[ResearchSnapshot] = None) -> Tuple[ResearchSnapshot, Dict[str, int]]:
+    """
+    Lataa data/haplogroups/-hakemiston JSON-tiedostot. Jos edellinen
+    tilannekuva annetaan, lataus on inkrementaalinen:
+
+      - sama mtime + koko      → tiedostoa ei lueta lainkaan
+      - eri mtime, sama sha256 → vanha parsittu raportti käytetään uudelleen
+      - muuttunut sisältö      → vain tämä tiedosto parsitaan
+      - parsinta epäonnistuu   → edellinen ehjä versio säilyy (esim. kesken
+                                 tallennuksen luettu tiedosto)
 
-            report = ResearchReport(**raw)
+    Palauttaa (tilannekuva, muutostilasto). Jos mikään ei muuttunut,
+    palautetaan sama tilannekuva-objekti.
+    """
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "errors": 0}
+    old_files = previous.files if previous is not None else {}
+    files: Dict[str, _SourceFile] = {}
+
+    if not DATA_DIR.exists():
+        logger.warning(f"Data-hakemistoa ei löydy: {DATA_DIR}")
+        paths: List[Path] = []
+    else:
+        paths = sorted(DATA_DIR.glob("*.json"))
 
-            # Kanoninen avain (tiedostonimi ilman .json, isot kirjaimet)
-            canonical = path.stem.upper()
-            db[canonical] = report
+    for path in paths:
+        old = old_files.get(path.name)
+        try:
+            st = path.stat()
+            if old is not None and (old.mtime_ns, old.size) == (st.st_mtime_ns, st.st_size):
+                files[path.name] = old
+                stats["unchanged"] += 1
+                continue
 
-            # Lisää aliases hakutaulukkoon
-            for alias in raw.get("aliases", []):
-                db[alias.upper()] = report
+            data = path.read_bytes()
+            sha256 = hashlib.sha256(data).hexdigest()
+            if old is not None and old.sha256 == sha256:
+                files[path.name] = old.restamped(st)
+                stats["unchanged"] += 1
+                continue
 
-            logger.info(f"Ladattu: {canonical} ({len(raw.get('ancient_samples', []))} näytettä)")
+            sf = _parse_file(path, data, st, sha256)
+            files[path.name] = sf
+            stats["changed" if old is not None else "added"] += 1
+            logger.info(f"Ladattu: {path.stem.upper()} ({len(sf.report.ancient_samples)} näytettä)")
 
         except Exception as e:
+            stats["errors"] += 1
             logger.error(f"Virhe tiedostossa {path.name}: {e}")
+            if old is not None:
+                files[path.name] = old
 
-    logger.info(f"Tietokanta ladattu: {len(set(db.values()))} haploryhmää, {len(db)} hakuavainta")
-    return db
+    stats["removed"] = len(set(old_files) - set(files))
+
+    if previous is not None and not (stats["added"] or stats["changed"] or stats["removed"]) \
+            and previous.signature == tuple(sorted((n, f.mtime_ns, f.size) for n, f in files.items())):
+        return previous, stats
+
+    snapshot = ResearchSnapshot(files)
+    logger.info(
+        f"Tietokanta ladattu: {len(snapshot.index.reports)} haploryhmää, {len(snapshot.db)} hakuavainta "
+        f"(versio {snapshot.version}; uusia {stats['added']}, muuttuneita {stats['changed']}, "
+        f"poistettuja {stats['removed']})"
+    )
+    return snapshot, stats
 
 
 # Ladataan kerran käynnistyksessä
-HAPLOGROUP_DB: dict[str, ResearchReport] = _load_all()
+_SNAPSHOT: ResearchSnapshot
+_SNAPSHOT, _ = _load_all()
+_RELOAD_LOCK = threading.Lock()
+
+# Yhteensopivuus: nykyisen tilannekuvan hakutaulukko
+HAPLOGROUP_DB: dict[str, ResearchReport] = _SNAPSHOT.db
+
+
+def current_snapshot() -> ResearchSnapshot:
+    return _SNAPSHOT
+
+
+def lookup(haplogroup: str, lineage: Optional[str] = None) -> Optional[ResearchReport]:
+    """Haku kanonisella ID:llä: kirjainkoko, ~-pääte ja Y-aliakset eivät vaikuta."""
+    return _SNAPSHOT.lookup(haplogroup, lineage)
+
+
+def refresh_db() -> Dict[str, int]:
+    """
+    Lataa muuttuneet tiedostot uudelleen ilman palvelimen uudelleenkäynnistystä
+    ja julkaisee uuden tilannekuvan atomisesti. Palauttaa muutostilaston.
+    """
+    global _SNAPSHOT, HAPLOGROUP_DB
+    with _RELOAD_LOCK:
+        snapshot, stats = _load_all(_SNAPSHOT)
+        _SNAPSHOT = snapshot
+        HAPLOGROUP_DB = snapshot.db
+    return stats
+
+
+# ─────────────────────────────────────────────
+# TIEDOSTOVAHTI
+# ─────────────────────────────────────────────
+#
+# Jokainen uvicorn-työprosessi pitää omaa kopiotaan tietokannasta, joten
+# POST /api/research/reload päivittää vain sen prosessin joka pyynnön sai.
+# Vahti tarkistaa hakemiston (pelkät stat()-kutsut) RESEARCH_WATCH_INTERVAL
+# sekunnin välein jokaisessa prosessissa ja lataa muutokset itse.
+
+WATCH_INTERVAL = float(os.getenv("RESEARCH_WATCH_INTERVAL", 0))   # 0 = pois käytöstä
+
+_watch_stop = threading.Event()
+_watch_thread: Optional[threading.Thread] = None
+
+
+def _watch_loop(interval: float) -> None:
+    while not _watch_stop.wait(interval):
+        try:
+            if _dir_signature() != _SNAPSHOT.signature:
+                stats = refresh_db()
+                logger.info(f"Tiedostovahti: data päivitetty ({stats})")
+        except Exception:
+            logger.exception("Tiedostovahti: uudelleenlataus epäonnistui")
+
+
+def start_watcher(interval: float = WATCH_INTERVAL) -> bool:
+    """Käynnistää tiedostovahdin taustasäikeen (kerran per prosessi)."""
+    global _watch_thread
+    if interval <= 0 or (_watch_thread is not None and _watch_thread.is_alive()):
+        return False
+    _watch_stop.clear()
+    _watch_thread = threading.Thread(
+        target=_watch_loop, args=(interval,), name="research-watcher", daemon=True,
+    )
+    _watch_thread.start()
+    logger.info(f"Tiedostovahti käynnissä: {DATA_DIR} ({interval:g} s välein)")
+    return True
+
+
+def stop_watcher() -> None:
+    _watch_stop.set()
+
 
+app.router.on_startup.append(start_watcher)
+app.router.on_shutdown.append(stop_watcher)
 
-def lookup(haplogroup: str) -> Optional[ResearchReport]:
-    """Case-insensitive haku – etsii ensin tarkalla, sitten isoilla kirjaimilla."""
-    key = haplogroup.strip()
-    return HAPLOGROUP_DB.get(key) or HAPLOGROUP_DB.get(key.upper())
+
+# ─────────────────────────────────────────────
+# AADR-INDEKSIN ESILATAUS
+# ─────────────────────────────────────────────
+#
+# aadr_db lataa indeksin laiskasti ensimmäisellä haulla. Palvelimessa
+# ladataan työprosessin käynnistyksessä (säiepoolissa), jotta ensimmäinen
+# käyttäjä ei maksa .anno-parsintaa. AADR_PRELOAD=0 ohittaa.
+
+AADR_PRELOAD = os.getenv("AADR_PRELOAD", "1") != "0"
 
 
-def refresh_db():
-    """Lataa tietokannan uudelleen ilman palvelimen uudelleenkäynnistystä."""
-    global HAPLOGROUP_DB
-    HAPLOGROUP_DB = _load_all()
+async def preload_aadr() -> None:
+    if not AADR_PRELOAD:
+        return
+    n = await run_in_threadpool(aadr_db.preload)
+    logger.info(f"AADR-indeksi esiladattu: {n} näytettä ({aadr_db.get_aadr_version()})")
+
+
+app.router.on_startup.append(preload_aadr)
 
 
 def now() -> str:
@@ -176,10 +792,12 @@ def now() -> str:
 
 @app.get("/health")
 async def health_check():
+    snap = current_snapshot()
     return {
         "status": "healthy",
         "version": app.version,
-        "haplogroups_loaded": len(set(HAPLOGROUP_DB.values())),
+        "haplogroups_loaded": len(snap.index.reports),
+        "data_version": snap.version,
         "data_dir": str(DATA_DIR),
         "timestamp": now(),
     }
@@ -192,6 +810,8 @@ async def search_haplogroups(
     snp_quality: Optional[str] = Query(None, description="High / Medium / Low"),
     min_date_bp: Optional[int] = Query(None, description="Vanhin hyväksytty näyte (BP)"),
     max_date_bp: Optional[int] = Query(None, description="Nuorin hyväksytty näyte (BP)"),
+    limit:       Optional[int] = Query(None, ge=1, le=PAGE_SIZE_MAX, description="Sivun koko"),
+    cursor:      Optional[str] = Query(None, description="Edellisen sivun next_cursor"),
 ):
     """
     Hae haploryhmäraportteja suodattimilla.
@@ -199,40 +819,15 @@ async def search_haplogroups(
       /api/research/search?lineage=mtDNA&region=Ireland
       /api/research/search?snp_quality=High&max_date_bp=3000
       /api/research/search?min_date_bp=5000&max_date_bp=10000
+      /api/research/search?min_date_bp=5000&limit=20&cursor=<next_cursor>
     """
+    snap = current_snapshot()
+    key = SearchIndex.query_key(lineage, region, snp_quality, min_date_bp, max_date_bp)
+    matches = snap.index.search(*key)
+    page, next_cursor = _page(matches, snap.version, key, limit, cursor)
     results = []
 
-    for report in set(HAPLOGROUP_DB.values()):
-
-        if lineage and report.lineage_type.lower() != lineage.lower():
-            continue
-
-        if region:
-            r = region.lower()
-            in_samples = any(
-                r in s.region.lower() or r in s.country.lower()
-                for s in report.ancient_samples
-            )
-            in_dist = any(r in g.region.lower() for g in report.geographic_distribution)
-            if not in_samples and not in_dist:
-                continue
-
-        if snp_quality:
-            if not any(
-                s.snp_quality.lower() == snp_quality.lower()
-                for s in report.ancient_samples
-            ):
-                continue
-
-        if min_date_bp or max_date_bp:
-            matching = [
-                s for s in report.ancient_samples
-                if (min_date_bp is None or s.date_bp >= min_date_bp)
-                and (max_date_bp is None or s.date_bp <= max_date_bp)
-            ]
-            if not matching:
-                continue
-
+    for report in page:
         results.append({
             "haplogroup":           report.haplogroup,
             "lineage_type":         report.lineage_type,
@@ -250,41 +845,309 @@ async def search_haplogroups(
             "min_date_bp": min_date_bp, "max_date_bp": max_date_bp,
         },
         "result_count": len(results),
+        "total": len(matches),
+        "next_cursor": next_cursor,
         "results": results,
     }
 
 
+# AADR-haut ajetaan säiepoolissa: indeksin lataus tai pitkä kladipuu ei
+# pysäytä tapahtumasilmukkaa. Reitit ennen /api/research/{haplogroup}-reittejä.
+
+_LINEAGE_PATTERN = "^(mt|y)$"
+
+
+def _aadr_samples(haplogroup: str, lineage: str, samples: List[Dict]) -> Dict:
+    return {
+        "haplogroup":   haplogroup,
+        "lineage":      lineage,
+        "aadr_version": aadr_db.get_aadr_version(),
+        "sample_count": len(samples),
+        "samples":      samples,
+    }
+
+
+@app.get("/api/research/aadr/clades")
+async def list_aadr_clades(
+    lineage:   str = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    min_count: int = Query(1, ge=1, description="Vähimmäisnäytemäärä"),
+    limit:     Optional[int] = Query(None, ge=1, description="Enintään N suurinta kladia"),
+):
+    """Kaikki AADR-indeksin kladit näytemäärän mukaan (suurin ensin)."""
+    clades = await run_in_threadpool(aadr_db.list_available_clades, lineage, min_count=min_count)
+    if limit is not None:
+        clades = clades[:limit]
+    return {
+        "lineage":      lineage,
+        "aadr_version": aadr_db.get_aadr_version(),
+        "clade_count":  len(clades),
+        "clades":       [{"clade": name, "sample_count": count} for name, count in clades],
+    }
+
+
+@app.get("/api/research/aadr/{haplogroup}/nearest")
+async def get_aadr_nearest(
+    haplogroup: str,
+    lineage:             str  = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    limit:               int  = Query(10, ge=1, le=PAGE_SIZE_MAX),
+    require_coordinates: bool = Query(False, description="Vain koordinaatilliset näytteet"),
+    exclude_modern:      bool = Query(True, description="Ohita modernit .DG-referenssinäytteet"),
+):
+    """Lähimmät aDNA-näytteet (täsmällinen tai pisin etuliiteosuma), vanhin ensin."""
+    hg = haplo_normalize.canonical_id(haplogroup, lineage)
+    samples = await run_in_threadpool(
+        aadr_db.get_nearest_samples, hg, limit, lineage,
+        require_coordinates=require_coordinates, exclude_modern=exclude_modern,
+    )
+    return _aadr_samples(hg, lineage, samples)
+
+
+@app.get("/api/research/aadr/{haplogroup}/clade")
+async def get_aadr_clade(
+    haplogroup: str,
+    lineage:        str  = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    limit:          int  = Query(50, ge=1, le=PAGE_SIZE_MAX),
+    exclude_modern: bool = Query(True, description="Ohita modernit .DG-referenssinäytteet"),
+):
+    """Koko kladipuun näytteet (esim. kaikki U5*), vanhin ensin. Kaikki rivit: /export."""
+    hg = haplo_normalize.canonical_id(haplogroup, lineage)
+    samples = await run_in_threadpool(
+        aadr_db.get_clade_tree_samples, hg, lineage,
+        max_total=limit, exclude_modern=exclude_modern,
+    )
+    return _aadr_samples(hg, lineage, samples)
+
+
+@app.get("/api/research/aadr/{haplogroup}/region/{country}")
+async def get_aadr_region(
+    haplogroup: str,
+    country: str,
+    lineage: str = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    limit:   int = Query(50, ge=1, le=PAGE_SIZE_MAX),
+):
+    """Haploryhmän näytteet maittain (osamerkkijono, esim. 'Fin' → Finland)."""
+    hg = haplo_normalize.canonical_id(haplogroup, lineage)
+    samples = await run_in_threadpool(
+        aadr_db.get_samples_by_region, hg, country, lineage, n=limit,
+    )
+    result = _aadr_samples(hg, lineage, samples)
+    result["country"] = country
+    return result
+
+
+@app.get("/api/research/aadr/{haplogroup}/count")
+async def get_aadr_count(
+    haplogroup: str,
+    lineage: str = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+):
+    """Näytemäärä haploryhmälle (täsmällinen tai pisin etuliiteosuma)."""
+    hg = haplo_normalize.canonical_id(haplogroup, lineage)
+    count = await run_in_threadpool(aadr_db.get_sample_count, hg, lineage)
+    return {
+        "haplogroup":   hg,
+        "lineage":      lineage,
+        "aadr_version": aadr_db.get_aadr_version(),
+        "sample_count": count,
+    }
+
+
+def _geo_collection(
+    bbox: geo_index.BBox,
+    haplogroup: Optional[str],
+    lineage: str,
+    from_bp: Optional[int],
+    to_bp: Optional[int],
+    zoom: int,
+    source: str,
+    exclude_modern: bool,
+) -> Dict:
+    """AADR- ja suomalaisnäytteet alueelta GeoJSONiksi (ajetaan säiepoolissa)."""
+    points = tile_builder.collect_points(bbox, haplogroup, lineage, from_bp, to_bp, source, exclude_modern)
+    collection = geo_index.feature_collection(
+        points, zoom, lambda ref: tile_builder.sample_props(ref, lineage),
+    )
+    collection["bbox"] = list(bbox)
+    return collection
+
+
+@app.get("/api/research/geo")
+async def get_geo_samples(
+    bbox:           Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    haplogroup:     Optional[str] = Query(None, description="Klade (koko kladipuu), esim. U5"),
+    lineage:        str  = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    from_bp:        Optional[int] = Query(None, description="Aikavälin alku (vanhempi pää, BP)"),
+    to_bp:          Optional[int] = Query(None, description="Aikavälin loppu (nuorempi pää, BP)"),
+    zoom:           int  = Query(4, ge=0, le=22, description="Kartan zoom-taso (Leaflet)"),
+    source:         str  = Query("all", enum=["all", "aadr", "finnish"], pattern="^(all|aadr|finnish)$"),
+    exclude_modern: bool = Query(True, description="Ohita modernit .DG-referenssinäytteet"),
+):
+    """
+    Näkymän näytteet GeoJSONina kartoille. Matalilla zoom-tasoilla
+    palvelin klusteroi pisteet (properties.cluster = true, point_count),
+    ja piirteiden määrä on aina rajattu (GEO_MAX_FEATURES).
+
+      /api/research/geo?bbox=19,59.5,32,70.5&haplogroup=U5&zoom=5
+      /api/research/geo?haplogroup=N-L550&lineage=y&from_bp=5000&to_bp=1000
+    """
+    try:
+        box = geo_index.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if haplogroup:
+        haplogroup = haplo_normalize.canonical_id(haplogroup, lineage)
+    return await run_in_threadpool(
+        _geo_collection, box, haplogroup, lineage, from_bp, to_bp, zoom, source, exclude_modern,
+    )
+
+
+# Esirakennetut tiilet (tile_builder.py). Versioitu URL (?v=<sormenjälki>
+# manifestista) → "immutable"; muuten tavallinen välimuistiaika.
+
+TILE_CACHE_MAX_AGE = int(os.getenv("RESEARCH_TILE_CACHE_MAX_AGE", 3600))
+
+_tile_manifest: Tuple[Optional[int], Dict] = (None, {})
+
+
+def _load_tile_manifest() -> Dict:
+    """Manifesti luetaan uudelleen vain kun tiedosto muuttuu (rakentajan ajo)."""
+    global _tile_manifest
+    try:
+        mtime = tile_builder.manifest_path().stat().st_mtime_ns
+    except OSError:
+        return {}
+    if _tile_manifest[0] != mtime:
+        _tile_manifest = (mtime, tile_builder.load_manifest())
+    return _tile_manifest[1]
+
+
+@app.get("/api/research/tiles/manifest")
+async def get_tile_manifest():
+    """Kerrokset, sormenjäljet (tiilien versiot) ja zoom-tasot."""
+    manifest = _load_tile_manifest()
+    if not manifest:
+        raise HTTPException(status_code=404, detail="Tiiliä ei ole rakennettu (python tile_builder.py).")
+    return manifest
+
+
+@app.get("/api/research/tiles/{lineage}/{layer}/{z}/{x}/{y}.json")
+async def get_tile(lineage: str, layer: str, z: int, x: int, y: int, v: Optional[str] = None):
+    """Yksi esiklusteroitu GeoJSON-tiili. Tyhjä alue → tyhjä FeatureCollection."""
+    meta = _load_tile_manifest().get("layers", {}).get(f"{lineage}/{layer}")
+    if meta is None or not (0 <= z <= meta["max_zoom"]) or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tiiltä ei löydy.")
+
+    # Versio on hakemiston nimi: ?v=<sormenjälki> palvellaan juuri siitä
+    # versiosta niin kauan kuin se on levyllä (nykyinen tai edellinen
+    # rakennus), joten "immutable" ei koskaan merkitse väärää sisältöä
+    version = meta["fingerprint"]
+    immutable = v is not None and (v == version or tile_builder.has_version(lineage, layer, v))
+    if immutable:
+        version = v
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = f"public, max-age={TILE_CACHE_MAX_AGE}"
+    headers = {"Cache-Control": cache_control, "ETag": f'"{version}-{z}-{x}-{y}"'}
+
+    path = tile_builder.tile_path(lineage, layer, z, x, y, version)
+    if not path.is_file():
+        return Response(content=b'{"type":"FeatureCollection","features":[]}',
+                        media_type="application/json", headers=headers)
+    return FileResponse(path, media_type="application/json", headers=headers)
+
+
+@app.get("/api/research/aadr/{haplogroup}/export")
+async def export_aadr_clade(
+    request: Request,
+    haplogroup: str,
+    lineage:        str  = Query("mt", enum=["mt", "y"], pattern=_LINEAGE_PATTERN),
+    format:         str  = Query("csv", enum=["csv", "ndjson"]),
+    exclude_modern: bool = Query(True, description="Ohita modernit .DG-referenssinäytteet"),
+    limit:          Optional[int] = Query(None, ge=1, description="Rivien enimmäismäärä"),
+):
+    """
+    Koko AADR-kladipuun näytteet (esim. kaikki U5*) kronologisesti,
+    suoratoistettuna CSV:nä tai NDJSON:na. Accept-Encoding: gzip → pakattu virta.
+
+      /api/research/aadr/U5/export?format=ndjson
+      /api/research/aadr/N-L550/export?lineage=y
+    """
+    # Indeksin (mahdollinen) ensilataus ei saa pysäyttää tapahtumasilmukkaa
+    hg = haplo_normalize.canonical_id(haplogroup, lineage)
+    rows = await run_in_threadpool(
+        aadr_db.iter_clade_tree_samples, hg, lineage, exclude_modern=exclude_modern,
+    )
+    first = next(rows, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail=f"AADR-näytteitä ei löydy: {hg}")
+    rows = itertools.chain((first,), rows)
+    if limit is not None:
+        rows = itertools.islice(rows, limit)
+    return _stream_export(request, rows, format, f"{hg}_aadr_{lineage}", _AADR_CSV_FIELDS)
+
+
 @app.get("/api/research/{haplogroup}", response_model=ResearchReport)
-async def get_research_report(haplogroup: str):
-    """Täysi tutkimusraportti – Research Edition PDF:n ja dashboardin datalähde."""
-    report = lookup(haplogroup)
+async def get_research_report(
+    haplogroup: str,
+    request: Request,
+    lineage: Optional[str] = Query(None, enum=["mt", "y"], pattern=_LINEAGE_PATTERN,
+                                   description="Linjavihje samannimisille (esim. N1c1)"),
+):
+    """
+    Täysi tutkimusraportti – Research Edition PDF:n ja dashboardin datalähde.
+    Valmiiksi sarjallistettu; tukee If-None-Match → 304.
+    """
+    snap = current_snapshot()
+    report = snap.lookup(haplogroup, lineage)
     if not report:
-        available = sorted(set(r.haplogroup for r in HAPLOGROUP_DB.values()))
+        available = sorted(set(r.haplogroup for r in snap.index.reports))
         raise HTTPException(
             status_code=404,
             detail=f"Haploryhmää '{haplogroup}' ei löydy. Saatavilla: {available}"
         )
-    report.generated_at = now()
-    return report
+    return _cached_response(request, snap.payloads(report), "report")
 
 
 @app.get("/api/research/{haplogroup}/samples")
-async def get_ancient_samples(haplogroup: str):
-    """Pelkät muinaisnäytteet – dashboardin taulukkoa varten."""
-    report = lookup(haplogroup)
+async def get_ancient_samples(
+    haplogroup: str,
+    request: Request,
+    lineage: Optional[str] = Query(None, enum=["mt", "y"], pattern=_LINEAGE_PATTERN,
+                                   description="Linjavihje samannimisille (esim. N1c1)"),
+    limit:  Optional[int] = Query(None, ge=1, le=PAGE_SIZE_MAX, description="Sivun koko"),
+    cursor: Optional[str] = Query(None, description="Edellisen sivun next_cursor"),
+):
+    """
+    Pelkät muinaisnäytteet – dashboardin taulukkoa varten.
+    limit/cursor → sivutettu, järjestys (date_bp, sample_id).
+    """
+    snap = current_snapshot()
+    report = snap.lookup(haplogroup, lineage)
     if not report:
         raise HTTPException(status_code=404, detail="Haploryhmää ei löydy.")
+    payloads = snap.payloads(report)
+    if limit is None and cursor is None:
+        return _cached_response(request, payloads, "samples")
+
+    key = ("samples", report.haplogroup)
+    samples = payloads.samples_by_date
+    page, next_cursor = _page(samples, payloads.version, key, limit, cursor)
     return {
         "haplogroup":   report.haplogroup,
         "sample_count": report.ancient_sample_count,
-        "samples":      [s.model_dump() for s in report.ancient_samples],
+        "total":        len(samples),
+        "next_cursor":  next_cursor,
+        "samples":      [s.model_dump() for s in page],
     }
 
 
 @app.get("/api/research/{haplogroup}/phylogeny")
-async def get_phylogeny(haplogroup: str):
+async def get_phylogeny(
+    haplogroup: str,
+    lineage: Optional[str] = Query(None, enum=["mt", "y"], pattern=_LINEAGE_PATTERN,
+                                   description="Linjavihje samannimisille (esim. N1c1)"),
+):
     """Fylogeneettinen sijoitus – dashboardin puunäkymää varten."""
-    report = lookup(haplogroup)
+    report = lookup(haplogroup, lineage)
     if not report:
         raise HTTPException(status_code=404, detail="Haploryhmää ei löydy.")
     return report.phylogenetic_placement.model_dump()
@@ -292,35 +1155,34 @@ async def get_phylogeny(haplogroup: str):
 
 @app.get("/api/research/{haplogroup}/export")
 async def export_data(
+    request: Request,
     haplogroup: str,
-    format: str = Query("json", enum=["json", "csv"])
+    format: str = Query("json", enum=["json", "csv", "ndjson"]),
+    lineage: Optional[str] = Query(None, enum=["mt", "y"], pattern=_LINEAGE_PATTERN,
+                                   description="Linjavihje samannimisille (esim. N1c1)"),
 ):
-    """Exportoi muinaisnäytteet CSV:nä tai täysi raportti JSON:na."""
-    report = lookup(haplogroup)
+    """Exportoi muinaisnäytteet CSV:nä tai NDJSON:na, tai täysi raportti JSON:na."""
+    snap = current_snapshot()
+    report = snap.lookup(haplogroup, lineage)
     if not report:
         raise HTTPException(status_code=404, detail="Haploryhmää ei löydy.")
+    payloads = snap.payloads(report)
+
+    if format == "ndjson":
+        rows = (sample.model_dump() for sample in report.ancient_samples)
+        return _stream_export(request, rows, format, f"{haplogroup}_ancient_samples", _CSV_FIELDS)
 
     if format == "csv":
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=[
-            "sample_id", "date_bp", "date_bp_uncertainty",
-            "region", "country", "site", "culture",
-            "snp_quality", "coverage", "source", "doi"
-        ])
-        writer.writeheader()
-        for s in report.ancient_samples:
-            writer.writerow(s.model_dump())
-        return Response(
-            content=output.getvalue(),
+        return _cached_response(
+            request, payloads, "csv",
             media_type="text/csv",
             headers={
                 "Content-Disposition":
                     f"attachment; filename={haplogroup}_ancient_samples.csv"
-            }
+            },
         )
 
-    report.generated_at = now()
-    return report.model_dump()
+    return _cached_response(request, payloads, "report")
 
 
 @app.post("/api/research/reload")
@@ -328,12 +1190,17 @@ async def reload_database():
     """
     Lataa JSON-tiedostot uudelleen ilman palvelimen uudelleenkäynnistystä.
     Käytä kun lisäät uuden haploryhmän data/haplogroups/-hakemistoon.
+    Vain muuttuneet tiedostot parsitaan; uusi tilannekuva vaihdetaan
+    atomisesti. Monen työprosessin ajossa käytä RESEARCH_WATCH_INTERVAL-vahtia.
     HUOM: Suojaa tämä autentikoinnilla tuotannossa.
     """
-    refresh_db()
+    stats = await run_in_threadpool(refresh_db)
+    snap = current_snapshot()
     return {
         "status": "reloaded",
-        "haplogroups_loaded": len(set(HAPLOGROUP_DB.values())),
+        "haplogroups_loaded": len(snap.index.reports),
+        "data_version": snap.version,
+        "changes": stats,
         "timestamp": now(),
     }
 
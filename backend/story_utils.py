@@ -165,8 +165,8 @@ def generate_dual_haplogroup_story(
     – symbolinen rakkaustarina
     – yhteinen perintö-loppuhuipennus
     """
-    y_data  = fetch_full_haplogroup_data(y_haplogroup)
-    mt_data = fetch_full_haplogroup_data(mt_haplogroup)
+    y_data  = fetch_full_haplogroup_data(y_haplogroup, "y")
+    mt_data = fetch_full_haplogroup_data(mt_haplogroup, "mt")
     style   = get_style_profile(lang=lang, tone=tone)
 
     story: Dict = {
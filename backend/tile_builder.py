@@ -0,0 +1,349 @@
+"""
+tile_builder.py — Esiklusteroitu karttatiilipyramidi näytekartoille
+KSHM-projekti
+
+Staattiset karttasivut latautuvat nopeammin valmiista tiilistä kuin
+bbox-hauista. Rakentaja kokoaa AADR-indeksin (sis. MANUAL_ADDITIONS) ja
+finnish_samples_db:n näytteet, ja kirjoittaa jokaiselle kerrokselle
+zoom-pyramidin (web mercator z/x/y) klusteroituja GeoJSON-tiiliä:
+
+  <TILE_DIR>/manifest.json
+  <TILE_DIR>/<linja>/<kerros>/<sormenjälki>/<z>/<x>/<y>.json
+
+Kerrokset: "all" (kaikki näytteet) + jokainen pääklade jossa on vähintään
+TILE_MIN_CLADE_SAMPLES karttapistettä (mt: "U5", "H1"…; Y: "N", "R"…).
+Näyte kuuluu tasan yhteen pääkladikerrokseen oman kladinsa mukaan
+(major_clade), joten "H1"-kerroksessa ei ole H10–H19-näytteitä ja
+manifestin samples on kerroksen pistemäärä. Tyhjiä tiiliä ei kirjoiteta.
+Syvemmät zoomit: /api/research/geo.
+
+Inkrementaalisuus: jokaisen kerroksen sisällöstä (pisteet + ominaisuudet +
+asetukset) lasketaan sormenjälki. Kun .anno-versio vaihtuu, vain ne
+kerrokset kirjoitetaan uudelleen joiden sisältö muuttui; poistuneet
+kerrokset siivotaan.
+
+Sormenjälki on myös tiilien versio ja hakemiston nimi: uusi versio
+kirjoitetaan omaan hakemistoonsa (tmp → rename), manifesti päivitetään,
+ja vasta sitten siivotaan versiot jotka eivät ole nykyisessä tai
+edellisessä manifestissa. Siksi /api/research/tiles/...?v=<sormenjälki>
+palvelee aina juuri sen version tiilet ja voidaan välimuistittaa
+"immutable"-otsakkeella — myös rakentajan ajon aikana.
+
+Ympäristömuuttujat:
+  KSHM_TILE_DIR            — tiilihakemisto (oletus: data/tiles)
+  TILE_MAX_ZOOM            — syvin zoom-taso (oletus: 6)
+  TILE_MAX_FEATURES        — piirteitä enintään per tiili (oletus: 500)
+  TILE_MIN_CLADE_SAMPLES   — pääkladin vähimmäisnäytemäärä (oletus: 50)
+
+Käyttö:
+  cd backend && python tile_builder.py [anno_path] [--force]   # rakenna/päivitä
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aadr_db
+import finnish_samples_db
+import geo_index
+from geo_index import WORLD, BBox, GeoPoint
+
+logger = logging.getLogger(__name__)
+
+TILE_DIR            = Path(os.getenv("KSHM_TILE_DIR", Path(__file__).parent.parent / "data" / "tiles"))
+TILE_MAX_ZOOM       = int(os.getenv("TILE_MAX_ZOOM", 6))
+TILE_MAX_FEATURES   = int(os.getenv("TILE_MAX_FEATURES", 500))
+TILE_MIN_CLADE_SAMPLES = int(os.getenv("TILE_MIN_CLADE_SAMPLES", 50))
+
+# Nostetaan kun tiilien sisältö tai muoto muuttuu → kaikki kerrokset uusiksi
+# (2: kerros = oman kladin näytteet, versioidut hakemistot)
+TILE_FORMAT = 2
+
+_VERSION = re.compile(r"^[0-9a-f]{16}$")
+
+LINEAGES = ("mt", "y")
+
+_MERCATOR_MAX_LAT = 85.0511287798
+
+
+# ---------------------------------------------------------------------------
+# Pisteiden kokoaminen (jaettu /api/research/geo:n kanssa)
+# ---------------------------------------------------------------------------
+
+def collect_points(
+    bbox: BBox = WORLD,
+    haplogroup: Optional[str] = None,
+    lineage: str = "mt",
+    from_bp: Optional[int] = None,
+    to_bp: Optional[int] = None,
+    source: str = "all",
+    exclude_modern: bool = True,
+    anno_path: str = aadr_db.DEFAULT_ANNO_PATH,
+) -> List[GeoPoint]:
+    """AADR- ja suomalaisnäytteet pisteinä; viite = ("aadr" | "finnish", rivi)."""
+    points: List[GeoPoint] = []
+    if source in ("all", "aadr"):
+        points.extend(
+            (lon, lat, bp, ("aadr", r)) for lon, lat, bp, r in aadr_db.get_geo_points(
+                bbox, haplogroup, lineage, from_bp, to_bp, exclude_modern, anno_path,
+            )
+        )
+    # Suomalaisaineisto on vain mtDNA:ta
+    if source in ("all", "finnish") and lineage == "mt":
+        points.extend(
+            (lon, lat, bp, ("finnish", r)) for lon, lat, bp, r in finnish_samples_db.get_geo_points(
+                bbox, haplogroup, from_bp, to_bp,
+            )
+        )
+    return points
+
+
+def sample_props(ref: Tuple[str, int], lineage: str = "mt",
+                 anno_path: str = aadr_db.DEFAULT_ANNO_PATH) -> Dict:
+    """Yksittäisen pisteen GeoJSON-ominaisuudet (date_bp lisätään erikseen)."""
+    kind, row = ref
+    if kind == "aadr":
+        s = aadr_db.get_sample_row(row, anno_path)
+        hg = s["mt"] if lineage == "mt" else (s["y_isogg"] or s["y"])
+        return {"source": kind, "id": s["id"], "haplogroup": hg,
+                "site": s["location"], "country": s["country"], "group": s["group"]}
+    s = finnish_samples_db.get_sample_row(row)
+    return {"source": kind, "id": s["id"], "haplogroup": s.get("mt"),
+            "site": s.get("site"), "country": s.get("country"), "group": s.get("culture")}
+
+
+# ---------------------------------------------------------------------------
+# Kerrokset
+# ---------------------------------------------------------------------------
+
+_MT_MAJOR = re.compile(r"^[A-Z]+[0-9]*")
+_Y_MAJOR  = re.compile(r"^[A-Z]+")
+
+
+def major_clade(key: str, lineage: str) -> Optional[str]:
+    """Indeksiavain → pääklade: "U5b1b1" → "U5", "N-L550" → "N"."""
+    m = (_MT_MAJOR if lineage == "mt" else _Y_MAJOR).match(key.upper())
+    return m.group(0) if m else None
+
+
+def layer_name(clade: str) -> str:
+    """Tiedostojärjestelmä- ja URL-turvallinen kerroksen nimi."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", clade)
+
+
+def layer_points(lineage: str, anno_path: str = aadr_db.DEFAULT_ANNO_PATH) -> Dict[str, List[GeoPoint]]:
+    """
+    "all" + pääkladit joissa vähintään TILE_MIN_CLADE_SAMPLES karttapistettä
+    → kerroksen pisteet. Pääklade tulee näytteen omasta kladista, ei
+    etuliitehausta (etuliite "H1" osuisi myös H10–H19:ään).
+    """
+    points = collect_points(lineage=lineage, anno_path=anno_path)
+    aadr_keys = aadr_db.clade_keys_by_row(lineage, anno_path)
+    groups: Dict[str, List[GeoPoint]] = defaultdict(list)
+    for p in points:
+        kind, row = p[3]
+        key = aadr_keys.get(row) if kind == "aadr" else finnish_samples_db.get_sample_row(row).get("mt")
+        major = major_clade(key or "", lineage)
+        if major:
+            groups[major].append(p)
+    layers = {"all": points}
+    for major in sorted(groups):
+        if len(groups[major]) >= TILE_MIN_CLADE_SAMPLES:
+            layers[major] = groups[major]
+    return layers
+
+
+def list_layers(lineage: str, anno_path: str = aadr_db.DEFAULT_ANNO_PATH) -> List[str]:
+    return list(layer_points(lineage, anno_path))
+
+
+# ---------------------------------------------------------------------------
+# Tiilet
+# ---------------------------------------------------------------------------
+
+def tile_of(lon: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """Web mercator -tiili (x, y) pisteelle."""
+    n = 2 ** zoom
+    lat = max(-_MERCATOR_MAX_LAT, min(_MERCATOR_MAX_LAT, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def build_tiles(points: List[GeoPoint], props, max_zoom: int = TILE_MAX_ZOOM) -> Iterable[Tuple[int, int, int, bytes]]:
+    """(z, x, y, JSON-tavut) jokaiselle ei-tyhjälle tiilelle."""
+    for zoom in range(max_zoom + 1):
+        buckets: Dict[Tuple[int, int], List[GeoPoint]] = defaultdict(list)
+        for p in points:
+            buckets[tile_of(p[0], p[1], zoom)].append(p)
+        for (x, y) in sorted(buckets):
+            collection = geo_index.feature_collection(buckets[(x, y)], zoom, props, TILE_MAX_FEATURES)
+            yield zoom, x, y, json.dumps(
+                collection, ensure_ascii=False, separators=(",", ":"),
+            ).encode("utf-8")
+
+
+def _fingerprint(lineage: str, points: List[GeoPoint], props) -> str:
+    """Kerroksen sisällön sormenjälki — sama data + asetukset → samat tiilet."""
+    digest = hashlib.sha256(
+        f"{TILE_FORMAT}\0{TILE_MAX_ZOOM}\0{TILE_MAX_FEATURES}\0"
+        f"{geo_index.CLUSTER_MAX_ZOOM}\0{lineage}\0".encode()
+    )
+    for lon, lat, bp, ref in points:
+        digest.update(json.dumps([lon, lat, bp, props(ref)], ensure_ascii=False).encode())
+    return digest.hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------
+# Manifesti
+# ---------------------------------------------------------------------------
+
+def manifest_path(tile_dir: Path = TILE_DIR) -> Path:
+    return Path(tile_dir) / "manifest.json"
+
+
+def load_manifest(tile_dir: Path = TILE_DIR) -> Dict:
+    try:
+        with open(manifest_path(tile_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(tile_dir: Path, manifest: Dict) -> None:
+    path = manifest_path(tile_dir)
+    tmp = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _prune_versions(tile_dir: Path, keep: Dict[str, set]) -> None:
+    """
+    Poistaa kerroshakemistot ja versiot joita `keep` ({kerros: {sormenjälki}})
+    ei mainitse. Kutsutaan vasta uuden manifestin kirjoituksen jälkeen.
+    """
+    for lineage_dir in (d for d in tile_dir.iterdir() if d.is_dir()):
+        for layer_dir in (d for d in lineage_dir.iterdir() if d.is_dir()):
+            versions = keep.get(f"{lineage_dir.name}/{layer_dir.name}")
+            if versions is None:
+                shutil.rmtree(layer_dir, ignore_errors=True)
+                continue
+            for version_dir in layer_dir.iterdir():
+                if version_dir.name not in versions:
+                    shutil.rmtree(version_dir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# Rakentaja
+# ---------------------------------------------------------------------------
+
+def build_pyramid(
+    anno_path: str = aadr_db.DEFAULT_ANNO_PATH,
+    tile_dir: Path = TILE_DIR,
+    lineages: Iterable[str] = LINEAGES,
+    force: bool = False,
+) -> Dict[str, int]:
+    """
+    Rakentaa tai päivittää tiilipyramidin. Kerros kirjoitetaan vain jos sen
+    sormenjälki on muuttunut (tai force=True). Palauttaa tilaston.
+    """
+    tile_dir = Path(tile_dir)
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    previous = load_manifest(tile_dir).get("layers", {})
+    layers: Dict[str, Dict] = {}
+    stats = {"built": 0, "unchanged": 0, "removed": 0, "tiles": 0, "bytes": 0}
+
+    for lineage in lineages:
+        for layer, points in layer_points(lineage, anno_path).items():
+            name = f"{lineage}/{layer_name(layer)}"
+
+            def props(ref, lineage=lineage):
+                return sample_props(ref, lineage, anno_path)
+
+            fingerprint = _fingerprint(lineage, points, props)
+            old = previous.get(name)
+            final = layer_dir(lineage, layer, fingerprint, tile_dir)
+            if not force and old and old.get("fingerprint") == fingerprint and final.is_dir():
+                layers[name] = old
+                stats["unchanged"] += 1
+                continue
+
+            tmp = final.with_name(f"{final.name}.tmp{os.getpid()}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            n_tiles = n_bytes = 0
+            for z, x, y, body in build_tiles(points, props):
+                path = tmp / str(z) / str(x) / f"{y}.json"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(body)
+                n_tiles += 1
+                n_bytes += len(body)
+            # Sama sormenjälki = sama sisältö: olemassa oleva (force) korvataan
+            shutil.rmtree(final, ignore_errors=True)
+            if n_tiles:
+                os.rename(tmp, final)
+            layers[name] = {
+                "clade": layer, "lineage": lineage, "fingerprint": fingerprint,
+                "samples": len(points), "tiles": n_tiles, "bytes": n_bytes,
+                "max_zoom": TILE_MAX_ZOOM,
+            }
+            stats["built"] += 1
+            logger.info(f"Kerros {name}: {len(points)} näytettä → {n_tiles} tiiltä ({n_bytes / 1024:.0f} kt)")
+
+    stats["removed"] = len(set(previous) - set(layers))
+    for meta in layers.values():
+        stats["tiles"] += meta["tiles"]
+        stats["bytes"] += meta["bytes"]
+
+    # Manifesti ensin, siivous vasta sitten: edellisen manifestin versiot
+    # säilyvät yhden ajon ajan, joten ?v=<vanha> osuu yhä omiin tiiliinsä
+    _write_manifest(tile_dir, {
+        "format":       TILE_FORMAT,
+        "aadr_version": aadr_db.get_aadr_version(anno_path),
+        "layers":       layers,
+    })
+    keep: Dict[str, set] = defaultdict(set)
+    for name, meta in list(previous.items()) + list(layers.items()):
+        keep[name].add(meta.get("fingerprint"))
+    _prune_versions(tile_dir, keep)
+    return stats
+
+
+def layer_dir(lineage: str, layer: str, version: str, tile_dir: Path = TILE_DIR) -> Path:
+    """Kerroksen yhden version hakemisto (version = sormenjälki)."""
+    if not _VERSION.match(version or ""):
+        raise ValueError(f"Virheellinen tiiliversio: {version!r}")
+    return Path(tile_dir) / lineage / layer_name(layer) / version
+
+
+def has_version(lineage: str, layer: str, version: str, tile_dir: Path = TILE_DIR) -> bool:
+    """Onko kerroksen versio (vielä) levyllä — myös edellisen rakennuksen versio."""
+    return bool(_VERSION.match(version or "")) and layer_dir(lineage, layer, version, tile_dir).is_dir()
+
+
+def tile_path(lineage: str, layer: str, z: int, x: int, y: int, version: str,
+              tile_dir: Path = TILE_DIR) -> Path:
+    return layer_dir(lineage, layer, version, tile_dir) / str(z) / str(x) / f"{y}.json"
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    path = args[0] if args else aadr_db.DEFAULT_ANNO_PATH
+    result = build_pyramid(path, force="--force" in sys.argv)
+    print(f"Tiilet: {TILE_DIR}")
+    print(f"  rakennettu {result['built']}, ennallaan {result['unchanged']}, poistettu {result['removed']} kerrosta")
+    print(f"  {result['tiles']} tiiltä, {result['bytes'] / 1024:.0f} kt")